@@ -0,0 +1,335 @@
+"""
+Structured application log for Shivam Opticals.
+
+The packaged build runs without a console, so ``print`` output is lost.
+Modules log through the standard ``logging`` package instead::
+    
+    log = logging.getLogger(__name__)
+    log.info("Customer saved", extra={"fields": {"customer_id": 42}})
+
+``setup_logging`` sends every record to:
+
+* ``RingBuffer``, the most recent records in memory for the Tools-tab log
+  viewer. It appends to a bounded ``collections.deque``, which is atomic,
+  so the handler takes no lock; records are only turned into events when
+  the viewer asks for them;
+* ``data/logs/shivam_opticals.log``, one JSON object per line, rotated at
+  about 1 MB with five old files kept;
+* stderr, when there is one.
+
+The file and stderr are written by a listener thread: the logging call only
+puts the record on a queue, so the Tk thread never waits on disk. The
+listener writes whatever has queued up in one go and flushes once the queue
+is empty, rather than once per record.
+
+Run ``python applog.py --bench 5000`` to measure the cost on the save path.
+"""
+import argparse
+import collections
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime
+
+LOG_DIR_NAME = "logs"
+LOG_FILENAME = "shivam_opticals.log"
+MAX_LOG_BYTES = 1024 * 1024
+LOG_BACKUPS = 5
+
+# Events kept in memory for the viewer
+RING_SIZE = 2000
+
+LEVELS = {"Debug": logging.DEBUG, "Info": logging.INFO, "Warning": logging.WARNING, "Error": logging.ERROR}
+
+_ring = None
+_listener = None
+
+
+class RingBuffer(logging.Handler):
+    """The most recent records, kept without locking"""
+    
+    def __init__(self, capacity=RING_SIZE):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+    
+    def handle(self, record):
+        # Skips Handler.handle's lock: deque.append is atomic and drops the
+        # oldest record once the buffer is full
+        if self.filter(record):
+            self.records.append(record)
+            return True
+        return False
+    
+    def emit(self, record):
+        self.records.append(record)
+    
+    def matching(self, min_level=logging.DEBUG, text="", limit=None):
+        """Events at or above min_level containing text, newest first"""
+        text = text.casefold()
+        found = []
+        for record in reversed(list(self.records)):  # list() copies in one step
+            if record.levelno < min_level:
+                continue
+            event = event_from_record(record)
+            if text and text not in event["search"]:
+                continue
+            found.append(event)
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+
+def event_from_record(record):
+    """Structured form of a log record"""
+    message = record.getMessage()
+    fields = getattr(record, "fields", None) or {}
+    exception = None
+    if record.exc_info:
+        exception = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+    return {
+        "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+        "level": record.levelname,
+        "levelno": record.levelno,
+        "logger": record.name,
+        "thread": record.threadName,
+        "message": message,
+        "fields": fields,
+        "exception": exception,
+        # Lower-cased text the viewer filter searches
+        "search": f"{record.name} {message} {fields}".casefold(),
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+    
+    def format(self, record):
+        event = event_from_record(record)
+        del event["levelno"], event["search"]
+        if not event["fields"]:
+            del event["fields"]
+        if event["exception"] is None:
+            del event["exception"]
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable console lines with the structured fields appended"""
+    
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S")
+    
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class RotatingLogFile(logging.Handler):
+    """Log file written in batches, renamed to .1 ... .N as it fills up
+    
+    Used only by the listener thread: emit() buffers the formatted record
+    and flush() writes the batch.
+    """
+    
+    def __init__(self, path, max_bytes=MAX_LOG_BYTES, backups=LOG_BACKUPS):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.stream = None
+        self.size = 0
+        self.pending = []
+    
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+    
+    def flush(self):
+        if not self.pending:
+            return
+        data = "".join(self.pending)
+        self.pending.clear()
+        try:
+            if self.stream is None:
+                self.stream = open(self.path, "a", encoding="utf-8")
+                self.size = self.stream.tell()
+            if self.size and self.size + len(data) > self.max_bytes:
+                self.rotate()
+            self.stream.write(data)
+            self.stream.flush()
+            self.size += len(data)  # Characters, close enough to bytes here
+        except OSError as e:
+            if sys.stderr is not None:
+                sys.stderr.write(f"Could not write log file: {e}\n")
+    
+    def rotate(self):
+        self.stream.close()
+        self.stream = None
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.stream = open(self.path, "a", encoding="utf-8")
+        self.size = 0
+    
+    def close(self):
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        super().close()
+
+
+class _Listener(logging.handlers.QueueListener):
+    """Queue listener that flushes its handlers when the queue runs dry"""
+    
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        for handler in self.handlers:
+            handler.flush()
+        return self.queue.get(block)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, for the listener in this process
+    
+    The message is fixed now (arguments may change later); formatting is
+    left to the listener thread.
+    """
+    
+    def handle(self, record):
+        # SimpleQueue.put is thread-safe, so the handler lock is not needed
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+    
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def get_log_dir():
+    import database
+    return os.path.join(database.DATA_DIR, LOG_DIR_NAME)
+
+
+def setup_logging(log_dir=None, level=logging.INFO, console=True):
+    """Install the ring buffer, rotating file and console handlers; returns the ring buffer
+    
+    Safe to call more than once (later calls return the existing buffer).
+    """
+    global _ring, _listener
+    if _ring is not None:
+        return _ring
+    
+    log_dir = log_dir or get_log_dir()
+    os.makedirs(log_dir, exist_ok=True)
+    
+    file_handler = RotatingLogFile(os.path.join(log_dir, LOG_FILENAME))
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console and sys.stderr is not None:  # None in the windowed build
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(TextFormatter())
+        handlers.append(console_handler)
+    
+    records = queue.SimpleQueue()
+    _listener = _Listener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    
+    _ring = RingBuffer()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_QueueHandler(records))
+    root.addHandler(_ring)
+    
+    # Crashes outside Tk callbacks end up in the log too
+    def log_uncaught(exc_type, exc_value, exc_traceback):
+        logging.getLogger("uncaught").critical(
+            "Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
+    sys.excepthook = log_uncaught
+    threading.excepthook = lambda args: log_uncaught(args.exc_type, args.exc_value, args.exc_traceback)
+    
+    return _ring
+
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    logging.shutdown()
+
+
+def ring_buffer():
+    """The ring buffer installed by setup_logging, or None"""
+    return _ring
+
+
+def benchmark(count=5000):
+    """Time saves with and without an info event per save"""
+    import database
+    
+    log = logging.getLogger("bench")
+    sample = ({"right_sph": "-1.00"}, {"frame_name": "Frame", "lens_name": "Lens",
+                                        "frame_paise": 150000, "lens_paise": 80000})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        setup_logging(os.path.join(temp_dir, "logs"), console=False)
+        conn = database.open_database(os.path.join(temp_dir, "bench.db"))
+        cursor = conn.cursor()
+        
+        def run(logged):
+            start = time.perf_counter()
+            for i in range(count):
+                customer_id = database.insert_customer(
+                    cursor, f"Customer {i}", f"9{i:09d}", "2024-01-01", *sample)
+                conn.commit()
+                if logged:
+                    log.info("Customer saved", extra={"fields": {"customer_id": customer_id}})
+            return (time.perf_counter() - start) / count
+        
+        run(False)  # Warm up
+        plain = run(False)
+        logged = run(True)
+        
+        start = time.perf_counter()
+        for i in range(count):
+            log.info("Customer saved", extra={"fields": {"customer_id": i}})
+        call = (time.perf_counter() - start) / count
+        conn.close()
+        shutdown_logging()
+    
+    print(f"Save without logging: {plain * 1e6:8.1f} us")
+    print(f"Save with logging:    {logged * 1e6:8.1f} us")
+    print(f"Logging call alone:   {call * 1e6:8.1f} us ({call / plain:.1%} of a save)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Application log")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark logging on COUNT saves")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
@@ -0,0 +1,155 @@
+"""
+Hot/cold archive tier for Shivam Opticals.
+
+Customers who have not visited for a long time are moved, with their
+prescriptions and sales, from ``optical_shop.db`` to ``archive.db`` in the
+same directory. The live database then only holds recent customers, so list
+refreshes, searches, backups and VACUUM scale with recent data. The archive is
+attached as schema ``archive`` only when a search asks for it (see
+``database.query_customer_list``) and is backed up once per archive run
+instead of with every scheduled backup.
+
+Rows keep their ids and uuids when they move. Moves are not propagated to
+other branches: archiving is local housekeeping, not a deletion. An archived
+customer who comes back is moved back by ``database.insert_customer`` with
+the new visit, so they keep a single record.
+
+Each batch commits the archive copy and the live delete together, but SQLite
+does not make a transaction spanning WAL databases atomic across a crash, so
+both directions are written to be safely re-run: copies use
+``INSERT OR REPLACE``/``INSERT OR IGNORE`` keyed on the row id.
+"""
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import database
+
+# Customers whose last visit is older than this are archived by default
+DEFAULT_ARCHIVE_DAYS = 730
+
+ARCHIVE_BACKUP_PREFIX = "archive_backup_"
+
+
+def archive_cutoff(days=DEFAULT_ARCHIVE_DAYS, today=None):
+    """ISO date before which customers are archived"""
+    return ((today or date.today()) - timedelta(days=int(days))).isoformat()
+
+
+def archive_counts(conn):
+    """(live customers, archived customers)"""
+    live = conn.execute("SELECT COUNT(*) FROM main.customers").fetchone()[0]
+    archived = 0
+    if database.attach_archive(conn):
+        archived = conn.execute("SELECT COUNT(*) FROM archive.customers").fetchone()[0]
+    return live, archived
+
+
+def last_visit_before_sql():
+    """SQL for ids of live customers whose last visit is before the ? cutoff
+    
+    The last visit is the latest visit_day (the ISO form of the typed date),
+    or the customer's own date for customers without visits. Customers with a
+    date that can't be read are never archived.
+    """
+    return f'''
+        SELECT c.id FROM main.customers c
+        LEFT JOIN (
+            SELECT customer_id, MAX(visit_day) AS last_day,
+                   COUNT(*) - COUNT(visit_day) AS unreadable
+            FROM main.prescriptions
+            GROUP BY customer_id
+        ) v ON v.customer_id = c.id
+        WHERE CASE
+            WHEN v.customer_id IS NULL THEN {database.iso_date_sql("c.date")}
+            WHEN v.unreadable = 0 THEN v.last_day
+        END < ?
+        ORDER BY c.id
+    '''
+
+
+def archive_customers_before(conn, cutoff, job=None, batch_size=1000):
+    """Move customers last seen before cutoff to the archive; returns count
+    
+    conn must be a connection of its own (the move commits per batch).
+    """
+    database.attach_archive(conn, create=True)
+    ids = [row[0] for row in conn.execute(last_visit_before_sql(), (cutoff,))]
+    
+    for start in range(0, len(ids), batch_size):
+        if job:
+            job.check_cancelled()
+            job.report(start / max(len(ids), 1), f"Archiving customers ({start}/{len(ids)})")
+        _move_customers(conn, ids[start:start + batch_size], "main", "archive", "OR REPLACE")
+    
+    if job:
+        job.report(1.0, f"Archived {len(ids)} customers")
+    return len(ids)
+
+
+def restore_customers(conn, customer_ids):
+    """Move archived customers back to the live database; returns count"""
+    if not customer_ids or not database.attach_archive(conn):
+        return 0
+    placeholders = ", ".join("?" for _ in customer_ids)
+    ids = [row[0] for row in conn.execute(
+        f"SELECT id FROM archive.customers WHERE id IN ({placeholders})", list(customer_ids)
+    )]
+    if ids:
+        _move_customers(conn, ids, "archive", "main", "OR IGNORE")
+    return len(ids)
+
+
+def drop_live_customers(conn):
+    """Delete archived copies of customers that are in the live database; returns count
+    
+    Restoring a backup made before an archive run brings the customers
+    archived since back into the live database; their live rows are kept.
+    """
+    if not database.attach_archive(conn):
+        return 0
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Visits go with the customer by cascade
+        cursor.execute("DELETE FROM archive.customers WHERE id IN (SELECT id FROM main.customers)")
+        count = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+
+def _move_customers(conn, ids, source, target, conflict):
+    """Move customers and their visits from source to target in one transaction"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        database.move_customers(cursor, ids, source, target, conflict)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def backup_archive(conn, backup_dir=None, max_backups=3):
+    """Copy the archive with the online backup API; returns the backup path"""
+    if not database.attach_archive(conn):
+        return None
+    backup_dir = backup_dir or database.BACKUP_DIR
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_path = os.path.join(backup_dir, f"{ARCHIVE_BACKUP_PREFIX}{timestamp}.db")
+    
+    target = sqlite3.connect(backup_path)
+    try:
+        conn.backup(target, name="archive")
+    finally:
+        target.close()
+    
+    # Keep only the most recent archive backups
+    backups = sorted((f for f in os.listdir(backup_dir)
+                      if f.startswith(ARCHIVE_BACKUP_PREFIX) and f.endswith(".db")), reverse=True)
+    for old_file in backups[max_backups:]:
+        os.remove(os.path.join(backup_dir, old_file))
+    return backup_path
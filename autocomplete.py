@@ -0,0 +1,458 @@
+"""
+Autocomplete for the Add Customer form.
+
+Distinct ``products.frame_name`` / ``lens_name`` values are kept in an
+in-memory prefix trie, weighted by how many sales used them. Each trie node
+caches its most frequent completions, so a keystroke costs a walk down the
+typed prefix; caches of the first few levels are filled when the trie is
+built (in a background job at startup). New names and new uses of existing
+names are added after each save, updating the cached lists in place.
+
+Returning customers are suggested on the name and phone fields from
+indexed prefix queries (``database.suggest_customers``) run by
+``CustomerSuggester`` on a background reader once typing pauses; picking
+one can prefill the form from their latest visit.
+
+``AutocompleteDropdown`` attaches a suggestion list to an existing entry;
+``DebouncedDropdown`` does the same for lookups that run off the Tk thread.
+
+Run ``python autocomplete.py --bench 50000`` to time name build and lookups,
+``--bench-customers 500000`` to time customer lookups.
+"""
+import argparse
+import heapq
+import logging
+import os
+import random
+import tempfile
+import time
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+log = logging.getLogger(__name__)
+
+PRODUCT_NAME_FIELDS = ("frame_name", "lens_name")
+
+# Completions cached per node and shown in the dropdown
+MAX_SUGGESTIONS = 8
+
+# Node caches filled at build time (deeper subtrees are small enough to
+# search on the first keystroke that reaches them)
+PRECOMPUTE_DEPTH = 4
+
+
+def name_key(name):
+    """Lookup key: case-insensitive, surrounding spaces ignored"""
+    return " ".join(name.split()).casefold()
+
+
+class Completion:
+    """A stored name and the number of sales that used it"""
+    
+    __slots__ = ("name", "count")
+    
+    def __init__(self, name, count):
+        self.name = name
+        self.count = count
+
+
+class TrieNode:
+    __slots__ = ("children", "completion", "best")
+    
+    def __init__(self):
+        self.children = {}
+        self.completion = None  # Set when a stored name ends here
+        self.best = None  # Cached most frequent completions below, or None
+
+
+def _rank(completion):
+    return (-completion.count, completion.name.casefold())
+
+
+class PrefixTrie:
+    """Names weighted by use, completed by prefix"""
+    
+    def __init__(self, counts=()):
+        self.root = TrieNode()
+        self.size = 0
+        # Lookups answered from a node's cached list, and ones that searched
+        self.hits = 0
+        self.misses = 0
+        for name, count in counts:
+            self.add(name, count, update_cache=False)
+    
+    def add(self, name, count=1, update_cache=True):
+        """Add uses of a name (a new name if it was not stored yet)"""
+        key = name_key(name or "")
+        if not key:
+            return
+        path = [self.root]
+        node = self.root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = TrieNode()
+            node = child
+            path.append(node)
+        
+        if node.completion is None:
+            node.completion = Completion(" ".join(name.split()), 0)
+            self.size += 1
+        completion = node.completion
+        completion.count += count
+        
+        if not update_cache:
+            return
+        # Counts only grow, so each cached list just has to admit or
+        # re-rank this one completion
+        for node in path:
+            best = node.best
+            if best is None:
+                continue
+            if completion not in best:
+                if len(best) >= MAX_SUGGESTIONS and _rank(completion) >= _rank(best[-1]):
+                    continue
+                best.append(completion)
+            best.sort(key=_rank)
+            del best[MAX_SUGGESTIONS:]
+    
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """Most used names starting with prefix"""
+        node = self.root
+        for char in name_key(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if node.best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return [completion.name for completion in self._best(node)[:limit]]
+    
+    def _best(self, node):
+        if node.best is None:
+            node.best = heapq.nsmallest(MAX_SUGGESTIONS, self._completions(node), key=_rank)
+        return node.best
+    
+    @staticmethod
+    def _completions(node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.completion is not None:
+                yield node.completion
+            stack.extend(node.children.values())
+    
+    def precompute(self, depth=PRECOMPUTE_DEPTH):
+        """Fill the caches of the first levels, children before parents"""
+        def fill(node, level):
+            if level < depth:
+                merged = [node.completion] if node.completion is not None else []
+                for child in node.children.values():
+                    merged.extend(fill(child, level + 1))
+                node.best = heapq.nsmallest(MAX_SUGGESTIONS, merged, key=_rank)
+            return self._best(node)
+        fill(self.root, 0)
+    
+    def __len__(self):
+        return self.size
+
+
+def product_name_counts(cursor, field):
+    """(name, sales) for every distinct frame or lens name"""
+    if field not in PRODUCT_NAME_FIELDS:
+        raise ValueError(f"Unknown product name field: {field}")
+    cursor.execute(f'''
+        SELECT {field}, COUNT(*) FROM products
+        WHERE {field} IS NOT NULL AND TRIM({field}) != ''
+        GROUP BY {field}
+    ''')
+    return cursor.fetchall()
+
+
+def build_tries(counts_by_field):
+    """{field: PrefixTrie} from {field: [(name, count), ...]}"""
+    tries = {}
+    for field, counts in counts_by_field.items():
+        trie = PrefixTrie(counts)
+        trie.precompute()
+        tries[field] = trie
+    return tries
+
+
+class AutocompleteDropdown:
+    """Suggestion list shown under an entry while typing
+    
+    ``source`` is called with the entry text and returns suggestions, shown
+    as ``label(suggestion)``. Up/Down move through the list, Return or Tab
+    accepts, Escape closes. Accepting puts the label in the entry, or calls
+    ``on_accept(suggestion)`` when given.
+    """
+    
+    def __init__(self, entry, source, font=None, label=str, on_accept=None):
+        self.entry = entry
+        self.source = source
+        self.font = font
+        self.label = label
+        self.on_accept = on_accept
+        self.suggestions = []
+        self.popup = None
+        self.listbox = None
+        
+        entry.bind("<KeyRelease>", self.on_key_release, add="+")
+        entry.bind("<Down>", lambda event: self.move(1))
+        entry.bind("<Up>", lambda event: self.move(-1))
+        entry.bind("<Return>", self.accept, add="+")
+        entry.bind("<Tab>", self.accept, add="+")
+        entry.bind("<Escape>", lambda event: self.hide())
+        entry.bind("<FocusOut>", lambda event: entry.after(150, self.hide), add="+")
+    
+    def on_key_release(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Tab", "Escape"):
+            return
+        text = self.entry.get()
+        self.present(text, self.source(text) if text.strip() else [])
+    
+    def present(self, text, suggestions):
+        """Show suggestions for text (hidden when there are none)"""
+        # Nothing to add when the only suggestion is what was typed
+        if len(suggestions) == 1 and name_key(self.label(suggestions[0])) == name_key(text):
+            suggestions = []
+        if suggestions:
+            self.show(suggestions)
+        else:
+            self.hide()
+    
+    def show(self, suggestions):
+        if self.popup is None:
+            self.popup = tk.Toplevel(self.entry)
+            self.popup.wm_overrideredirect(True)
+            self.listbox = tk.Listbox(self.popup, activestyle="none", exportselection=False,
+                                      font=self.font, relief="solid", borderwidth=1)
+            self.listbox.pack(fill="both", expand=True)
+            self.listbox.bind("<ButtonRelease-1>", self.accept)
+        
+        self.suggestions = list(suggestions)
+        self.listbox.delete(0, tk.END)
+        for suggestion in self.suggestions:
+            self.listbox.insert(tk.END, self.label(suggestion))
+        self.listbox.configure(height=len(self.suggestions))
+        
+        x = self.entry.winfo_rootx()
+        y = self.entry.winfo_rooty() + self.entry.winfo_height()
+        self.popup.geometry(f"{self.entry.winfo_width()}x{self.listbox.winfo_reqheight()}+{x}+{y}")
+        self.popup.deiconify()
+        self.popup.lift()
+    
+    def hide(self):
+        if self.popup is not None:
+            self.popup.withdraw()
+    
+    def visible(self):
+        return self.popup is not None and self.popup.winfo_viewable()
+    
+    def move(self, step):
+        if not self.visible():
+            return None
+        selection = self.listbox.curselection()
+        index = (selection[0] + step) if selection else (0 if step > 0 else self.listbox.size() - 1)
+        index = max(0, min(index, self.listbox.size() - 1))
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        return "break"
+    
+    def accept(self, event=None):
+        """Use the selected suggestion"""
+        if not self.visible():
+            return None
+        selection = self.listbox.curselection()
+        self.hide()
+        if not selection:
+            return None
+        suggestion = self.suggestions[selection[0]]
+        if self.on_accept:
+            self.on_accept(suggestion)
+        else:
+            self.entry.delete(0, tk.END)
+            self.entry.insert(0, self.label(suggestion))
+            self.entry.icursor(tk.END)
+        return "break"
+
+
+class DebouncedDropdown(AutocompleteDropdown):
+    """Dropdown whose suggestions are looked up off the Tk thread
+    
+    ``lookup(text, deliver)`` starts a lookup and later calls
+    ``deliver(suggestions)`` on the Tk thread. A lookup starts only once
+    typing pauses for ``delay`` ms, and answers for text that has since
+    changed are dropped, so typing never waits for the database.
+    """
+    
+    def __init__(self, entry, lookup, delay=150, **options):
+        super().__init__(entry, None, **options)
+        self.lookup = lookup
+        self.delay = delay
+        self.pending = None
+        self.generation = 0
+    
+    def on_key_release(self, event):
+        if event.keysym in ("Up", "Down", "Return", "Tab", "Escape"):
+            return
+        if self.pending is not None:
+            self.entry.after_cancel(self.pending)
+        self.generation += 1
+        self.pending = self.entry.after(self.delay, self.start_lookup, self.generation)
+    
+    def start_lookup(self, generation):
+        self.pending = None
+        text = self.entry.get()
+        if not text.strip():
+            self.hide()
+            return
+        
+        def deliver(suggestions):
+            if generation == self.generation and self.entry.get() == text:
+                self.present(text, suggestions)
+        self.lookup(text, deliver)
+
+
+class CustomerSuggester:
+    """Looks up returning customers on a background reader
+    
+    One worker thread with its own read-only connection (or the LAN client
+    in thin-client mode) answers lookups in order; lookups overtaken by a
+    newer one are skipped. Results are handed back through ``call_in_ui``.
+    """
+    
+    def __init__(self, call_in_ui, db_path=None, client=None):
+        self.call_in_ui = call_in_ui
+        self.db_path = db_path
+        self.client = client
+        self.conn = None
+        self.latest = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="CustomerSuggest")
+    
+    def suggest(self, text, deliver):
+        """Call deliver(rows) on the Tk thread with database.suggest_customers rows"""
+        self.latest += 1
+        self._submit(deliver, self._suggest, self.latest, text)
+    
+    def detail(self, customer_id, deliver):
+        """Call deliver(customer) on the Tk thread with the full record"""
+        self._submit(deliver, self._detail, customer_id)
+    
+    def _submit(self, deliver, func, *args):
+        def done(future):
+            try:
+                result = future.result()
+            except Exception:
+                log.exception("Customer lookup failed")
+                return
+            if result is not None:
+                self.call_in_ui(deliver, result)
+        self.executor.submit(func, *args).add_done_callback(done)
+    
+    def _cursor(self):
+        if self.conn is None:
+            self.conn = database.connect_readonly(self.db_path)
+        return self.conn.cursor()
+    
+    def _suggest(self, sequence, text):
+        if sequence != self.latest:
+            return None  # A newer lookup is queued
+        if self.client:
+            return self.client.suggest_customers(text)
+        return database.suggest_customers(self._cursor(), text)
+    
+    def _detail(self, customer_id):
+        if self.client:
+            return self.client.customer_detail(customer_id)
+        return database.query_customer_detail(self._cursor(), customer_id)
+    
+    def close(self):
+        def close_connection():
+            if self.conn is not None:
+                self.conn.close()
+        self.executor.submit(close_connection)
+        self.executor.shutdown(wait=True)
+
+
+def customer_label(row):
+    """Dropdown text for a suggest_customers row"""
+    _, name, phone, visit_date = row
+    return " - ".join(part for part in (name, phone, visit_date and f"last visit {visit_date}") if part)
+
+
+def benchmark(count=50000):
+    """Build a trie of count distinct names and time lookups"""
+    rng = random.Random(3)
+    brands = ["Ray-Ban", "Titan", "Fastrack", "Lenskart", "Vincent Chase", "Oakley", "Carrera",
+              "Tommy Hilfiger", "Police", "Vogue", "John Jacobs", "Idee"]
+    styles = ["Aviator", "Wayfarer", "Round", "Square", "Cat Eye", "Rimless", "Half Rim", "Clubmaster"]
+    names = {f"{rng.choice(brands)} {rng.choice(styles)} {rng.randrange(10 ** 5):05d}" for _ in range(count * 2)}
+    counts = [(name, rng.randrange(1, 50)) for name in list(names)[:count]]
+    
+    start = time.perf_counter()
+    trie = build_tries({"frame_name": counts})["frame_name"]
+    print(f"Build: {len(trie)} names in {time.perf_counter() - start:.2f}s")
+    
+    # Typing "Vincent Chase Round 0" one keystroke at a time
+    word = "Vincent Chase Round 0"
+    worst = 0
+    for length in range(1, len(word) + 1):
+        start = time.perf_counter()
+        trie.suggest(word[:length])
+        worst = max(worst, time.perf_counter() - start)
+    print(f"Slowest keystroke (first lookup): {worst * 1000:.2f} ms")
+    
+    rounds = 1000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        trie.add(rng.choice(counts)[0])
+        trie.suggest(rng.choice(brands)[:2])
+    print(f"Save + lookup: {(time.perf_counter() - start) * 1000 / rounds:.3f} ms average")
+
+
+def benchmark_customers(count=500000):
+    """Time name and phone lookups as typed, with count customers"""
+    rng = random.Random(5)
+    first = ["Amit", "Anita", "Deepak", "Kavita", "Manoj", "Neha", "Priya", "Rahul", "Sunita", "Vijay"]
+    last = ["Sharma", "Kumar", "Verma", "Gupta", "Singh", "Patel", "Reddy", "Iyer", "Das", "Khan"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        conn.executemany(
+            "INSERT INTO customers (name, phone, date) VALUES (?, ?, ?)",
+            ((f"{rng.choice(first)} {rng.choice(last)} {i}", f"9{rng.randrange(10 ** 9):09d}",
+              f"20{rng.randrange(15, 25)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}")
+             for i in range(count)))
+        conn.commit()
+        conn.close()
+        
+        conn = database.connect_readonly(path)
+        cursor = conn.cursor()
+        for typed in ("Priya Sharma 12", "98765 43210"):
+            worst = 0
+            for length in range(1, len(typed) + 1):
+                start = time.perf_counter()
+                database.suggest_customers(cursor, typed[:length])
+                worst = max(worst, time.perf_counter() - start)
+            print(f"{count} customers, typing {typed!r}: slowest keystroke {worst * 1000:.2f} ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Form autocomplete")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT distinct names")
+    parser.add_argument("--bench-customers", type=int, metavar="COUNT",
+                        help="Benchmark customer lookups with COUNT customers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    elif args.bench_customers:
+        benchmark_customers(args.bench_customers)
+    else:
+        parser.print_help()
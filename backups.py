@@ -0,0 +1,203 @@
+"""
+Backup verification and online restore for Shivam Opticals.
+
+Backups are the ``optical_shop_backup_*.db`` copies made by the app every two
+hours (plus the safety copies taken before a restore). Each one can be
+checked with ``PRAGMA quick_check``; checks run in a process pool so several
+backups are verified in parallel without slowing the window down.
+
+A restore copies a backup page by page into the live database through the
+SQLite online backup API. Other connections (the window, the write queue,
+the LAN server) stay open and see the restored data on their next query, so
+the app does not need to be restarted. The current database is copied to a
+``pre_restore_*.db`` file first (and the archive to an ``archive_backup_*.db``
+file), so a restore can itself be undone.
+
+Scheduled backups do not include ``archive.db``. A backup made before an
+archive run still holds the customers archived since, so after a restore the
+archive copies of customers that are live again are dropped; each customer
+ends up in exactly one of the two databases.
+
+Run ``python backups.py --bench 1024`` to time restoring a 1 GB database.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import archive
+import database
+
+BACKUP_PREFIXES = ("optical_shop_backup_", "pre_restore_")
+PRE_RESTORE_PREFIX = "pre_restore_"
+MAX_PRE_RESTORE_BACKUPS = 3
+
+# Pages copied per backup step (64 MB with 4 KB pages); progress is
+# reported between steps
+RESTORE_STEP_PAGES = 16384
+
+COUNTED_TABLES = ("customers", "prescriptions", "products")
+
+
+def list_backups(backup_dir=None):
+    """Backup files, newest first, as dicts with path, name, size and created"""
+    backup_dir = backup_dir or database.BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        if not (name.startswith(BACKUP_PREFIXES) and name.endswith(".db")):
+            continue
+        path = os.path.join(backup_dir, name)
+        stat = os.stat(path)
+        backups.append({
+            "path": path,
+            "name": name,
+            "size": stat.st_size,
+            "created": datetime.fromtimestamp(stat.st_mtime),
+        })
+    backups.sort(key=lambda backup: backup["created"], reverse=True)
+    return backups
+
+
+def count_rows(path):
+    """{table: row count} of a backup, or None if it cannot be read"""
+    try:
+        conn = database.connect_readonly(path, immutable=True)
+    except sqlite3.Error:
+        return None
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in COUNTED_TABLES}
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def verify_backup(path):
+    """(path, ok, message) from PRAGMA quick_check on a backup"""
+    try:
+        conn = database.connect_readonly(path, immutable=True)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA quick_check")]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return path, False, str(e)
+    if problems == ["ok"]:
+        return path, True, "ok"
+    return path, False, "; ".join(problems[:3])
+
+
+def verify_backups(paths, workers=None, job=None):
+    """Check several backups in parallel; returns verify_backup() results in order"""
+    workers = min(workers or os.cpu_count() or 1, max(len(paths), 1))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(verify_backup, paths):
+            results.append(result)
+            if job:
+                job.check_cancelled()
+                job.report(len(results) / len(paths), f"Verified {len(results)} of {len(paths)} backups")
+    return results
+
+
+def copy_database(source, target, job=None, message="Copying"):
+    """Copy one open connection's database into another with the backup API"""
+    def progress(status, remaining, total):
+        if job:
+            job.report((total - remaining) / max(total, 1), f"{message} ({total - remaining}/{total} pages)")
+    source.backup(target, pages=RESTORE_STEP_PAGES, progress=progress)
+
+
+def save_pre_restore_copy(db_path=None, backup_dir=None):
+    """Copy the live database (and archive) aside before a restore; returns the path"""
+    backup_dir = backup_dir or database.BACKUP_DIR
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(backup_dir, f"{PRE_RESTORE_PREFIX}{timestamp}.db")
+    
+    live = database.connect(db_path)
+    target = sqlite3.connect(path)
+    try:
+        live.backup(target)
+        archive.backup_archive(live, backup_dir)
+    finally:
+        target.close()
+        live.close()
+    
+    # Keep only the most recent safety copies
+    copies = sorted((name for name in os.listdir(backup_dir)
+                     if name.startswith(PRE_RESTORE_PREFIX) and name.endswith(".db")), reverse=True)
+    for old_file in copies[MAX_PRE_RESTORE_BACKUPS:]:
+        os.remove(os.path.join(backup_dir, old_file))
+    return path
+
+
+def restore_backup(backup_path, db_path=None, job=None):
+    """Replace the live database's contents with a backup, online
+    
+    The backup is verified first. Older backups are brought up to the
+    current schema afterwards, and customers the backup holds are dropped
+    from the archive. Writers on the database should be paused meanwhile.
+    """
+    _, ok, message = verify_backup(backup_path)
+    if not ok:
+        raise ValueError(f"Backup failed verification: {message}")
+    
+    source = database.connect_readonly(backup_path, immutable=True)
+    target = database.connect(db_path)
+    try:
+        copy_database(source, target, job, "Restoring")
+        if job:
+            job.report(1.0, "Updating schema")
+        database.create_schema(target.cursor())
+        target.commit()
+        archive.drop_live_customers(target)
+        target.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        source.close()
+        target.close()
+
+
+def benchmark(size_mb=1024):
+    """Time verifying and restoring a database of about size_mb megabytes"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        backup_path = os.path.join(temp_dir, "optical_shop_backup_bench.db")
+        conn = database.open_database(backup_path)
+        conn.execute("CREATE TABLE filler (data BLOB)")
+        conn.executemany("INSERT INTO filler (data) VALUES (randomblob(?))",
+                         [(1024 * 1024,)] * size_mb)
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        
+        live_path = os.path.join(temp_dir, "optical_shop.db")
+        database.open_database(live_path).close()
+        
+        start = time.perf_counter()
+        print(f"quick_check: {verify_backup(backup_path)[2]} in {time.perf_counter() - start:.2f}s")
+        
+        start = time.perf_counter()
+        restore_backup(backup_path, live_path)
+        print(f"Restore of {os.path.getsize(backup_path) / 2 ** 20:.0f} MB: "
+              f"{time.perf_counter() - start:.2f}s (including verification)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backup verification and restore")
+    parser.add_argument("--bench", type=int, metavar="MB", help="Benchmark with a database of MB megabytes")
+    parser.add_argument("--verify", action="store_true", help="Verify every backup in the backup folder")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    elif args.verify:
+        found = list_backups()
+        for path, ok, message in verify_backups([backup["path"] for backup in found]):
+            print(f"{'OK  ' if ok else 'FAIL'} {os.path.basename(path)}: {message}")
+    else:
+        parser.print_help()
@@ -0,0 +1,425 @@
+"""
+Offline multi-branch synchronisation for Shivam Opticals.
+
+Every store keeps its own ``data/optical_shop.db``. Triggers on the synced
+tables record inserts, updates and deletes in ``change_log``; rows carry a
+globally unique ``uuid`` so they can be matched across branches. Changes are
+exported to compact gzip-compressed change-set files (USB stick or shared
+folder) and imported at another branch in a single batched transaction.
+Imports are idempotent and conflicts are resolved by ``updated_at``.
+"""
+import gzip
+import json
+import os
+import platform
+import uuid
+from datetime import datetime
+
+from money import to_paise
+
+# Synced tables in parent-first order, with foreign keys that must be
+# translated to the parent's uuid when rows travel between branches
+SYNC_TABLES = [
+    ("customers", {}),
+    ("prescriptions", {"customer_id": "customers"}),
+    ("products", {"customer_id": "customers", "prescription_id": "prescriptions"}),
+]
+
+CHANGESET_FORMAT = "shivam-opticals-changeset"
+CHANGESET_VERSION = 2  # 2: product costs in whole paise
+
+# Version 1 product costs (float rupees) and the paise columns they fill
+LEGACY_COST_COLUMNS = {"frame_cost": "frame_paise", "lens_cost": "lens_paise"}
+
+# Stands in for a foreign key whose parent row is unknown at this branch
+MISSING_PARENT = object()
+
+# SQL expression producing a random 128-bit identifier
+NEW_UUID_SQL = "lower(hex(randomblob(16)))"
+
+
+def install_change_capture(cursor):
+    """Create the change log, row identifiers and capture triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_uuid TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Key/value settings: branch identity and export position
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # Change sets already applied, so importing a file twice is a no-op
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_applied (
+            changeset_id TEXT PRIMARY KEY,
+            branch_id TEXT,
+            branch_name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            row_count INTEGER
+        )
+    ''')
+    
+    # While a row exists here the capture triggers stay silent (used when
+    # applying another branch's changes so they are not exported again)
+    cursor.execute('CREATE TABLE IF NOT EXISTS sync_guard (active INTEGER)')
+    
+    cursor.execute(
+        "INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('branch_id', ?)",
+        (uuid.uuid4().hex,)
+    )
+    cursor.execute(
+        "INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('branch_name', ?)",
+        (platform_node_name(),)
+    )
+    cursor.execute(
+        "INSERT OR IGNORE INTO sync_meta (key, value) VALUES ('last_export_seq', '0')"
+    )
+    
+    for table, _ in SYNC_TABLES:
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        
+        # Globally unique row identifier
+        if "uuid" not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN uuid TEXT")
+        cursor.execute(f"UPDATE {table} SET uuid = {NEW_UUID_SQL} WHERE uuid IS NULL")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_uuid ON {table}(uuid)")
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capture_{table}_insert
+            AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET uuid = {NEW_UUID_SQL}
+                WHERE id = NEW.id AND NEW.uuid IS NULL;
+                INSERT INTO change_log (table_name, row_uuid, op)
+                SELECT '{table}', uuid, 'U' FROM {table}
+                WHERE id = NEW.id AND NOT EXISTS (SELECT 1 FROM sync_guard);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capture_{table}_update
+            AFTER UPDATE ON {table}
+            WHEN OLD.uuid IS NOT NULL AND NOT EXISTS (SELECT 1 FROM sync_guard)
+            BEGIN
+                INSERT INTO change_log (table_name, row_uuid, op)
+                VALUES ('{table}', NEW.uuid, 'U');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS capture_{table}_delete
+            AFTER DELETE ON {table}
+            WHEN OLD.uuid IS NOT NULL AND NOT EXISTS (SELECT 1 FROM sync_guard)
+            BEGIN
+                INSERT INTO change_log (table_name, row_uuid, op)
+                VALUES ('{table}', OLD.uuid, 'D');
+            END
+        ''')
+
+
+def platform_node_name():
+    """Default branch name: the computer name"""
+    return platform.node() or "branch"
+
+
+class BranchSync:
+    """Export and import change-set files for one branch database"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM sync_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+    
+    @property
+    def branch_id(self):
+        return self.get_meta("branch_id")
+    
+    @property
+    def branch_name(self):
+        return self.get_meta("branch_name")
+    
+    def pending_changes(self):
+        """Number of changed rows not yet exported"""
+        since = int(self.get_meta("last_export_seq", "0"))
+        return self.conn.execute(
+            "SELECT COUNT(DISTINCT table_name || row_uuid) FROM change_log WHERE seq > ?", (since,)
+        ).fetchone()[0]
+    
+    def export_changes(self, path, since_seq=None, job=None):
+        """Write changes logged after since_seq to a compressed change-set file
+        
+        By default exports everything since the last export. The export
+        position only advances once the file has been written.
+        """
+        if since_seq is None:
+            since_seq = int(self.get_meta("last_export_seq", "0"))
+        
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN")  # Consistent view of log and rows
+        try:
+            to_seq = cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+            
+            tables = {}
+            total = 0
+            for index, (table, foreign_keys) in enumerate(SYNC_TABLES):
+                if job:
+                    job.check_cancelled()
+                    job.report(index / len(SYNC_TABLES), f"Collecting {table}")
+                data = self._collect_table(cursor, table, foreign_keys, since_seq, to_seq)
+                total += len(data["upserts"]) + len(data["deletes"])
+                tables[table] = data
+        finally:
+            cursor.execute("COMMIT")
+        
+        changeset = {
+            "format": CHANGESET_FORMAT,
+            "version": CHANGESET_VERSION,
+            "changeset_id": uuid.uuid4().hex,
+            "branch_id": self.branch_id,
+            "branch_name": self.branch_name,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "from_seq": since_seq,
+            "to_seq": to_seq,
+            "tables": tables,
+        }
+        
+        # Write to a temporary file first so a half-written file is never left behind
+        temp_path = path + ".part"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as out:
+            json.dump(changeset, out, separators=(",", ":"))
+        os.replace(temp_path, path)
+        
+        self.set_meta("last_export_seq", to_seq)
+        self.conn.commit()
+        return total
+    
+    def _collect_table(self, cursor, table, foreign_keys, since_seq, to_seq):
+        """Gather the latest state of every row of table changed in the range"""
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")
+                   if row[1] != "id"]
+        
+        # Foreign keys travel as the parent's uuid
+        select_list = []
+        for column in columns:
+            if column in foreign_keys:
+                parent = foreign_keys[column]
+                select_list.append(f"(SELECT uuid FROM {parent} WHERE id = t.{column})")
+            else:
+                select_list.append(f"t.{column}")
+        
+        # Only the most recent operation per row matters
+        changed = '''
+            SELECT row_uuid, op, changed_at FROM change_log
+            WHERE seq IN (
+                SELECT MAX(seq) FROM change_log
+                WHERE table_name = ? AND seq > ? AND seq <= ?
+                GROUP BY row_uuid
+            )
+        '''
+        upserts = cursor.execute(f'''
+            SELECT {", ".join(select_list)}
+            FROM ({changed}) c
+            JOIN {table} t ON t.uuid = c.row_uuid
+            WHERE c.op = 'U'
+        ''', (table, since_seq, to_seq)).fetchall()
+        
+        deletes = cursor.execute(f'''
+            SELECT c.row_uuid, c.changed_at FROM ({changed}) c
+            WHERE c.op = 'D'
+        ''', (table, since_seq, to_seq)).fetchall()
+        
+        return {
+            "columns": columns,
+            "upserts": [list(row) for row in upserts],
+            "deletes": [list(row) for row in deletes],
+        }
+    
+    def import_changes(self, path, job=None):
+        """Apply a change-set file; returns a summary dictionary
+        
+        Applying the same file twice has no effect. A row is only overwritten
+        when the incoming version has a newer ``updated_at``.
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as source:
+            changeset = json.load(source)
+        
+        if changeset.get("format") != CHANGESET_FORMAT:
+            raise ValueError("Not a Shivam Opticals change-set file")
+        if changeset.get("version", 0) > CHANGESET_VERSION:
+            raise ValueError("Change-set was written by a newer version of the application")
+        
+        summary = {"branch": changeset.get("branch_name"), "inserted": 0, "updated": 0,
+                   "deleted": 0, "skipped": 0, "already_applied": False}
+        
+        if changeset.get("branch_id") == self.branch_id:
+            raise ValueError("This change-set was exported from this branch")
+        
+        applied = self.conn.execute(
+            "SELECT 1 FROM sync_applied WHERE changeset_id = ?", (changeset["changeset_id"],)
+        ).fetchone()
+        if applied:
+            summary["already_applied"] = True
+            return summary
+        
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Keep the capture triggers quiet while applying foreign changes
+            cursor.execute("INSERT INTO sync_guard (active) VALUES (1)")
+            
+            tables = changeset.get("tables", {})
+            
+            # Parents first for inserts/updates, children first for deletes
+            for index, (table, foreign_keys) in enumerate(SYNC_TABLES):
+                if job:
+                    job.check_cancelled()
+                    job.report(index / (2 * len(SYNC_TABLES)), f"Applying {table}")
+                if table in tables:
+                    self._apply_upserts(cursor, table, foreign_keys, tables[table], summary)
+            
+            for table, _ in reversed(SYNC_TABLES):
+                if table in tables:
+                    self._apply_deletes(cursor, table, tables[table], summary)
+            
+            cursor.execute("DELETE FROM sync_guard")
+            cursor.execute(
+                '''INSERT INTO sync_applied (changeset_id, branch_id, branch_name, row_count)
+                   VALUES (?, ?, ?, ?)''',
+                (changeset["changeset_id"], changeset.get("branch_id"),
+                 changeset.get("branch_name"),
+                 summary["inserted"] + summary["updated"] + summary["deleted"])
+            )
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        
+        return summary
+    
+    def _local_rows(self, cursor, table, uuids):
+        """Map uuid -> (id, updated_at) for the given uuids in one query"""
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS sync_incoming (uuid TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM sync_incoming")
+        cursor.executemany("INSERT OR IGNORE INTO sync_incoming (uuid) VALUES (?)",
+                           ((value,) for value in uuids))
+        rows = cursor.execute(f'''
+            SELECT t.uuid, t.id, t.updated_at
+            FROM sync_incoming i JOIN {table} t ON t.uuid = i.uuid
+        ''').fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+    
+    def _apply_upserts(self, cursor, table, foreign_keys, data, summary):
+        """Insert new rows and update older local copies in batches"""
+        data = upgrade_legacy_costs(table, data)
+        incoming_columns = data["columns"]
+        local_columns = set(row[1] for row in cursor.execute(f"PRAGMA table_info({table})"))
+        
+        # Only columns both sides know about; uuid is required
+        keep = [i for i, column in enumerate(incoming_columns) if column in local_columns]
+        columns = [incoming_columns[i] for i in keep]
+        if "uuid" not in columns:
+            return
+        uuid_index = columns.index("uuid")
+        updated_index = columns.index("updated_at") if "updated_at" in columns else None
+        
+        rows = [[row[i] for i in keep] for row in data["upserts"]]
+        if not rows:
+            return
+        
+        # Translate parent uuids back to local ids
+        for column, parent in foreign_keys.items():
+            if column not in columns:
+                continue
+            position = columns.index(column)
+            parent_ids = self._local_rows(cursor, parent, [row[position] for row in rows])
+            for row in rows:
+                if row[position] is None:
+                    continue  # No parent at the source either
+                parent_row = parent_ids.get(row[position])
+                row[position] = parent_row[0] if parent_row else MISSING_PARENT
+        
+        existing = self._local_rows(cursor, table, [row[uuid_index] for row in rows])
+        
+        inserts = []
+        updates = []
+        for row in rows:
+            local = existing.get(row[uuid_index])
+            if any(row[columns.index(column)] is MISSING_PARENT
+                   for column in foreign_keys if column in columns):
+                summary["skipped"] += 1  # Parent is unknown here
+            elif local is None:
+                inserts.append(row)
+            elif updated_index is not None and (row[updated_index] or "") > (local[1] or ""):
+                updates.append(row + [local[0]])
+            else:
+                summary["skipped"] += 1  # Local copy is as new or newer
+        
+        if inserts:
+            placeholders = ", ".join("?" for _ in columns)
+            cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", inserts
+            )
+            summary["inserted"] += len(inserts)
+        
+        if updates:
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", updates)
+            summary["updated"] += len(updates)
+    
+    def _apply_deletes(self, cursor, table, data, summary):
+        """Delete rows removed at the other branch unless changed here since"""
+        deletes = data.get("deletes", [])
+        if not deletes:
+            return
+        
+        existing = self._local_rows(cursor, table, [row[0] for row in deletes])
+        doomed = []
+        for row_uuid, deleted_at in deletes:
+            local = existing.get(row_uuid)
+            if local is None:
+                continue
+            if (local[1] or "") <= (deleted_at or ""):
+                doomed.append((local[0],))
+            else:
+                summary["skipped"] += 1
+        
+        if doomed:
+            cursor.executemany(f"DELETE FROM {table} WHERE id = ?", doomed)
+            summary["deleted"] += len(doomed)
+
+
+def upgrade_legacy_costs(table, data):
+    """Convert a version 1 change set's rupee costs to paise columns"""
+    positions = [i for i, column in enumerate(data["columns"]) if column in LEGACY_COST_COLUMNS]
+    if table != "products" or not positions:
+        return data
+    upserts = []
+    for row in data["upserts"]:
+        row = list(row)
+        for i in positions:
+            row[i] = None if row[i] is None else to_paise(row[i])
+        upserts.append(row)
+    columns = [LEGACY_COST_COLUMNS.get(column, column) for column in data["columns"]]
+    return dict(data, columns=columns, upserts=upserts)
+
+
+def default_changeset_name(branch_name):
+    """Suggested file name for an exported change set"""
+    safe = "".join(ch if ch.isalnum() else "_" for ch in (branch_name or "branch"))
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"changes_{safe}_{timestamp}.json.gz"
@@ -0,0 +1,328 @@
+"""
+WAL checkpoint management for Shivam Opticals.
+
+Under WAL every save is appended to ``optical_shop.db-wal`` and only copied
+into the database file by a checkpoint. SQLite's automatic checkpoint runs
+inside whichever commit crosses ``wal_autocheckpoint`` pages, and it cannot
+get past a reader that is still looking at an older snapshot. On a busy day
+with a long export or maintenance read open, the WAL keeps growing, and
+every read has to search it.
+
+``CheckpointManager`` runs on its own thread and connection:
+
+* every few seconds it checks ``PRAGMA data_version`` (which changes when
+  any other connection commits) and the WAL file size;
+* once the database has been idle for a while, or the WAL is large, or
+  the last checkpoint is too long ago, it runs ``wal_checkpoint(PASSIVE)``,
+  which never blocks writers;
+* ``checkpoint("TRUNCATE")`` is called after backups and VACUUM to empty
+  the WAL file;
+* a checkpoint that cannot copy every frame means a reader is pinning the
+  WAL; ``status`` reports since when, together with the long reads open in
+  this process (``database.track_read``);
+* each checkpoint's duration and frame counts are kept in ``history``.
+
+``wal_autocheckpoint`` and ``journal_size_limit`` are stored in the
+settings table and applied to every connection by ``database.connect``.
+
+Run ``python checkpoints.py --bench 20000`` to watch the WAL through a busy
+day with a long read open.
+"""
+import argparse
+import collections
+import contextlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import database
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+# Seconds between checks of the WAL
+CHECK_INTERVAL = 5.0
+# Seconds without commits before the database counts as idle
+IDLE_SECONDS = 10.0
+# Seconds after which pending frames are checkpointed even while busy
+MAX_INTERVAL = 30.0
+# WAL size that triggers a checkpoint even while busy
+WAL_LIMIT = 32 * MB
+# Seconds a reader may pin the WAL before it is reported
+PIN_WARN_SECONDS = 60
+
+# Checkpoints kept in the history
+HISTORY = 50
+
+
+def load_wal_settings(conn):
+    """Read the configured WAL settings into database.WAL_PRAGMAS and apply them to conn"""
+    for name in database.WAL_PRAGMAS:
+        value = database.get_setting(conn, name)
+        if value is not None:
+            database.WAL_PRAGMAS[name] = int(value)
+    apply_wal_settings(conn)
+    return dict(database.WAL_PRAGMAS)
+
+
+def save_wal_settings(conn, autocheckpoint, size_limit):
+    """Store new WAL settings; connections opened from now on use them
+    
+    ``autocheckpoint`` is in pages (0 turns automatic checkpoints off),
+    ``size_limit`` in bytes. Raises ValueError for negative values.
+    """
+    settings = {"wal_autocheckpoint": int(autocheckpoint), "journal_size_limit": int(size_limit)}
+    if min(settings.values()) < 0:
+        raise ValueError("WAL settings cannot be negative")
+    for name, value in settings.items():
+        database.set_setting(conn, name, str(value))
+    database.WAL_PRAGMAS.update(settings)
+    apply_wal_settings(conn)
+    return settings
+
+
+def apply_wal_settings(conn):
+    """Apply database.WAL_PRAGMAS to an open connection or cursor"""
+    for name, value in database.WAL_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {int(value)}")
+
+
+def wal_size(db_path):
+    try:
+        return os.path.getsize(db_path + "-wal")
+    except OSError:
+        return 0
+
+
+class CheckpointManager:
+    """Checkpoints the WAL when the database is idle and watches for pinned readers"""
+    
+    def __init__(self, db_path=None, latency=None, check_interval=CHECK_INTERVAL,
+                 idle_seconds=IDLE_SECONDS, max_interval=MAX_INTERVAL, wal_limit=WAL_LIMIT):
+        self.db_path = db_path or database.get_db_path()
+        self.latency = latency  # health.LatencyStats for checkpoint timings, optional
+        self.check_interval = check_interval
+        self.idle_seconds = idle_seconds
+        self.max_interval = max_interval
+        self.wal_limit = wal_limit
+        
+        self.history = collections.deque(maxlen=HISTORY)
+        self.pinned_since = None  # datetime of the first incomplete checkpoint in a row
+        self.checkpoints = 0
+        
+        self._lock = threading.Lock()  # One checkpoint at a time on self.conn
+        self.conn = database.connect(self.db_path)
+        self._data_version = None
+        self._changed_at = time.monotonic()
+        self._last_checkpoint = time.monotonic()
+        self._pending = True  # The WAL may hold frames from before we started
+        
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="Checkpoints")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                log.warning("Checkpoint check failed: %s", e)
+    
+    def poll(self):
+        """Checkpoint if the database is idle, the WAL is large or it is time; returns the checkpoint or None"""
+        now = time.monotonic()
+        with self._lock:
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._changed_at = now
+            self._pending = True
+        if not self._pending:
+            return None
+        
+        if now - self._changed_at >= self.idle_seconds:
+            reason = "Idle"
+        elif wal_size(self.db_path) >= self.wal_limit:
+            reason = "WAL size"
+        elif now - self._last_checkpoint >= self.max_interval:
+            reason = "Interval"
+        else:
+            return None
+        return self.checkpoint("PASSIVE", reason)
+    
+    def checkpoint(self, mode="PASSIVE", reason="Manual"):
+        """Run a checkpoint now and return its history entry
+        
+        TRUNCATE waits for readers and writers (up to the busy timeout) and
+        then empties the WAL file; PASSIVE copies what it can without
+        waiting.
+        """
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        with self._lock:
+            wal_before = wal_size(self.db_path)
+            start = time.perf_counter()
+            busy, frames, copied = self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            seconds = time.perf_counter() - start
+        
+        # frames is -1 when the database is not in WAL mode
+        complete = not busy and copied >= frames
+        entry = {
+            "time": datetime.now(),
+            "mode": mode,
+            "reason": reason,
+            "seconds": seconds,
+            "wal_before": wal_before,
+            "wal_after": wal_size(self.db_path),
+            "frames": max(frames, 0),
+            "copied": max(copied, 0),
+            "complete": complete,
+        }
+        self.history.append(entry)
+        self.checkpoints += 1
+        self._last_checkpoint = time.monotonic()
+        if self.latency is not None:
+            self.latency.record("checkpoint", seconds)
+        
+        if complete:
+            self._pending = False
+            if self.pinned_since is not None:
+                log.info("WAL no longer pinned", extra={"fields": {"since": self.pinned_since.isoformat()}})
+            self.pinned_since = None
+        elif self.pinned_since is None:
+            self.pinned_since = entry["time"]
+            log.info("Checkpoint incomplete, a reader is pinning the WAL", extra={"fields": {
+                "frames": entry["frames"], "copied": entry["copied"], "readers": database.open_reads()}})
+        return entry
+    
+    def apply_settings(self):
+        """Apply changed WAL settings to the manager's own connection"""
+        with self._lock:
+            apply_wal_settings(self.conn)
+    
+    def status(self):
+        """Snapshot of the WAL and checkpoint figures for display"""
+        history = list(self.history)
+        durations = [entry["seconds"] for entry in history]
+        return {
+            "wal_bytes": wal_size(self.db_path),
+            "settings": dict(database.WAL_PRAGMAS),
+            "last": history[-1] if history else None,
+            "checkpoints": self.checkpoints,
+            "average_seconds": sum(durations) / len(durations) if durations else None,
+            "worst_seconds": max(durations) if durations else None,
+            "pinned_since": self.pinned_since,
+            "readers": database.open_reads(),
+        }
+    
+    @contextlib.contextmanager
+    def paused(self):
+        """No checks or checkpoints until the with block ends"""
+        with self._lock:
+            yield
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            self.conn.close()
+
+
+def advice(status):
+    """Hints about a pinned WAL"""
+    pinned_since = status["pinned_since"]
+    if pinned_since is None:
+        return []
+    pinned_for = (datetime.now() - pinned_since).total_seconds()
+    if pinned_for < PIN_WARN_SECONDS:
+        return []
+    readers = ", ".join(f"{name} (open {seconds / 60:.1f} min)" for name, _, seconds in status["readers"])
+    held_by = readers or "another program or counter with the database open"
+    return [f"The WAL has not been fully checkpointed since {pinned_since.strftime('%H:%M')}: "
+            f"held by {held_by}."]
+
+
+def describe(status):
+    """One line about the WAL for the Tools tab"""
+    text = f"WAL {status['wal_bytes'] / MB:.1f} MB"
+    last = status["last"]
+    if last:
+        text += (f", last checkpoint {last['time'].strftime('%H:%M:%S')} ({last['mode'].lower()}, "
+                 f"{last['reason'].lower()}) took {last['seconds'] * 1000:.0f} ms, "
+                 f"{last['copied']:,} of {last['frames']:,} frames")
+        text += f"; worst {status['worst_seconds'] * 1000:.0f} ms of {status['checkpoints']}"
+    return text
+
+
+def benchmark(count=20000, batch=50):
+    """Saves with a long read open part of the time, with and without the manager"""
+    from write_queue import WriteQueue
+    
+    sample = ({"right_sph": "-1.00"}, {"frame_name": "Frame", "lens_name": "Lens",
+                                        "frame_paise": 150000, "lens_paise": 80000})
+    
+    def run(managed):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "bench.db")
+            database.open_database(path).close()
+            manager = CheckpointManager(path, check_interval=0.05, idle_seconds=0.1, max_interval=1.0) \
+                if managed else None
+            writes = WriteQueue(path, checkpoint_interval=None)
+            reader = database.connect_readonly(path)
+            peak = 0
+            start = time.perf_counter()
+            for i in range(0, count, batch):
+                # An export holds a snapshot over the middle third of the day
+                if i == count // 3:
+                    reader.execute("BEGIN")
+                    reader.execute("SELECT COUNT(*) FROM customers").fetchone()
+                elif i == 2 * count // 3:
+                    reader.rollback()
+                futures = [writes.save_customer(f"Customer {j}", f"9{j:09d}", "2024-01-01", *sample)
+                           for j in range(i, min(i + batch, count))]
+                futures[-1].result()
+                time.sleep(0.002)  # Counter staff between saves
+                peak = max(peak, wal_size(path))
+            elapsed = time.perf_counter() - start
+            writes.close()
+            
+            # Reads at the end of the day search whatever is left in the WAL
+            query_start = time.perf_counter()
+            for _ in range(20):
+                reader.execute("SELECT COUNT(*), SUM(total_paise) FROM products").fetchone()
+            query = (time.perf_counter() - query_start) / 20
+            reader.close()
+            
+            end_wal = wal_size(path)
+            if manager:
+                time.sleep(0.3)  # Let the idle checkpoint run
+                manager.checkpoint("TRUNCATE", "Backup")
+                end_wal = wal_size(path)
+                status = manager.status()
+                manager.close()
+            label = "managed" if managed else "autocheckpoint only"
+            print(f"{label:20} {count / elapsed:7.0f} saves/s   WAL peak {peak / MB:6.1f} MB, "
+                  f"end of day {end_wal / MB:6.1f} MB   read {query * 1000:6.2f} ms")
+            if manager:
+                print(f"  {describe(status)}")
+    
+    run(False)
+    run(True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WAL checkpoint management")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT saves")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
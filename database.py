@@ -0,0 +1,959 @@
+"""
+Database access shared by the Shivam Opticals desktop app and LAN server.
+
+Holds the data directory location, connection setup, schema creation and the
+queries used to save, list, search and show customers, so the Tk window and
+the server run exactly the same SQL against the same schema.
+"""
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from branch_sync import install_change_capture
+from duplicates import install_duplicate_index
+from fuzzy import install_fuzzy_index, search_names
+from tuning import apply_tuning
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")
+DB_FILENAME = "optical_shop.db"
+
+# Customers not seen for a long time are moved to this file, kept next to
+# the live database and attached as schema "archive" when needed
+ARCHIVE_FILENAME = "archive.db"
+ARCHIVE_TABLES = ["customers", "prescriptions", "products"]  # Parents first
+
+# WAL settings applied to every writable connection (checkpoints.py loads
+# the configured values from the settings table at startup)
+WAL_PRAGMAS = {
+    "wal_autocheckpoint": 1000,  # Pages; SQLite's default
+    "journal_size_limit": 64 * 1024 * 1024,  # WAL file kept after a reset, in bytes
+}
+
+# Long read transactions in this process, which keep the WAL from being
+# checkpointed: token -> (name, thread name, monotonic start)
+_open_reads = {}
+_open_reads_lock = threading.Lock()
+
+PRESCRIPTION_FIELDS = [
+    "right_sph", "right_cyl", "right_axe", "right_add",
+    "left_sph", "left_cyl", "left_axe", "left_add",
+]
+
+# Costs are whole paise (see money.py); total_paise is generated from the
+# other two, so only PRODUCT_INPUT_FIELDS are written
+PRODUCT_FIELDS = ["frame_name", "lens_name", "frame_paise", "lens_paise", "total_paise"]
+PRODUCT_INPUT_FIELDS = PRODUCT_FIELDS[:-1]
+
+# Columns shown in the customer list
+LIST_COLUMNS = ["id", "name", "phone", "date", "frame_name", "total_paise"]
+
+# Sort expressions for the customer list. Each one is backed by an index
+# (ending in the customer id, the tie-breaker) so the list can be paged
+# with a keyset cursor; NULLs are folded so the cursor comparisons hold.
+LIST_SORTS = {
+    "id": "c.id",
+    "name": "c.name",
+    "phone": "COALESCE(c.phone, '')",
+    "date": "COALESCE(c.date, '')",
+    "frame_name": "COALESCE(p.frame_name, '')",
+    "total_paise": "COALESCE(p.total_paise, 0)",
+}
+
+# Version of the schema written by this code (kept in the settings table)
+SCHEMA_VERSION = 3
+
+# A sale's total in paise, from its frame and lens costs
+TOTAL_PAISE_SQL = "COALESCE(frame_paise, 0) + COALESCE(lens_paise, 0)"
+
+# Products table as of schema version 3 ({0} is the table name). Columns
+# added later come from ADDED_COLUMNS and install_change_capture.
+PRODUCTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {0} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        frame_name TEXT,
+        lens_name TEXT,
+        frame_paise INTEGER,
+        lens_paise INTEGER,
+        total_paise INTEGER GENERATED ALWAYS AS (''' + TOTAL_PAISE_SQL + ''') STORED,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+    )
+'''
+
+# Float rupee columns of schema versions 1-2 and their paise replacements
+LEGACY_COST_COLUMNS = {"frame_cost": "frame_paise", "lens_cost": "lens_paise", "total_cost": None}
+
+# Customers are recognised by phone and name, ignoring punctuation, spacing
+# and case; the phone key is its last ten digits. {0} is the column or "?".
+PHONE_KEY_SQL = ("substr(replace(replace(replace(replace(replace(replace("
+                 "coalesce({0}, ''), ' ', ''), '-', ''), '+', ''), '(', ''), ')', ''), '.', ''), -10)")
+NAME_KEY_SQL = "lower(trim(replace(replace(coalesce({0}, ''), '  ', ' '), '  ', ' ')))"
+
+
+def iso_date_sql(column):
+    """SQL for the YYYY-MM-DD form of a typed date, or NULL if it can't be read
+    
+    Dates are accepted year first (2024-03-05, 2024/3/5, also with a time
+    after them) or day first (05-03-2024, 5/3/2024, 5.3.24; two-digit
+    years before 70 are in this century). Month names are not read.
+    """
+    text = f"trim({column})"
+    separator = "[-/.]"
+    branches = []
+    
+    def branch(order, widths, tail=""):
+        pattern = separator.join("[0-9]" * width for width in widths) + tail
+        starts = (1, widths[0] + 2, widths[0] + widths[1] + 3)
+        parts = {field: f"substr({text}, {start}, {width})"
+                 for field, start, width in zip(order, starts, widths)}
+        year = parts["y"]
+        if widths[order.index("y")] == 2:
+            year = f"{year} + CASE WHEN {year} < '70' THEN 2000 ELSE 1900 END"
+        branches.append(f"WHEN {text} GLOB '{pattern}' "
+                        f"THEN printf('%04d-%02d-%02d', {year}, {parts['m']}, {parts['d']})")
+    
+    branch("ymd", (4, 2, 2), "*")  # The form the app enters, checked first
+    for month, day in itertools.product((2, 1), repeat=2):
+        if (month, day) != (2, 2):
+            branch("ymd", (4, month, day))
+    for year in (4, 2):
+        for day, month in itertools.product((2, 1), repeat=2):
+            branch("dmy", (day, month, year))
+    # date() turns impossible months and days into NULL
+    return f"date(CASE {' '.join(branches)} END)"
+
+
+# Visit dates are free text; visit_day is the ISO date, for date-range scans
+# and for finding a customer's latest visit (typed dates don't sort as dates)
+VISIT_DAY_SQL = iso_date_sql("visit_date")
+
+# Columns added after the first release: (table, column, definition)
+ADDED_COLUMNS = [
+    ("customers", "phone_key", f"TEXT GENERATED ALWAYS AS ({PHONE_KEY_SQL.format('phone')}) VIRTUAL"),
+    ("customers", "name_key", f"TEXT GENERATED ALWAYS AS ({NAME_KEY_SQL.format('name')}) VIRTUAL"),
+    ("prescriptions", "visit_date", "TEXT"),
+    ("prescriptions", "visit_day", f"TEXT GENERATED ALWAYS AS ({VISIT_DAY_SQL}) VIRTUAL"),
+    ("products", "visit_date", "TEXT"),
+    ("products", "prescription_id", "INTEGER REFERENCES prescriptions (id) ON DELETE SET NULL"),
+    ("products", "visit_day", f"TEXT GENERATED ALWAYS AS ({VISIT_DAY_SQL}) VIRTUAL"),
+]
+
+
+def get_db_path():
+    """Path of the live database file"""
+    return os.path.join(DATA_DIR, DB_FILENAME)
+
+
+def get_archive_path(conn=None):
+    """Path of the archive database (next to conn's database file)"""
+    if conn is not None:
+        main_file = conn.execute(
+            "SELECT file FROM pragma_database_list WHERE name = 'main'"
+        ).fetchone()[0]
+        if main_file:
+            return os.path.join(os.path.dirname(main_file), ARCHIVE_FILENAME)
+    return os.path.join(DATA_DIR, ARCHIVE_FILENAME)
+
+
+def attach_archive(conn, create=False):
+    """Attach the archive as schema "archive"; returns False if there is none
+    
+    With create=True a missing archive is created with the same tables as
+    the live database. Must not be called inside a transaction.
+    """
+    attached = conn.execute(
+        "SELECT 1 FROM pragma_database_list WHERE name = 'archive'"
+    ).fetchone()
+    if not attached:
+        path = get_archive_path(conn)
+        if not create and not os.path.exists(path):
+            return False
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        conn.execute("PRAGMA archive.journal_mode = WAL")
+    if create:
+        create_archive_schema(conn)
+    return True
+
+
+def create_archive_schema(conn):
+    """Create the archived tables with the same columns as the live ones"""
+    for table in ARCHIVE_TABLES:
+        sql = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        conn.execute(re.sub(r"^CREATE TABLE\s+\"?\w+\"?",
+                            f"CREATE TABLE IF NOT EXISTS archive.{table}", sql))
+    
+    # Enough indexes for searching and showing archived customers
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_customer_name ON customers(name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_customer_phone ON customers(phone)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_customer_identity ON customers(phone_key, name_key)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_prescriptions_visit ON prescriptions(customer_id, visit_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_prescriptions_day ON prescriptions(visit_day, customer_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_products_visit ON products(customer_id, visit_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_products_prescription ON products(prescription_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_prescriptions_latest ON prescriptions(customer_id, visit_day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_products_latest ON products(customer_id, visit_day)')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS archive.idx_products_revenue ON products(visit_date, frame_name, frame_paise, lens_paise)'
+    )
+    conn.commit()
+
+
+def upgrade_archive(conn):
+    """Bring an archive written by an older version up to the live schema"""
+    if not os.path.exists(get_archive_path(conn)):
+        return
+    attach_archive(conn)
+    columns = [row[1] for row in conn.execute("PRAGMA archive.table_info(products)")]
+    if "frame_paise" not in columns:
+        migrate_to_paise(conn.cursor(), "archive")
+        conn.commit()
+        create_archive_schema(conn)  # Indexes went with the old table
+    
+    # Columns added to the live tables since the archive was created
+    added = False
+    for table, column, definition in ADDED_COLUMNS:
+        existing = [row[1] for row in conn.execute(f"PRAGMA archive.table_xinfo({table})")]
+        if column not in existing:
+            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column} {definition}")
+            added = True
+    if added:
+        conn.commit()
+        create_archive_schema(conn)
+    conn.execute("DETACH DATABASE archive")
+
+
+def ensure_data_dirs():
+    """Create the data and backup directories if they don't exist"""
+    for directory in (DATA_DIR, BACKUP_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+def connect(db_path=None, check_same_thread=False):
+    """Open a connection with the application's standard settings"""
+    db_path = db_path or get_db_path()
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign key constraints
+    conn.execute("PRAGMA journal_mode = WAL")  # Use Write-Ahead Logging for better concurrency
+    for name, value in WAL_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {int(value)}")
+    apply_tuning(conn, db_path)  # Cache, mmap and temp store sized to the database
+    return conn
+
+
+def connect_readonly(db_path=None, immutable=False):
+    """Open a read-only connection for reports and exports
+    
+    Under WAL a reader never blocks the writer and is never blocked by it.
+    Files nothing else writes to (backups) can be opened immutable, which
+    skips locking altogether.
+    """
+    path = os.path.abspath(db_path or get_db_path())
+    options = "mode=ro&immutable=1" if immutable else "mode=ro"
+    conn = sqlite3.connect(f"file:{pathname2url(path)}?{options}", uri=True,
+                           check_same_thread=False)
+    apply_tuning(conn, path, read_only=True)
+    return conn
+
+
+@contextmanager
+def track_read(name):
+    """Register the block as a long read, reported when it holds up checkpoints"""
+    key = object()
+    with _open_reads_lock:
+        _open_reads[key] = (name, threading.current_thread().name, time.monotonic())
+    try:
+        yield
+    finally:
+        with _open_reads_lock:
+            del _open_reads[key]
+
+
+def open_reads():
+    """(name, thread name, seconds open) of the long reads in progress"""
+    now = time.monotonic()
+    with _open_reads_lock:
+        return [(name, thread, now - started) for name, thread, started in _open_reads.values()]
+
+
+@contextmanager
+def read_snapshot(conn, name="Snapshot read"):
+    """Run the block's queries in one read transaction
+    
+    Every query sees the database as it was when the block started, so a
+    multi-query report cannot mix rows from before and after a save.
+    """
+    with track_read(name):
+        conn.execute("BEGIN")
+        try:
+            # A transaction only takes its snapshot at the first read
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            yield conn
+        finally:
+            conn.rollback()
+
+
+def create_schema(cursor):
+    """Create tables, triggers and indexes if they don't exist"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT,
+            date TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prescriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            right_sph TEXT,
+            right_cyl TEXT,
+            right_axe TEXT,
+            right_add TEXT,
+            left_sph TEXT,
+            left_cyl TEXT,
+            left_axe TEXT,
+            left_add TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+        )
+    ''')
+    
+    cursor.execute(PRODUCTS_TABLE_SQL.format("products"))
+    
+    # Application settings that live with the data (e.g. write durability)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    
+    # Float rupee costs (schema 1-2) become paise; done before the triggers
+    # and indexes below are created on the rebuilt table
+    migrate_to_paise(cursor)
+    
+    # Create trigger to update the updated_at timestamp
+    # (only when the writer did not set it, so synced rows keep theirs)
+    for table in ['customers', 'prescriptions', 'products']:
+        cursor.execute(f"DROP TRIGGER IF EXISTS update_{table}_timestamp")
+        cursor.execute(f'''
+            CREATE TRIGGER update_{table}_timestamp
+            AFTER UPDATE ON {table}
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END
+        ''')
+    
+    # Add columns introduced by later versions
+    for table, column, definition in ADDED_COLUMNS:
+        existing = [row[1] for row in cursor.execute(f"PRAGMA table_xinfo({table})")]
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    # Create change-capture log and triggers for branch sync
+    install_change_capture(cursor)
+    
+    # Blocking keys for fuzzy duplicate detection
+    install_duplicate_index(cursor)
+    
+    # Create index on frequently searched fields
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_name ON customers(name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_phone ON customers(phone)')
+    
+    # Returning-customer lookup and per-customer visit history
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_identity ON customers(phone_key, name_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prescriptions_visit ON prescriptions(customer_id, visit_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_visit ON products(customer_id, visit_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_prescription ON products(prescription_id)')
+    # A customer's latest visit
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prescriptions_latest ON prescriptions(customer_id, visit_day)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_latest ON products(customer_id, visit_day)')
+    
+    # Visits in a date range, for recall lists (recall.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prescriptions_day ON prescriptions(visit_day, customer_id)')
+    
+    # Name prefix suggestions (phone prefixes use idx_customer_identity)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_name_key ON customers(name_key)')
+    
+    # Trigram index for typo-tolerant name search
+    install_fuzzy_index(cursor)
+    
+    # Incremental exports select rows changed since a watermark
+    for table in ['customers', 'prescriptions', 'products']:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_updated ON {table}(updated_at)')
+    
+    # Sort orders of the customer list (see LIST_SORTS)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_customer_phone_sort ON customers(COALESCE(phone, ''))")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_customer_date_sort ON customers(COALESCE(date, ''))")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_frame_sort ON products(COALESCE(frame_name, ''), customer_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_total_sort ON products(COALESCE(total_paise, 0), customer_id)"
+    )
+    
+    # Revenue reports: covers the daily, monthly and per-frame aggregates
+    # (SQLite does not treat an index holding a generated column as
+    # covering, so reports sum TOTAL_PAISE_SQL over the two costs)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_products_revenue ON products(visit_date, frame_name, frame_paise, lens_paise)"
+    )
+    
+    row = cursor.execute("SELECT value FROM settings WHERE key = 'schema_version'").fetchone()
+    version = int(row[0]) if row else 1
+    if version < 2:
+        migrate_to_visits(cursor)
+    cursor.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES ('schema_version', ?)",
+        (str(SCHEMA_VERSION),)
+    )
+
+
+def migrate_to_visits(cursor):
+    """Upgrade a one-row-per-save database to customers with dated visits
+    
+    Each old customer row holds exactly one prescription and one sale, which
+    become a visit on the customer's date. Rows for the same person are then
+    merged.
+    """
+    # Every branch derives these columns itself, so keep them out of the
+    # change log
+    cursor.execute("INSERT INTO sync_guard (active) VALUES (1)")
+    for table in ("prescriptions", "products"):
+        cursor.execute(f'''
+            UPDATE {table} SET visit_date =
+                (SELECT c.date FROM customers c WHERE c.id = {table}.customer_id)
+            WHERE visit_date IS NULL
+        ''')
+    cursor.execute('''
+        UPDATE products SET prescription_id =
+            (SELECT MIN(pr.id) FROM prescriptions pr WHERE pr.customer_id = products.customer_id)
+        WHERE prescription_id IS NULL
+    ''')
+    cursor.execute("DELETE FROM sync_guard")
+    
+    merge_duplicate_customers(cursor)
+
+
+def migrate_to_paise(cursor, schema="main"):
+    """Rebuild products with integer paise costs and a generated total
+    
+    Float rupee costs are rounded to the nearest paisa. The total becomes
+    frame + lens; a total saved through the LAN API that differed from the
+    sum is not kept. Also used for an archive written by an older version.
+    """
+    columns = [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info(products)")]
+    if "frame_paise" in columns:
+        return
+    
+    # Columns the fresh table does not define (visit date, uuid, ...)
+    new_table = f"{schema}.products_paise"
+    cursor.execute(f"DROP TABLE IF EXISTS {new_table}")
+    cursor.execute(PRODUCTS_TABLE_SQL.format(new_table))
+    fresh = [row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info(products_paise)")]
+    definitions = {column: definition for table, column, definition in ADDED_COLUMNS if table == "products"}
+    for column in columns:
+        if column not in fresh and column not in LEGACY_COST_COLUMNS:
+            cursor.execute(f"ALTER TABLE {new_table} ADD COLUMN {column} {definitions.get(column, 'TEXT')}")
+    
+    kept = [column for column in columns if column not in LEGACY_COST_COLUMNS]
+    cursor.execute(f'''
+        INSERT INTO {new_table} ({", ".join(kept)}, frame_paise, lens_paise)
+        SELECT {", ".join(kept)},
+               CAST(ROUND(frame_cost * 100) AS INTEGER), CAST(ROUND(lens_cost * 100) AS INTEGER)
+        FROM {schema}.products
+    ''')
+    # Nothing references products, so it can be replaced with foreign keys on
+    cursor.execute(f"DROP TABLE {schema}.products")
+    cursor.execute(f"ALTER TABLE {new_table} RENAME TO products")
+
+
+def merge_duplicate_customers(cursor):
+    """Merge customers with the same phone and name; returns rows removed
+    
+    The earliest created row is kept (ties broken by uuid, so every branch
+    keeps the same one) and takes over the visits of the others.
+    """
+    groups = cursor.execute('''
+        SELECT phone_key, name_key FROM customers
+        WHERE phone_key != ''
+        GROUP BY phone_key, name_key
+        HAVING COUNT(*) > 1
+    ''').fetchall()
+    
+    removed = 0
+    for phone_key, name_key in groups:
+        ids = [row[0] for row in cursor.execute(
+            "SELECT id FROM customers WHERE phone_key = ? AND name_key = ? ORDER BY created_at, uuid",
+            (phone_key, name_key)
+        )]
+        merge_customers(cursor, ids[0], ids[1:])
+        removed += len(ids) - 1
+    
+    return removed
+
+
+def merge_customers(cursor, keeper_id, duplicate_ids):
+    """Move the visits of duplicate_ids to keeper_id and delete them
+    
+    The keeper takes the latest visit date of the group. The caller owns the
+    transaction.
+    """
+    duplicates = [customer_id for customer_id in duplicate_ids if customer_id != keeper_id]
+    if not duplicates:
+        return
+    placeholders = ", ".join("?" for _ in duplicates)
+    
+    for table in ("prescriptions", "products"):
+        cursor.execute(
+            f"UPDATE {table} SET customer_id = ? WHERE customer_id IN ({placeholders})",
+            [keeper_id] + duplicates
+        )
+    cursor.execute(f"DELETE FROM customers WHERE id IN ({placeholders})", duplicates)
+    update_customer_date(cursor, keeper_id)
+
+
+def update_customer_date(cursor, customer_id):
+    """Set a customer's date to that of their latest visit (by visit_day)"""
+    cursor.execute(
+        """UPDATE customers SET date = COALESCE((
+               SELECT visit_date FROM prescriptions
+               WHERE customer_id = ?
+               ORDER BY visit_day DESC, id DESC
+               LIMIT 1
+           ), date)
+           WHERE id = ?""",
+        (customer_id, customer_id)
+    )
+
+
+def open_database(db_path=None):
+    """Connect to the database, creating directories and schema as needed"""
+    ensure_data_dirs()
+    conn = connect(db_path)
+    create_schema(conn.cursor())
+    conn.commit()
+    upgrade_archive(conn)
+    return conn
+
+
+def get_setting(conn, key, default=None):
+    """Value of an application setting, or default if it was never set"""
+    row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_setting(conn, key, value):
+    """Store an application setting"""
+    conn.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+        (key, value)
+    )
+    conn.commit()
+
+
+def find_existing_customer(cursor, name, phone):
+    """Id of the customer with the same phone and name, or None
+    
+    Customers without a phone number are never matched.
+    """
+    cursor.execute(
+        f'''SELECT id FROM customers
+           WHERE phone_key = {PHONE_KEY_SQL.format("?")} AND name_key = {NAME_KEY_SQL.format("?")}
+             AND phone_key != ''
+           ORDER BY created_at
+           LIMIT 1''',
+        (phone, name)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def find_archived_customer(cursor, name, phone):
+    """Id of an archived customer with the same phone and name, or None
+    
+    Only looks in an archive that is already attached (see attach_archive).
+    """
+    attached = cursor.execute(
+        "SELECT 1 FROM pragma_database_list WHERE name = 'archive'"
+    ).fetchone()
+    if not attached:
+        return None
+    cursor.execute(
+        f'''SELECT id FROM archive.customers
+           WHERE phone_key = {PHONE_KEY_SQL.format("?")} AND name_key = {NAME_KEY_SQL.format("?")}
+             AND phone_key != ''
+           ORDER BY created_at
+           LIMIT 1''',
+        (phone, name)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def table_columns(cursor, table):
+    """Stored columns of a live table (generated columns excluded)"""
+    return [row[1] for row in cursor.execute(f"PRAGMA main.table_info({table})")]
+
+
+def move_customers(cursor, ids, source, target, conflict):
+    """Copy customers and their visits from source to target, then delete them
+    
+    source and target are "main" and "archive" (attached); conflict is the
+    INSERT conflict clause. The caller owns the transaction.
+    """
+    # Moving rows is not an edit: keep it out of the branch change log
+    cursor.execute("INSERT INTO main.sync_guard (active) VALUES (1)")
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM temp.archive_batch")
+    cursor.executemany("INSERT INTO temp.archive_batch (id) VALUES (?)", [(i,) for i in ids])
+    
+    for table in ARCHIVE_TABLES:
+        key = "id" if table == "customers" else "customer_id"
+        columns = ", ".join(table_columns(cursor, table))
+        cursor.execute(f'''
+            INSERT {conflict} INTO {target}.{table} ({columns})
+            SELECT {columns} FROM {source}.{table}
+            WHERE {key} IN (SELECT id FROM temp.archive_batch)
+        ''')
+    
+    # Visits (and duplicate-index rows) go with the customer by cascade
+    cursor.execute(f"DELETE FROM {source}.customers WHERE id IN (SELECT id FROM temp.archive_batch)")
+    cursor.execute("DELETE FROM main.sync_guard")
+
+
+def insert_customer(cursor, name, phone, visit_date, prescription, product):
+    """Record a visit with its prescription and sale; returns the customer id
+    
+    A returning customer (same phone and name) gets the visit added to their
+    record, after moving them back from the archive if they were archived;
+    anyone else gets a new customer row. The caller owns the transaction.
+    Costs must already be whole paise (money.to_paise).
+    """
+    customer_id = find_existing_customer(cursor, name, phone)
+    if customer_id is None:
+        customer_id = find_archived_customer(cursor, name, phone)
+        if customer_id is not None:
+            move_customers(cursor, [customer_id], "archive", "main", "OR IGNORE")
+    returning = customer_id is not None
+    if not returning:
+        cursor.execute(
+            "INSERT INTO customers (name, phone, date) VALUES (?, ?, ?)",
+            (name, phone, visit_date)
+        )
+        customer_id = cursor.lastrowid
+    else:
+        # Keep the latest spelling
+        cursor.execute(
+            "UPDATE customers SET name = ?, phone = ? WHERE id = ?",
+            (name, phone, customer_id)
+        )
+    
+    cursor.execute(
+        f'''INSERT INTO prescriptions
+           (customer_id, visit_date, {", ".join(PRESCRIPTION_FIELDS)})
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        [customer_id, visit_date] + [prescription.get(field, "") for field in PRESCRIPTION_FIELDS]
+    )
+    prescription_id = cursor.lastrowid
+    if returning:
+        # The visit may be older than one already recorded
+        update_customer_date(cursor, customer_id)
+    
+    cursor.execute(
+        f'''INSERT INTO products
+           (customer_id, visit_date, prescription_id, {", ".join(PRODUCT_INPUT_FIELDS)})
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        [customer_id, visit_date, prescription_id] + [product.get(field) for field in PRODUCT_INPUT_FIELDS]
+    )
+    
+    return customer_id
+
+
+def list_cursor(row, sort="date"):
+    """Keyset cursor (sort value, customer id) of a customer list row"""
+    value = row[LIST_COLUMNS.index(sort)]
+    if value is None:
+        value = 0 if sort == "total_paise" else ""
+    return value, row[0]
+
+
+def list_cursor_at(row, sort="date", descending=True):
+    """Keyset cursor of a page that starts with row itself
+    
+    The cursor is exclusive, so it is placed one customer id before the row
+    in the paging direction (the id breaks ties between equal sort values).
+    """
+    value, customer_id = list_cursor(row, sort)
+    return value, customer_id + 1 if descending else customer_id - 1
+
+
+def parse_list_cursor(sort, value, customer_id):
+    """Cursor from text values (e.g. URL parameters)"""
+    if sort == "id":
+        value = int(value)
+    elif sort == "total_paise":
+        value = int(value)
+    return value, int(customer_id)
+
+
+def query_customer_list(cursor, search_term="", limit=None, after=None,
+                        sort="date", descending=True, include_archive=False):
+    """Rows for the customer list (one per customer)
+    
+    The frame and total shown are those of the customer's latest visit.
+    Rows are ordered by ``sort`` (a LIST_SORTS key), newest/largest first
+    unless ``descending`` is False, with the customer id breaking ties.
+    
+    ``after`` is the list_cursor() of the last row of the previous page and
+    ``limit`` the page size; without them the whole list is returned.
+    With ``include_archive`` archived customers are listed too.
+    """
+    if sort not in LIST_SORTS:
+        raise ValueError(f"Unknown sort column: {sort}")
+    if include_archive and not attach_archive(cursor.connection):
+        include_archive = False  # Nothing has been archived yet
+    direction = "DESC" if descending else "ASC"
+    
+    query, params = _customer_list_select("main", search_term, after, sort, descending)
+    if include_archive:
+        archive_query, archive_params = _customer_list_select(
+            "archive", search_term, after, sort, descending)
+        query = f"SELECT * FROM ({query} UNION ALL {archive_query})"
+        params += archive_params
+        # Order the combined rows by the output columns
+        sort_key = re.sub(r"\b[cp]\.", "", LIST_SORTS[sort])
+        tie_breaker = "id"
+    else:
+        sort_key = LIST_SORTS[sort]
+        tie_breaker = "p.customer_id" if sort in ("frame_name", "total_paise") else "c.id"
+    
+    query += f" ORDER BY {sort_key} {direction}, {tie_breaker} {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def count_customers(cursor, search_term="", include_archive=False):
+    """Number of customers query_customer_list() lists in total"""
+    if include_archive and not attach_archive(cursor.connection):
+        include_archive = False
+    schemas = ("main", "archive") if include_archive else ("main",)
+    
+    total = 0
+    for schema in schemas:
+        query = f"SELECT COUNT(*) FROM {schema}.customers c"
+        params = []
+        if search_term:
+            query += f''' WHERE c.name LIKE ? OR c.phone LIKE ? OR EXISTS (
+                SELECT 1 FROM {schema}.products s WHERE s.customer_id = c.id AND s.frame_name LIKE ?)'''
+            params = [f"%{search_term}%"] * 3
+        cursor.execute(query, params)
+        total += cursor.fetchone()[0]
+    return total
+
+
+def _customer_list_select(schema, search_term, after, sort, descending):
+    """Unordered customer list query over one schema; returns (sql, params)"""
+    sort_key = LIST_SORTS[sort]
+    product_sort = sort in ("frame_name", "total_paise")
+    tie_breaker = "p.customer_id" if product_sort else "c.id"
+    
+    conditions = []
+    params = []
+    
+    if search_term:
+        conditions.append(f'''(c.name LIKE ? OR c.phone LIKE ? OR EXISTS (
+            SELECT 1 FROM {schema}.products s WHERE s.customer_id = c.id AND s.frame_name LIKE ?))''')
+        like_term = f"%{search_term}%"
+        params.extend([like_term, like_term, like_term])
+    
+    if after is not None:
+        conditions.append(f"({sort_key}, {tie_breaker}) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    
+    latest_product = f'''(
+            SELECT id FROM {schema}.products
+            WHERE customer_id = c.id
+            ORDER BY visit_day DESC, id DESC
+            LIMIT 1
+        )'''
+    if product_sort:
+        # Walk the product sort index and keep each customer's latest sale
+        query = f'''
+            SELECT c.id, c.name, c.phone, c.date, p.frame_name, p.total_paise
+            FROM {schema}.products p
+            JOIN {schema}.customers c ON c.id = p.customer_id
+        '''
+        conditions.insert(0, f"p.id = {latest_product}")
+    else:
+        query = f'''
+            SELECT c.id, c.name, c.phone, c.date, p.frame_name, p.total_paise
+            FROM {schema}.customers c
+            LEFT JOIN {schema}.products p ON p.id = {latest_product}
+        '''
+    
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params
+
+
+def query_fuzzy_customers(cursor, search_term, limit=None):
+    """Customer list rows for names within two edits of search_term
+    
+    Rows have the query_customer_list() shape and come closest name first,
+    newest customer first within a name. Returns (rows, complete), with
+    ``complete`` False while the name index is still being built. Archived
+    customers are not searched.
+    """
+    matches, complete = search_names(cursor, search_term)
+    if not matches:
+        return [], complete
+    distances = {key: distance for distance, key in matches}
+    
+    cursor.execute(f'''
+        SELECT c.id, c.name, c.phone, c.date, p.frame_name, p.total_paise, c.name_key
+        FROM customers c
+        LEFT JOIN products p ON p.id = (
+            SELECT id FROM products
+            WHERE customer_id = c.id
+            ORDER BY visit_day DESC, id DESC
+            LIMIT 1
+        )
+        WHERE c.name_key IN ({",".join("?" * len(distances))})
+    ''', list(distances))
+    rows = sorted(cursor.fetchall(), key=lambda row: (distances[row[6]], row[6], -row[0]))
+    return [row[:6] for row in rows[:limit]], complete
+
+
+def find_customer_match(cursor, search_term):
+    """Return (customer_id, kind) for an exact, single partial or similar match
+    
+    kind is "exact" when name or phone equals the term, "single" when exactly
+    one customer partially matches and "similar" when nothing matches but
+    one customer's name is a single edit away; returns (None, None)
+    otherwise.
+    """
+    query = '''
+        SELECT c.id
+        FROM customers c
+        WHERE c.name = ? OR c.phone = ?
+        LIMIT 1
+    '''
+    cursor.execute(query, (search_term, search_term))
+    exact_match = cursor.fetchone()
+    if exact_match:
+        return exact_match[0], "exact"
+    
+    query = '''
+        SELECT c.id, COUNT(*) as count
+        FROM customers c
+        WHERE c.name LIKE ? OR c.phone LIKE ?
+    '''
+    like_term = f"%{search_term}%"
+    cursor.execute(query, (like_term, like_term))
+    match_count = cursor.fetchone()
+    if match_count and match_count[1] == 1:
+        return match_count[0], "single"
+    
+    # A misspelt name: jump to the customer if only one is that close
+    if match_count and match_count[1] == 0 and any(char.isalpha() for char in search_term):
+        matches, _ = search_names(cursor, search_term, max_distance=1)
+        closest = [key for distance, key in matches if distance == matches[0][0]]
+        if len(closest) == 1:
+            cursor.execute("SELECT id FROM customers WHERE name_key = ? LIMIT 2", closest)
+            customers = cursor.fetchall()
+            if len(customers) == 1:
+                return customers[0][0], "similar"
+    
+    return None, None
+
+
+def suggest_customers(cursor, text, limit=8):
+    """Customers whose name or phone starts with text, for the entry form
+    
+    Digits are matched against the start of the phone key, anything else
+    against the start of the name key; both are index range scans, so the
+    cost does not grow with the number of customers. Returns (id, name,
+    phone, date) rows.
+    """
+    digits = re.sub(r"[\s\-+().]", "", text)
+    if digits.isdigit():
+        column, prefix = "phone_key", digits[-10:]
+    else:
+        column, prefix = "name_key", " ".join(text.split()).lower()
+    if not prefix:
+        return []
+    cursor.execute(
+        f'''SELECT id, name, phone, date FROM customers
+           WHERE {column} >= ? AND {column} < ?
+           ORDER BY {column}
+           LIMIT ?''',
+        (prefix, prefix + "\U0010ffff", limit)
+    )
+    return cursor.fetchall()
+
+
+def query_customer_detail(cursor, customer_id):
+    """Full record of one customer as a dictionary, or None
+    
+    The prescription and product fields are those of the latest visit;
+    ``visits`` lists every visit, newest first. Customers that are not in
+    the live database are looked up in the archive (``archived`` is True).
+    """
+    customer = _query_customer_detail(cursor, "main", customer_id)
+    if customer is None and attach_archive(cursor.connection):
+        customer = _query_customer_detail(cursor, "archive", customer_id)
+        if customer is not None:
+            customer["archived"] = True
+    return customer
+
+
+def _query_customer_detail(cursor, schema, customer_id):
+    visit_fields = ["visit_date", "product_id"] + PRESCRIPTION_FIELDS + PRODUCT_FIELDS
+    query = f'''
+        SELECT c.id, c.name, c.phone, c.date, c.created_at, c.updated_at,
+               pr.id AS prescription_id, pr.visit_date,
+               pr.right_sph, pr.right_cyl, pr.right_axe, pr.right_add,
+               pr.left_sph, pr.left_cyl, pr.left_axe, pr.left_add,
+               p.id AS product_id, p.frame_name, p.lens_name, p.frame_paise, p.lens_paise, p.total_paise
+        FROM {schema}.customers c
+        LEFT JOIN {schema}.prescriptions pr ON pr.customer_id = c.id
+        LEFT JOIN {schema}.products p ON p.prescription_id = pr.id
+        WHERE c.id = ?
+        ORDER BY pr.visit_day DESC, pr.id DESC
+    '''
+    cursor.execute(query, (customer_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    columns = [description[0] for description in cursor.description]
+    
+    customer = dict(zip(columns, rows[0]))
+    customer["archived"] = False
+    customer["visits"] = []
+    for row in rows:
+        visit = dict(zip(columns, row))
+        if visit["prescription_id"] is not None:
+            customer["visits"].append({field: visit[field] for field in visit_fields})
+    return customer
@@ -0,0 +1,353 @@
+"""
+PDF prescription cards and invoices for Shivam Opticals.
+
+Documents are built from ``database.query_customer_detail`` (the record the
+details window shows) and written by a small PDF writer using the standard
+Helvetica fonts, so no PDF library has to be bundled with the app.
+
+A month-end reprint renders every visit in a date range: visits are split into
+chunks rendered in a process pool, and the finished pages are streamed in
+order into one combined file, so memory use does not grow with the batch.
+
+Run ``python documents.py --bench 1000`` to time a batch.
+"""
+import argparse
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import database
+from money import format_rupees
+
+SHOP_NAME = "SHIVAM OPTICALS"
+
+# Page sizes in points (1/72 inch)
+CARD_SIZE = (420, 298)  # A6 landscape
+INVOICE_SIZE = (420, 595)  # A5 portrait
+
+DOCUMENT_KINDS = ("card", "invoice")
+
+# Visits rendered per process pool task
+CHUNK_SIZE = 50
+
+# Helvetica advance widths (1/1000 em) for alignment; other characters use
+# an average width
+_CHAR_WIDTHS = dict.fromkeys("0123456789", 556)
+_CHAR_WIDTHS.update({" ": 278, ".": 278, ",": 278, "-": 333, "+": 584, "/": 278, ":": 278})
+_AVERAGE_WIDTH = 556
+
+
+def format_amount(paise):
+    """Rupee amount for printing (the PDF fonts have no rupee sign)"""
+    return "-" if paise is None else f"Rs. {format_rupees(paise, grouped=True)}"
+
+
+class Page:
+    """Drawing operations for one PDF page, positioned from the top left"""
+    
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._ops = []
+    
+    @staticmethod
+    def text_width(value, size):
+        return sum(_CHAR_WIDTHS.get(char, _AVERAGE_WIDTH) for char in value) * size / 1000
+    
+    def text(self, x, y, value, size=10, bold=False, align="left"):
+        """Draw text with its baseline y points below the top of the page"""
+        value = str(value)
+        if align == "right":
+            x -= self.text_width(value, size)
+        elif align == "center":
+            x -= self.text_width(value, size) / 2
+        escaped = value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        self._ops.append(f"BT /{'F2' if bold else 'F1'} {size} Tf {x:.1f} {self.height - y:.1f} Td "
+                         f"({escaped}) Tj ET")
+    
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self._ops.append(f"{width} w {x1:.1f} {self.height - y1:.1f} m "
+                         f"{x2:.1f} {self.height - y2:.1f} l S")
+    
+    def rect(self, x, y, width, height, gray=None):
+        """Outline a rectangle, or fill it with a gray level (0 black, 1 white)"""
+        box = f"{x:.1f} {self.height - y - height:.1f} {width:.1f} {height:.1f} re"
+        if gray is None:
+            self._ops.append(f"0.5 w {box} S")
+        else:
+            self._ops.append(f"{gray} g {box} f 0 g")
+    
+    def render(self):
+        """(width, height, compressed content stream)"""
+        content = "\n".join(self._ops).encode("cp1252", "replace")
+        return self.width, self.height, zlib.compress(content)
+
+
+class PdfWriter:
+    """Minimal PDF writer that streams pages to a binary file"""
+    
+    # Objects written up front or at close; pages are numbered after them
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_IDS = {"F1": (3, "Helvetica"), "F2": (4, "Helvetica-Bold")}
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._position = 0
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 5
+        
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        for obj_id, base_font in self.FONT_IDS.values():
+            self._object(obj_id, f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} "
+                                 "/Encoding /WinAnsiEncoding >>".encode())
+    
+    def _write(self, data):
+        self._stream.write(data)
+        self._position += len(data)
+    
+    def _object(self, obj_id, body):
+        self._offsets[obj_id] = self._position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (obj_id, body))
+    
+    def add_page(self, page):
+        """Append a page from Page.render()"""
+        width, height, content = page
+        content_id, page_id = self._next_id, self._next_id + 1
+        self._next_id += 2
+        
+        self._object(content_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream"
+                     % (len(content), content))
+        fonts = " ".join(f"/{name} {obj_id} 0 R" for name, (obj_id, _) in self.FONT_IDS.items())
+        self._object(page_id, (f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+                               f"/MediaBox [0 0 {width} {height}] "
+                               f"/Resources << /Font << {fonts} >> >> "
+                               f"/Contents {content_id} 0 R >>").encode())
+        self._page_ids.append(page_id)
+    
+    def close(self):
+        """Write the page tree, cross-reference table and trailer"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._object(self.PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        self._object(self.CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES_ID)
+        
+        xref_position = self._position
+        entries = [b"xref\n0 %d\n" % self._next_id, b"0000000000 65535 f \n"]
+        entries.extend(b"%010d 00000 n \n" % self._offsets[obj_id] for obj_id in range(1, self._next_id))
+        self._write(b"".join(entries))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (self._next_id, self.CATALOG_ID, xref_position))
+
+
+def _shop_header(page, title):
+    page.rect(0, 0, page.width, 42, gray=0.85)
+    page.text(20, 27, SHOP_NAME, size=16, bold=True)
+    page.text(page.width - 20, 27, title, size=11, bold=True, align="right")
+
+
+def prescription_card(customer, visit):
+    """Prescription card page for one visit"""
+    page = Page(*CARD_SIZE)
+    _shop_header(page, "PRESCRIPTION CARD")
+    
+    page.text(20, 65, customer["name"] or "", size=12, bold=True)
+    page.text(20, 80, f"Phone: {customer['phone'] or '-'}", size=9)
+    page.text(page.width - 20, 65, f"Customer #{customer['id']}", size=9, align="right")
+    page.text(page.width - 20, 80, f"Date: {visit['visit_date'] or '-'}", size=9, align="right")
+    
+    # Right and left eye table
+    columns = [("Eye", 20), ("SPH", 110), ("CYL", 180), ("AXIS", 250), ("ADD", 320)]
+    top = 100
+    page.rect(20, top, page.width - 40, 20, gray=0.92)
+    for label, x in columns:
+        page.text(x + 6, top + 14, label, size=9, bold=True)
+    for row, eye in enumerate(("right", "left")):
+        y = top + 20 + row * 22
+        page.line(20, y + 22, page.width - 20, y + 22)
+        page.text(26, y + 15, eye.title(), size=10, bold=True)
+        for (_, x), part in zip(columns[1:], ("sph", "cyl", "axe", "add")):
+            page.text(x + 6, y + 15, visit[f"{eye}_{part}"] or "-", size=10)
+    page.rect(20, top, page.width - 40, 64)
+    
+    page.text(20, 200, f"Frame: {visit['frame_name'] or '-'}", size=9)
+    page.text(20, 215, f"Lens: {visit['lens_name'] or '-'}", size=9)
+    page.text(page.width / 2, page.height - 20, "Please bring this card on your next visit.",
+              size=8, align="center")
+    return page
+
+
+def invoice(customer, visit):
+    """Invoice page for the sale of one visit"""
+    page = Page(*INVOICE_SIZE)
+    _shop_header(page, "INVOICE")
+    
+    number = visit.get("product_id") or f"{customer['id']}-{visit['visit_date'] or ''}"
+    page.text(20, 70, f"Invoice No: {number}", size=10, bold=True)
+    page.text(page.width - 20, 70, f"Date: {visit['visit_date'] or '-'}", size=10, align="right")
+    
+    page.text(20, 100, "Bill To", size=9, bold=True)
+    page.text(20, 115, customer["name"] or "", size=11)
+    page.text(20, 130, f"Phone: {customer['phone'] or '-'}", size=9)
+    page.text(20, 145, f"Customer #{customer['id']}", size=9)
+    
+    # Items
+    top = 170
+    page.rect(20, top, page.width - 40, 20, gray=0.92)
+    page.text(26, top + 14, "Item", size=9, bold=True)
+    page.text(100, top + 14, "Description", size=9, bold=True)
+    page.text(page.width - 26, top + 14, "Amount", size=9, bold=True, align="right")
+    items = [("Frame", visit["frame_name"], visit["frame_paise"]),
+             ("Lens", visit["lens_name"], visit["lens_paise"])]
+    y = top + 20
+    for label, description, amount in items:
+        page.text(26, y + 15, label, size=10)
+        page.text(100, y + 15, description or "-", size=10)
+        page.text(page.width - 26, y + 15, format_amount(amount), size=10, align="right")
+        y += 22
+        page.line(20, y, page.width - 20, y)
+    
+    page.text(100, y + 18, "Total", size=11, bold=True)
+    page.text(page.width - 26, y + 18, format_amount(visit["total_paise"]), size=11, bold=True, align="right")
+    page.rect(20, top, page.width - 40, y + 26 - top)
+    
+    page.text(page.width / 2, page.height - 30, f"Thank you for choosing {SHOP_NAME.title()}.",
+              size=9, align="center")
+    return page
+
+
+RENDERERS = {"card": prescription_card, "invoice": invoice}
+
+
+def customer_pages(customer, visit_date=None, kinds=DOCUMENT_KINDS):
+    """Rendered pages for a customer's visits on visit_date (default: the latest visit)"""
+    visits = customer["visits"]
+    if visit_date is None:
+        visits = visits[:1]
+    else:
+        visits = [visit for visit in visits if visit["visit_date"] == visit_date]
+    return [RENDERERS[kind](customer, visit).render() for visit in visits for kind in kinds]
+
+
+def write_pdf(path, pages):
+    """Write rendered pages to a PDF file"""
+    with open(path, "wb") as f:
+        writer = PdfWriter(f)
+        for page in pages:
+            writer.add_page(page)
+        writer.close()
+
+
+def visits_between(conn, start_date, end_date):
+    """(customer_id, visit_date) of every visit in a date range, oldest first
+    
+    start_date and end_date are ISO dates; visits are matched on visit_day,
+    so dates typed day first are found too.
+    """
+    return conn.execute('''
+        SELECT DISTINCT customer_id, visit_date FROM prescriptions
+        WHERE visit_day BETWEEN ? AND ?
+        ORDER BY visit_day, customer_id
+    ''', (start_date, end_date)).fetchall()
+
+
+def _render_chunk(args):
+    """Process pool task: render the pages of a chunk of visits"""
+    db_path, visits, kinds = args
+    conn = database.connect_readonly(db_path)
+    try:
+        cursor = conn.cursor()
+        pages = []
+        for customer_id, visit_date in visits:
+            customer = database.query_customer_detail(cursor, customer_id)
+            if customer:
+                pages.extend(customer_pages(customer, visit_date, kinds))
+        return pages
+    finally:
+        conn.close()
+
+
+def render_batch(path, start_date, end_date, db_path=None, kinds=DOCUMENT_KINDS,
+                 workers=None, job=None):
+    """Render every visit in a date range into one PDF; returns the page count"""
+    db_path = db_path or database.get_db_path()
+    workers = workers or os.cpu_count() or 1
+    
+    conn = database.connect_readonly(db_path)
+    try:
+        visits = visits_between(conn, start_date, end_date)
+    finally:
+        conn.close()
+    chunks = [(db_path, visits[start:start + CHUNK_SIZE], kinds)
+              for start in range(0, len(visits), CHUNK_SIZE)]
+    
+    # Write to a temporary name so a cancelled batch leaves no broken file
+    partial_path = path + ".part"
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(chunks) > 1 else None
+    page_count = 0
+    try:
+        with open(partial_path, "wb") as f:
+            writer = PdfWriter(f)
+            # map() yields chunks in order, so pages stream out as they finish
+            results = pool.map(_render_chunk, chunks) if pool else map(_render_chunk, chunks)
+            for index, pages in enumerate(results):
+                for page in pages:
+                    writer.add_page(page)
+                page_count += len(pages)
+                if job:
+                    job.check_cancelled()
+                    done = min((index + 1) * CHUNK_SIZE, len(visits))
+                    job.report(done / len(visits), f"Rendered {done} of {len(visits)} visits")
+            writer.close()
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    return page_count
+
+
+def benchmark(count=1000):
+    """Time a batch of count visits with one process and with all cores"""
+    sample_prescription = {"right_sph": "-1.25", "right_cyl": "-0.50", "right_axe": "180",
+                           "left_sph": "-1.00", "left_cyl": "-0.25", "left_axe": "90"}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(db_path)
+        cursor = conn.cursor()
+        for i in range(count):
+            database.insert_customer(
+                cursor, f"Customer {i}", f"98{i:08d}", f"2024-01-{i % 28 + 1:02d}", sample_prescription,
+                {"frame_name": "Ray-Ban RB2140", "lens_name": "Blue Cut 1.56", "frame_paise": 250000,
+                 "lens_paise": 180000})
+        conn.commit()
+        conn.close()
+        
+        for workers in sorted({1, os.cpu_count() or 1}):
+            path = os.path.join(temp_dir, f"batch_{workers}.pdf")
+            start = time.perf_counter()
+            pages = render_batch(path, "2024-01-01", "2024-01-31", db_path, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"{workers} process(es): {count} visits, {pages} pages in {elapsed:.2f}s "
+                  f"({os.path.getsize(path) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prescription card and invoice PDFs")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark a batch of COUNT visits")
+    parser.add_argument("--from", dest="start", help="First visit date of a batch (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", default=date.today().isoformat(), help="Last visit date")
+    parser.add_argument("--out", default="documents.pdf", help="Output PDF file")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    elif args.start:
+        print(f"{render_batch(args.out, args.start, args.end)} pages written to {args.out}")
+    else:
+        parser.print_help()
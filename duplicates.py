@@ -0,0 +1,459 @@
+"""
+Fuzzy duplicate-customer detection for Shivam Opticals.
+
+Names are typed inconsistently ("Sharma R", "R. Sarma", "Ramesh Sharma"), so
+exact matching misses many duplicates while comparing every pair of customers
+does not scale. Each customer instead gets a few blocking keys, stored in the
+indexed ``customer_blocks`` table:
+
+* ``n:<soundex>:<soundex>`` for every pair of full words in the name
+* ``i:<soundex>:<initial>`` for every full word and the initial of another
+* ``p:<last seven phone digits>``
+
+Only customers sharing a key are compared. Full names are compared by the
+Dice coefficient of their character bigrams, which is cheap enough for large
+blocks; names written with initials ("R. Sarma") are compared word by word
+with Jaro-Winkler similarity, and only within ``i:`` blocks. Keys are
+refreshed incrementally, so only new or edited customers are re-keyed. Pairs
+marked "not a duplicate" are remembered.
+
+Run ``python duplicates.py --bench 500000`` to time a large database.
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+# Blocks larger than this are too common to be useful and are skipped rather
+# than compared pair by pair. Initial blocks ("Sharma R") are bigger but only
+# their abbreviated names are compared against the rest.
+MAX_BLOCK_SIZE = 200
+MAX_INITIAL_BLOCK_SIZE = 5000
+
+DEFAULT_THRESHOLD = 0.85
+
+# Adjustments to the name score when both customers have a phone number
+PHONE_MATCH_BONUS = 0.1
+PHONE_MISMATCH_PENALTY = 0.2
+
+TOKEN_RE = re.compile(r"[a-z]+")
+
+# A single letter standing alone, e.g. the "R" in "R. Sharma"
+ABBREVIATED_RE = re.compile(r"(?:^|[^a-z])[a-z](?![a-z])", re.IGNORECASE)
+
+_SOUNDEX_CODES = str.maketrans("bfpvcgjkqsxzdtlmnr", "111122222222334556")
+
+
+def install_duplicate_index(cursor):
+    """Create the blocking-key and dismissed-pair tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customer_blocks (
+            block_key TEXT NOT NULL,
+            customer_id INTEGER NOT NULL REFERENCES customers (id) ON DELETE CASCADE,
+            PRIMARY KEY (block_key, customer_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_customer_blocks_customer ON customer_blocks(customer_id)'
+    )
+    
+    # Name and phone each customer was keyed with, to find stale keys
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customer_block_state (
+            customer_id INTEGER PRIMARY KEY REFERENCES customers (id) ON DELETE CASCADE,
+            name_key TEXT,
+            phone_key TEXT
+        )
+    ''')
+    
+    # Pairs a user has marked as different people (smaller id first)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS duplicate_dismissed (
+            customer_a INTEGER NOT NULL REFERENCES customers (id) ON DELETE CASCADE,
+            customer_b INTEGER NOT NULL REFERENCES customers (id) ON DELETE CASCADE,
+            PRIMARY KEY (customer_a, customer_b)
+        ) WITHOUT ROWID
+    ''')
+
+
+def soundex(word):
+    """American Soundex code of a lowercase word"""
+    codes = word.translate(_SOUNDEX_CODES)
+    result = word[0].upper()
+    last = codes[0]
+    for char, code in zip(word[1:], codes[1:]):
+        if code.isdigit() and code != last:
+            result += code
+            if len(result) == 4:
+                return result
+        if char not in "hw":
+            last = code
+    return result.ljust(4, "0")
+
+
+def name_tokens(name):
+    """Lowercase words of a name"""
+    return TOKEN_RE.findall((name or "").lower())
+
+
+def blocking_keys(name, phone_key):
+    """Blocking keys for one customer"""
+    tokens = name_tokens(name)
+    words = [token for token in tokens if len(token) > 1]
+    codes = sorted({soundex(word) for word in words})
+    
+    keys = set()
+    if len(codes) == 1:
+        keys.add(f"n:{codes[0]}")
+    for i, code in enumerate(codes):
+        for other in codes[i + 1:]:
+            keys.add(f"n:{code}:{other}")
+    
+    for index, token in enumerate(tokens):
+        if len(token) < 2:
+            continue  # Initials only qualify another word
+        code = soundex(token)
+        keys.update(f"i:{code}:{other[0]}"
+                    for position, other in enumerate(tokens) if position != index)
+    
+    if phone_key and len(phone_key) >= 7:
+        keys.add(f"p:{phone_key[-7:]}")
+    return keys
+
+
+def name_record(name):
+    """Precomputed comparison data: (words, bigrams, abbreviated)"""
+    tokens = name_tokens(name)
+    bigrams = set()
+    for token in tokens:
+        padded = f" {token} "
+        bigrams.update(padded[i:i + 2] for i in range(len(padded) - 1))
+    abbreviated = any(len(token) == 1 for token in tokens)
+    return tokens, frozenset(bigrams), abbreviated
+
+
+def jaro_winkler(a, b):
+    """Jaro-Winkler similarity of two strings (0 to 1)"""
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+    
+    window = max(max(len_a, len_b) // 2 - 1, 0)
+    matched_b = [False] * len_b
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len_b, i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    if not matches_a:
+        return 0.0
+    
+    matches_b = [b[j] for j in range(len_b) if matched_b[j]]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    m = len(matches_a)
+    jaro = (m / len_a + m / len_b + (m - transpositions) / m) / 3
+    
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+def name_similarity(tokens_a, tokens_b):
+    """Similarity of two names given as word lists (0 to 1)
+    
+    Each word of the shorter name is matched to its best partner in the
+    longer one; an initial matches any word with the same first letter.
+    """
+    if not tokens_a or not tokens_b:
+        return 0.0
+    short, long = (tokens_a, tokens_b) if len(tokens_a) <= len(tokens_b) else (tokens_b, tokens_a)
+    
+    total = 0.0
+    for token in short:
+        best = 0.0
+        for other in long:
+            if len(token) == 1 or len(other) == 1:
+                score = 0.9 if token[0] == other[0] else 0.0
+            else:
+                score = jaro_winkler(token, other)
+            if score > best:
+                best = score
+        total += best
+    
+    # Missing words count for a little
+    return total / len(short) * (len(short) / len(long)) ** 0.1
+
+
+def name_score(a, b):
+    """Similarity of two name records (0 to 1)"""
+    if a[2] or b[2]:
+        return name_similarity(a[0], b[0])
+    if a[1] and b[1]:
+        return 2 * len(a[1] & b[1]) / (len(a[1]) + len(b[1]))
+    return 0.0
+
+
+def compare_blocks(blocks, records, threshold, dismissed=frozenset()):
+    """Scored candidate pairs within blocks; returns {(id_a, id_b): score}
+    
+    blocks is a list of (block_key, customer ids) and records maps ids to
+    (name, phone_key). In initial blocks only pairs involving an abbreviated
+    name are compared.
+    """
+    # A different phone number costs more than any name can make up for
+    # unless the threshold is low
+    skip_phone_mismatch = 1.0 - PHONE_MISMATCH_PENALTY < threshold
+    
+    parsed = {}
+    
+    def parse(customer_id):
+        record = parsed.get(customer_id)
+        if record is None:
+            record = parsed[customer_id] = name_record(records[customer_id][0])
+        return record
+    
+    found = {}
+    seen = set()
+    for block_key, ids in blocks:
+        initial_block = block_key.startswith("i:")
+        for position, id_a in enumerate(ids):
+            name_a, phone_a = records[id_a]
+            if initial_block:
+                if not ABBREVIATED_RE.search(name_a or ""):
+                    continue
+                others = ids
+            else:
+                others = ids[position + 1:]
+            
+            for id_b in others:
+                phone_b = records[id_b][1]
+                phones_differ = bool(phone_a and phone_b and phone_a != phone_b)
+                if (phones_differ and skip_phone_mismatch) or id_b == id_a:
+                    continue
+                pair = (id_a, id_b) if id_a < id_b else (id_b, id_a)
+                if pair in seen or pair in dismissed:
+                    continue
+                seen.add(pair)
+                
+                score = name_score(parse(id_a), parse(id_b))
+                if phones_differ:
+                    score -= PHONE_MISMATCH_PENALTY
+                elif phone_a and phone_b:
+                    score = min(score + PHONE_MATCH_BONUS, 1.0)
+                if score >= threshold:
+                    found[pair] = score
+    return found
+
+
+def _compare_chunk(args):
+    """Process-pool entry point for compare_blocks"""
+    return compare_blocks(*args)
+
+
+class DuplicateFinder:
+    """Maintain blocking keys and find likely duplicate customers"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def refresh_keys(self, job=None, batch_size=1000):
+        """Re-key new and edited customers; returns how many were keyed
+        
+        Each batch commits on its own, so saves queued meanwhile get the
+        write lock between batches. A customer's keys and key state are
+        written in the same batch, so a cancelled run resumes where it
+        stopped.
+        """
+        cursor = self.conn.cursor()
+        stale = cursor.execute('''
+            SELECT c.id, c.name, c.name_key, c.phone_key, s.customer_id IS NOT NULL
+            FROM customers c
+            LEFT JOIN customer_block_state s ON s.customer_id = c.id
+            WHERE s.customer_id IS NULL
+               OR s.name_key IS NOT c.name_key
+               OR s.phone_key IS NOT c.phone_key
+        ''').fetchall()
+        
+        for start in range(0, len(stale), batch_size):
+            if job:
+                job.check_cancelled()
+                job.report(start / len(stale) / 2, f"Indexing customers ({start}/{len(stale)})")
+            batch = stale[start:start + batch_size]
+            
+            cursor.execute("BEGIN")
+            try:
+                # Drop old keys of customers that were keyed before
+                cursor.executemany("DELETE FROM customer_blocks WHERE customer_id = ?",
+                                   [(row[0],) for row in batch if row[4]])
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO customer_blocks (block_key, customer_id) VALUES (?, ?)",
+                    sorted((key, row[0]) for row in batch for key in blocking_keys(row[1], row[3]))
+                )
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO customer_block_state (customer_id, name_key, phone_key) "
+                    "VALUES (?, ?, ?)",
+                    [(row[0], row[2], row[3]) for row in batch]
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return len(stale)
+    
+    def find(self, threshold=DEFAULT_THRESHOLD, workers=1, job=None, limit=None):
+        """Likely duplicate pairs, best first
+        
+        Returns a list of (score, keeper, duplicate) where each customer is a
+        (id, name, phone, date) tuple and the keeper is the older record.
+        With workers > 1 the comparisons run in a process pool.
+        """
+        cursor = self.conn.cursor()
+        if job:
+            job.report(0.5, "Collecting candidate blocks")
+        
+        rows = cursor.execute('''
+            SELECT block_key, customer_id FROM customer_blocks
+            WHERE block_key IN (
+                SELECT block_key FROM customer_blocks
+                GROUP BY block_key
+                HAVING COUNT(*) >= 2
+                   AND COUNT(*) <= CASE WHEN block_key LIKE 'i:%' THEN ? ELSE ? END
+            )
+            ORDER BY block_key
+        ''', (MAX_INITIAL_BLOCK_SIZE, MAX_BLOCK_SIZE)).fetchall()
+        blocks = [(block_key, [customer_id for _, customer_id in group])
+                  for block_key, group in groupby(rows, key=lambda row: row[0])]
+        
+        wanted = {customer_id for _, ids in blocks for customer_id in ids}
+        records = {}
+        for customer_id, name, phone_key in cursor.execute(
+                "SELECT id, name, phone_key FROM customers"):
+            if customer_id in wanted:
+                records[customer_id] = (name, phone_key)
+        dismissed = frozenset(cursor.execute(
+            "SELECT customer_a, customer_b FROM duplicate_dismissed"
+        ).fetchall())
+        
+        if job:
+            job.check_cancelled()
+            job.report(0.6, f"Comparing {len(blocks)} blocks")
+        
+        if workers > 1 and len(blocks) > 1:
+            found = {}
+            chunk_size = max(1, len(blocks) // (workers * 4))
+            chunks = []
+            for start in range(0, len(blocks), chunk_size):
+                chunk = blocks[start:start + chunk_size]
+                chunk_records = {customer_id: records[customer_id]
+                                 for _, ids in chunk for customer_id in ids}
+                chunks.append((chunk, chunk_records, threshold, dismissed))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for index, result in enumerate(pool.map(_compare_chunk, chunks)):
+                    found.update(result)
+                    if job:
+                        job.check_cancelled()
+                        job.report(0.6 + 0.3 * (index + 1) / len(chunks), "Comparing names")
+        else:
+            found = compare_blocks(blocks, records, threshold, dismissed)
+        
+        ranked = sorted(found.items(), key=lambda item: -item[1])
+        if limit is not None:
+            ranked = ranked[:limit]
+        
+        # Details of the customers in the reported pairs
+        details = {}
+        ids = list({customer_id for pair, _ in ranked for customer_id in pair})
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in part)
+            for row in cursor.execute(
+                    f"SELECT id, name, phone, date, created_at FROM customers WHERE id IN ({placeholders})",
+                    part):
+                details[row[0]] = row
+        
+        results = []
+        for (id_a, id_b), score in ranked:
+            a, b = details[id_a], details[id_b]
+            keeper, duplicate = (a, b) if (a[4] or "", a[0]) <= (b[4] or "", b[0]) else (b, a)
+            results.append((score, keeper[:4], duplicate[:4]))
+        return results
+
+
+def dismiss_pair(cursor, id_a, id_b):
+    """Remember that two customers are different people"""
+    cursor.execute(
+        "INSERT OR IGNORE INTO duplicate_dismissed (customer_a, customer_b) VALUES (?, ?)",
+        (min(id_a, id_b), max(id_a, id_b))
+    )
+
+
+def benchmark(count=500000, workers=1):
+    """Time keying and duplicate search on a synthetic database"""
+    import database
+    
+    syllables = ["ra", "me", "sh", "ku", "ma", "an", "ni", "ta", "de", "vi", "pr", "ak",
+                 "su", "ni", "la", "go", "pa", "la", "ha", "ri", "ja", "ya", "ch", "nd"]
+    
+    def random_word(rng):
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+    
+    def typo(word, rng):
+        position = rng.randrange(1, len(word))
+        return word[:position] + word[position + 1:]
+    
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        rows = []
+        for _ in range(count):
+            first, last = random_word(rng), random_word(rng)
+            phone = f"9{rng.randrange(10 ** 9):09d}"
+            rows.append((f"{first} {last}", phone))
+            if rng.random() < 0.02:
+                # Near-duplicate: initial, misspelt surname, same phone
+                rows.append((f"{last} {first[0]}" if rng.random() < 0.5
+                             else f"{first} {typo(last, rng)}", phone))
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO sync_guard (active) VALUES (1)")
+        conn.executemany("INSERT INTO customers (name, phone, date) VALUES (?, ?, '2024-01-01')", rows)
+        conn.execute("DELETE FROM sync_guard")
+        conn.commit()
+        print(f"{len(rows)} customers")
+        
+        finder = DuplicateFinder(conn)
+        start = time.perf_counter()
+        keyed = finder.refresh_keys()
+        print(f"Keyed {keyed} customers in {time.perf_counter() - start:.1f}s")
+        
+        start = time.perf_counter()
+        pairs = finder.find(workers=workers)
+        print(f"Found {len(pairs)} likely duplicates in {time.perf_counter() - start:.1f}s "
+              f"({workers} worker{'s' if workers != 1 else ''})")
+        
+        start = time.perf_counter()
+        finder.refresh_keys()
+        print(f"Incremental refresh with no changes: {time.perf_counter() - start:.2f}s")
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Duplicate customer detection")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used for comparing")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench, args.workers)
+    else:
+        parser.print_help()
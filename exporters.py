@@ -0,0 +1,463 @@
+"""
+Customer data exports for Shivam Opticals.
+
+Exports read customers, prescriptions and products from one read snapshot
+(see ``database.read_snapshot``) and write them as
+
+* CSV files, one per table;
+* a JSON Lines file with one line per row and its table name;
+* a gzip-compressed JSON Lines file with one line per customer, holding the
+  customer's prescriptions and products;
+* an SQLite snapshot: a database file with the three tables, their
+  customer indexes and an ``export_info`` table;
+* an Excel workbook.
+
+All but the workbook are written while the rows are read: rows are fetched
+a batch at a time and the three tables are joined by walking them in
+customer order along their indexes, so memory use does not grow with the
+database. Excel workbooks are built in memory by pandas and are meant for
+the smaller exports people open themselves. Progress is reported with the
+rows written per second.
+
+Incremental exports only contain rows inserted or updated since the last
+successful incremental export. The high-water mark is the newest
+``updated_at`` seen in the snapshot; it is stored in the ``settings`` table
+only after the file has been written. Rows are selected with
+``updated_at >= watermark``: timestamps have one-second resolution, so rows
+of the watermark second are sent again rather than risk missing one that
+was committed later in the same second. Receivers should upsert by ``uuid``.
+In the per-customer format a customer is exported, with all their visits,
+when it or any of its visits changed. Deletions are not exported (branch
+sync carries those).
+
+Costs are exported as stored, in whole paise, except in Excel workbooks,
+which are read by people and show them in rupees.
+
+Run ``python exporters.py --bench 100000`` to compare the formats.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+
+log = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "xlsx": "Excel workbook",
+    "csv": "CSV files",
+    "jsonl": "JSON Lines",
+    "jsonl.gz": "JSON Lines, gzip",
+    "sqlite": "SQLite snapshot",
+}
+
+WATERMARK_KEY = "export_watermark"
+
+# Columns exported per table, parents first
+EXPORT_COLUMNS = {
+    "customers": ["id", "uuid", "name", "phone", "date", "created_at", "updated_at"],
+    "prescriptions": ["id", "uuid", "customer_id", "visit_date"] + database.PRESCRIPTION_FIELDS
+                     + ["created_at", "updated_at"],
+    "products": ["id", "uuid", "customer_id", "prescription_id", "visit_date"] + database.PRODUCT_FIELDS
+                + ["created_at", "updated_at"],
+}
+
+SHEET_NAMES = {"customers": "Customers", "prescriptions": "Prescriptions", "products": "Products"}
+
+# Paise columns and their rupee headings in Excel workbooks
+RUPEE_COLUMNS = {"frame_paise": "frame_cost", "lens_paise": "lens_cost", "total_paise": "total_cost"}
+
+# Rows fetched from SQLite at a time
+FETCH_ROWS = 1000
+# Rows written between progress reports (and cancellation checks)
+REPORT_ROWS = 20000
+GZIP_LEVEL = 6
+
+
+def get_watermark(conn):
+    """updated_at of the newest row in the last incremental export, or None"""
+    return database.get_setting(conn, WATERMARK_KEY)
+
+
+def save_watermark(cursor, watermark):
+    """Store the high-water mark (run through the write queue)"""
+    cursor.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+        (WATERMARK_KEY, watermark)
+    )
+
+
+def customer_conditions(search_term="", since=None, with_visits=False):
+    """WHERE conditions and parameters selecting the customers to export
+    
+    ``search_term`` matches the way the customer list search does. With
+    ``with_visits`` a customer also counts as changed when one of its
+    prescriptions or products changed.
+    """
+    conditions = []
+    params = []
+    if since is not None:
+        if with_visits:
+            conditions.append('''(updated_at >= ?
+                OR id IN (SELECT customer_id FROM prescriptions WHERE updated_at >= ?)
+                OR id IN (SELECT customer_id FROM products WHERE updated_at >= ?))''')
+            params.extend([since] * 3)
+        else:
+            conditions.append("updated_at >= ?")
+            params.append(since)
+    if search_term:
+        conditions.append('''(name LIKE ? OR phone LIKE ? OR id IN (
+            SELECT customer_id FROM products WHERE frame_name LIKE ?))''')
+        like_term = f"%{search_term}%"
+        params.extend([like_term, like_term, like_term])
+    return conditions, params
+
+
+def export_query(table, search_term="", since=None, order=None):
+    """SELECT of one table's rows to export; returns (sql, params)
+    
+    Prescriptions and products of a search export are those of the
+    matching customers. ``order`` defaults to newest customers first and
+    ids for the other tables.
+    """
+    if table == "customers":
+        conditions, params = customer_conditions(search_term, since)
+    else:
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("updated_at >= ?")
+            params.append(since)
+        if search_term:
+            customer_where, customer_params = customer_conditions(search_term)
+            conditions.append(f"customer_id IN (SELECT id FROM customers WHERE {' AND '.join(customer_where)})")
+            params.extend(customer_params)
+    
+    query = f"SELECT {', '.join(EXPORT_COLUMNS[table])} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY " + (order or ("date DESC, id" if table == "customers" else "id"))
+    return query, params
+
+
+def snapshot_watermark(conn):
+    """Newest updated_at in the snapshot"""
+    latest = " UNION ALL ".join(f"SELECT MAX(updated_at) AS latest FROM {table}" for table in EXPORT_COLUMNS)
+    return conn.execute(f"SELECT MAX(latest) FROM ({latest})").fetchone()[0]
+
+
+def read_export(conn, search_term="", since=None):
+    """Rows to export as {table: (columns, rows)} plus the snapshot's watermark
+    
+    Call inside database.read_snapshot() so the tables and the watermark
+    agree. Every row is held in memory; the streaming formats use
+    export_query() directly.
+    """
+    tables = {}
+    for table, columns in EXPORT_COLUMNS.items():
+        tables[table] = (columns, conn.execute(*export_query(table, search_term, since)).fetchall())
+    return tables, snapshot_watermark(conn)
+
+
+def csv_paths(path):
+    """One CSV file per table, named after the chosen file"""
+    stem = os.path.splitext(path)[0]
+    return {table: f"{stem}_{table}.csv" for table in EXPORT_COLUMNS}
+
+
+def output_paths(path, fmt):
+    """Files an export to path writes, by table for CSV"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return csv_paths(path) if fmt == "csv" else {None: path}
+
+
+@contextmanager
+def partial_files(targets):
+    """Temporary names for the target files, renamed once the block succeeds
+    
+    A failed or cancelled export never leaves a partial file behind.
+    """
+    # Keep the real extension last: writers such as openpyxl check it
+    partials = {key: "{0}.part{1}".format(*os.path.splitext(target)) for key, target in targets.items()}
+    try:
+        yield partials
+        for key, partial in partials.items():
+            os.replace(partial, targets[key])
+    except BaseException:
+        for partial in partials.values():
+            if os.path.exists(partial):
+                os.remove(partial)
+        raise
+
+
+class Progress:
+    """Rows written so far, reported to a job with the rate"""
+    
+    def __init__(self, job=None):
+        self.job = job
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.stage = ""
+        self.fraction = 0.0
+        self._next_report = REPORT_ROWS
+    
+    def start(self, stage, fraction):
+        self.stage = stage
+        self.fraction = fraction
+        if self.job:
+            self.job.check_cancelled()
+            self.job.report(fraction, stage)
+    
+    def add(self, rows):
+        self.rows += rows
+        if self.job and self.rows >= self._next_report:
+            self._next_report = self.rows + REPORT_ROWS
+            self.job.check_cancelled()
+            self.job.report(self.fraction, f"{self.stage}: {self.rows:,} rows, {self.rate():,.0f} rows/s")
+    
+    def seconds(self):
+        return time.perf_counter() - self.started
+    
+    def rate(self):
+        """Rows written per second"""
+        seconds = self.seconds()
+        return self.rows / seconds if seconds > 0 else 0.0
+
+
+def batches(cursor):
+    """Rows of an executed query, FETCH_ROWS at a time"""
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            return
+        yield rows
+
+
+def _write_csv(partials, conn, search_term, since, progress):
+    counts = {}
+    for index, (table, path) in enumerate(partials.items()):
+        progress.start(f"Writing {table}", index / len(partials))
+        counts[table] = 0
+        # utf-8-sig so Excel recognises the encoding when the file is opened
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS[table])
+            for rows in batches(conn.execute(*export_query(table, search_term, since))):
+                writer.writerows(rows)
+                counts[table] += len(rows)
+                progress.add(len(rows))
+    return counts
+
+
+def _write_jsonl(partials, conn, search_term, since, progress):
+    counts = {}
+    with open(partials[None], "w", encoding="utf-8") as f:
+        for index, (table, columns) in enumerate(EXPORT_COLUMNS.items()):
+            progress.start(f"Writing {table}", index / len(EXPORT_COLUMNS))
+            counts[table] = 0
+            for rows in batches(conn.execute(*export_query(table, search_term, since))):
+                for row in rows:
+                    record = {"table": table}
+                    record.update(zip(columns, row))
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                counts[table] += len(rows)
+                progress.add(len(rows))
+    return counts
+
+
+class _ByCustomer:
+    """Rows of a query ordered by customer_id (its first column), handed out per customer"""
+    
+    def __init__(self, cursor):
+        self.rows = iter(cursor)
+        self.pending = next(self.rows, None)
+    
+    def take(self, customer_id):
+        """Rows of one customer; customers must be asked for in increasing id order"""
+        while self.pending is not None and (self.pending[0] is None or self.pending[0] < customer_id):
+            self.pending = next(self.rows, None)  # Not a customer being exported
+        found = []
+        while self.pending is not None and self.pending[0] == customer_id:
+            found.append(self.pending)
+            self.pending = next(self.rows, None)
+        return found
+
+
+def _write_jsonl_gz(partials, conn, search_term, since, progress):
+    progress.start("Writing customers", 0.0)
+    conditions, params = customer_conditions(search_term, since, with_visits=True)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    customers = conn.execute(
+        f"SELECT {', '.join(EXPORT_COLUMNS['customers'])} FROM customers{where} ORDER BY id", params)
+    
+    # Each visit table walked along its (customer_id, visit_date) index
+    visits = {}
+    for table in ("prescriptions", "products"):
+        # customer_id first, for _ByCustomer
+        columns = [column for column in EXPORT_COLUMNS[table] if column != "customer_id"]
+        query = f"SELECT customer_id, {', '.join(columns)} FROM {table}"
+        if conditions:
+            query += f" WHERE customer_id IN (SELECT id FROM customers{where})"
+        query += " ORDER BY customer_id, visit_date, id"
+        visits[table] = (columns, _ByCustomer(conn.execute(query, params if conditions else [])))
+    
+    counts = dict.fromkeys(EXPORT_COLUMNS, 0)
+    columns = EXPORT_COLUMNS["customers"]
+    with gzip.open(partials[None], "wt", encoding="utf-8", compresslevel=GZIP_LEVEL) as f:
+        for rows in batches(customers):
+            lines = []
+            written = len(rows)
+            for row in rows:
+                record = dict(zip(columns, row))
+                for table, (visit_columns, by_customer) in visits.items():
+                    found = by_customer.take(row[0])
+                    record[table] = [dict(zip(visit_columns, visit[1:])) for visit in found]
+                    counts[table] += len(found)
+                    written += len(found)
+                lines.append(json.dumps(record, ensure_ascii=False))
+            f.write("\n".join(lines) + "\n")
+            counts["customers"] += len(rows)
+            progress.add(written)
+    return counts
+
+
+def _write_sqlite(partials, conn, search_term, since, progress):
+    target = sqlite3.connect(partials[None])
+    try:
+        # A new file that is only renamed into place once complete
+        target.execute("PRAGMA journal_mode = OFF")
+        target.execute("PRAGMA synchronous = OFF")
+        counts = {}
+        for index, (table, columns) in enumerate(EXPORT_COLUMNS.items()):
+            progress.start(f"Copying {table}", index / len(EXPORT_COLUMNS))
+            types = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+            definitions = ", ".join("id INTEGER PRIMARY KEY" if column == "id"
+                                    else f"{column} {types.get(column, '')}".rstrip() for column in columns)
+            target.execute(f"CREATE TABLE {table} ({definitions})")
+            
+            insert = f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})"
+            counts[table] = 0
+            for rows in batches(conn.execute(*export_query(table, search_term, since, order="id"))):
+                target.executemany(insert, rows)
+                counts[table] += len(rows)
+                progress.add(len(rows))
+        
+        for table in ("prescriptions", "products"):
+            target.execute(f"CREATE INDEX idx_{table}_customer ON {table}(customer_id, visit_date)")
+        target.execute("CREATE TABLE export_info (key TEXT PRIMARY KEY, value TEXT)")
+        target.executemany("INSERT INTO export_info (key, value) VALUES (?, ?)", [
+            ("exported_at", datetime.now().isoformat(timespec="seconds")),
+            ("watermark", snapshot_watermark(conn)),
+            ("changed_since", since),
+            ("search", search_term or None),
+        ])
+        target.commit()
+    finally:
+        target.close()
+    return counts
+
+
+def _write_xlsx(path, tables):
+    import pandas as pd
+    
+    frames = {table: pd.DataFrame(rows, columns=columns) for table, (columns, rows) in tables.items()}
+    products_columns, products_rows = tables["products"]
+    total_index = products_columns.index("total_paise")
+    revenue = sum(row[total_index] or 0 for row in products_rows)  # Exact, in paise
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for table, frame in frames.items():
+            for column in RUPEE_COLUMNS:
+                if column in frame:
+                    frame[column] = frame[column] / 100
+            frame = frame.rename(columns=RUPEE_COLUMNS)
+            frame.to_excel(writer, sheet_name=SHEET_NAMES[table], index=False)
+        
+        # Create a summary sheet
+        summary_df = pd.DataFrame({
+            'Category': ['Total Customers', 'Total Revenue'],
+            'Count': [len(frames["customers"]), revenue / 100]
+        })
+        summary_df.to_excel(writer, sheet_name='Summary', index=False)
+
+
+STREAM_WRITERS = {
+    "csv": _write_csv,
+    "jsonl": _write_jsonl,
+    "jsonl.gz": _write_jsonl_gz,
+    "sqlite": _write_sqlite,
+}
+
+
+def export(path, fmt="xlsx", search_term="", incremental=False, db_path=None, job=None):
+    """Export from a read-only snapshot; returns (files, row counts, watermark, rows per second)
+    
+    For incremental exports the caller stores the returned watermark with
+    save_watermark() once it is satisfied the export succeeded.
+    """
+    targets = output_paths(path, fmt)
+    progress = Progress(job)
+    conn = database.connect_readonly(db_path)
+    try:
+        since = get_watermark(conn) if incremental else None
+        with partial_files(targets) as partials:
+            with database.read_snapshot(conn, "Export"):
+                watermark = snapshot_watermark(conn)
+                if fmt == "xlsx":
+                    progress.start("Reading changes" if incremental else "Reading customers", 0.0)
+                    tables, _ = read_export(conn, search_term, since)
+                else:
+                    counts = STREAM_WRITERS[fmt](partials, conn, search_term, since, progress)
+            
+            if fmt == "xlsx":
+                # Written after the snapshot ends; pandas is slow
+                progress.start("Writing workbook", 0.5)
+                _write_xlsx(partials[None], tables)
+                counts = {table: len(rows) for table, (_, rows) in tables.items()}
+                progress.add(sum(counts.values()))
+    finally:
+        conn.close()
+    
+    rate = progress.rate()
+    log.info("Export written", extra={"fields": {
+        "format": fmt, "rows": sum(counts.values()), "seconds": round(progress.seconds(), 3),
+        "rows_per_second": round(rate), "incremental": incremental}})
+    return list(targets.values()), counts, watermark or since, rate
+
+
+def benchmark(count=100000):
+    """Write every streaming format from a database of count customers"""
+    sample = ({"right_sph": "-1.25", "left_sph": "-1.00"},
+              {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(db_path)
+        cursor = conn.cursor()
+        for i in range(count):
+            database.insert_customer(cursor, f"Customer {i}", f"9{i:09d}", "2024-01-01", *sample)
+        conn.commit()
+        conn.close()
+        
+        for fmt in STREAM_WRITERS:
+            path = os.path.join(temp_dir, f"export.{fmt}")
+            files, counts, _, rate = export(path, fmt, db_path=db_path)
+            size = sum(os.path.getsize(file) for file in files)
+            print(f"{EXPORT_FORMATS[fmt]:42} {sum(counts.values()):8} rows  {rate:10,.0f} rows/s  "
+                  f"{size / 1024 / 1024:7.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Customer data exports")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
@@ -0,0 +1,304 @@
+"""
+Typo-tolerant customer name search for Shivam Opticals.
+
+A misspelt name ("Ramseh Sharma") matches nothing with ``=`` or ``LIKE``.
+This module finds names within a small edit distance (insertions,
+deletions, substitutions and swapped neighbours each count as one edit)
+without comparing the search against every customer.
+
+Every distinct normalised name is split into trigrams, the three-character
+windows of ``"  ramesh sharma "``, stored in the indexed ``name_trigrams``
+table together with the name's length. One edit changes at most four
+windows (three for a single character, four for a swap), so a name within
+two edits still has all but eight of the search's distinct trigrams. A
+search counts, in one grouped SQLite query over the postings of its
+trigrams and of names within two characters of its length, how many each
+name shares. Names with enough in common whose letters differ from the
+search's by no more than two are checked with an edit distance that only
+fills the cells near the diagonal and stops once every cell is over two.
+Searches with nine trigrams or fewer only need one
+in common; matches sharing none are not found, which only happens for very
+short names.
+
+New and renamed customers are queued in ``fuzzy_pending`` by triggers.
+Searches also check the queued names, so results never lag behind saves;
+``index_pending`` moves the queue into the index in small batches through
+the write queue, after start-up and after each typo-tolerant search. On
+first use every existing name is queued.
+
+Run ``python fuzzy.py --bench 500000`` to time searches on a large database.
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import weakref
+
+log = logging.getLogger(__name__)
+
+MAX_DISTANCE = 2
+MAX_MATCHES = 50
+
+# Names moved from the queue into the index per write
+REFRESH_BATCH = 1000
+
+# Queued names a search checks directly; a longer queue (the first build)
+# makes results incomplete until it has been indexed
+PENDING_SCAN_LIMIT = 2000
+
+FORM_RE = re.compile(r"[^\W_]+")
+
+# Write queues currently draining the queue, so searches don't start a second run
+_draining = weakref.WeakSet()
+_draining_lock = threading.Lock()
+
+
+def install_fuzzy_index(cursor):
+    """Create the trigram tables and the triggers that queue new names"""
+    seed = cursor.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'name_trigrams'"
+    ).fetchone()[0] == 0
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS name_trigrams (
+            trigram TEXT NOT NULL,
+            length INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            PRIMARY KEY (trigram, length, name_key)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Names in the index, and names waiting to be added
+    cursor.execute('CREATE TABLE IF NOT EXISTS fuzzy_indexed (name_key TEXT PRIMARY KEY) WITHOUT ROWID')
+    cursor.execute('CREATE TABLE IF NOT EXISTS fuzzy_pending (name_key TEXT PRIMARY KEY) WITHOUT ROWID')
+    for event in ("INSERT", "UPDATE OF name"):
+        trigger = "queue_fuzzy_insert" if event == "INSERT" else "queue_fuzzy_rename"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {trigger}
+            AFTER {event} ON customers
+            WHEN NEW.name_key != ''
+            BEGIN
+                INSERT OR IGNORE INTO fuzzy_pending (name_key) VALUES (NEW.name_key);
+            END
+        ''')
+    
+    if seed:
+        cursor.execute(
+            "INSERT OR IGNORE INTO fuzzy_pending (name_key) "
+            "SELECT DISTINCT name_key FROM customers WHERE name_key != ''"
+        )
+
+
+def name_form(name):
+    """Lowercase letters and digits of a name, one space between words"""
+    return " ".join(FORM_RE.findall((name or "").casefold()))
+
+
+def trigrams(form):
+    """Distinct three-character windows of a normalised name"""
+    padded = f"  {form} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit=MAX_DISTANCE):
+    """Edits (with swapped neighbours as one) from a to b, or None if more than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    if a == b:
+        return 0
+    # Only cells within limit of the diagonal can stay within limit; the
+    # rest are left at limit + 1
+    over = limit + 1
+    before = None
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        char = a[i - 1]
+        current = [over] * (len(b) + 1)
+        current[0] = row_best = i if i <= limit else over
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            value = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if before is not None and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] \
+                    and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < row_best:
+                row_best = value
+        if row_best > limit:
+            return None
+        before, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def refresh_index(cursor, limit=REFRESH_BATCH):
+    """Move up to limit queued names into the index; returns how many were moved"""
+    keys = [row[0] for row in cursor.execute("SELECT name_key FROM fuzzy_pending LIMIT ?", (limit,))]
+    if not keys:
+        return 0
+    placeholders = ",".join("?" * len(keys))
+    indexed = {row[0] for row in cursor.execute(
+        f"SELECT name_key FROM fuzzy_indexed WHERE name_key IN ({placeholders})", keys)}
+    
+    postings = []
+    for key in keys:
+        if key not in indexed:
+            form = name_form(key)
+            postings.extend((trigram, len(form), key) for trigram in trigrams(form))
+    postings.sort()
+    cursor.executemany(
+        "INSERT OR IGNORE INTO name_trigrams (trigram, length, name_key) VALUES (?, ?, ?)", postings)
+    cursor.executemany("INSERT OR IGNORE INTO fuzzy_indexed (name_key) VALUES (?)",
+                       [(key,) for key in keys if key not in indexed])
+    cursor.execute(f"DELETE FROM fuzzy_pending WHERE name_key IN ({placeholders})", keys)
+    return len(keys)
+
+
+def search_names(cursor, text, max_distance=MAX_DISTANCE, limit=MAX_MATCHES):
+    """Names within max_distance edits of text; returns ([(distance, name_key)], complete)
+    
+    Closest names come first. ``complete`` is False while the index is
+    still being built and some names were not looked at.
+    """
+    query = name_form(text)
+    if not query:
+        return [], True
+    grams = sorted(trigrams(query))
+    shared = max(1, len(grams) - 4 * max_distance)
+    cursor.execute(
+        f'''SELECT name_key FROM name_trigrams
+           WHERE trigram IN ({",".join("?" * len(grams))}) AND length BETWEEN ? AND ?
+           GROUP BY name_key
+           HAVING COUNT(*) >= ?''',
+        grams + [len(query) - max_distance, len(query) + max_distance, shared])
+    candidates = {row[0] for row in cursor}
+    
+    # Names saved since the last refresh
+    pending = [row[0] for row in cursor.execute(
+        "SELECT name_key FROM fuzzy_pending LIMIT ?", (PENDING_SCAN_LIMIT + 1,))]
+    complete = len(pending) <= PENDING_SCAN_LIMIT
+    candidates.update(pending[:PENDING_SCAN_LIMIT])
+    
+    # Each edit adds or removes at most one distinct character, a cheap
+    # test that rules out most candidates before the edit distance
+    letters = set(query)
+    matches = []
+    for key in candidates:
+        form = name_form(key)
+        other = set(form)
+        if len(other - letters) > max_distance or len(letters - other) > max_distance:
+            continue
+        distance = edit_distance(query, form, max_distance)
+        if distance is not None:
+            matches.append((distance, key))
+    matches.sort()
+    return matches[:limit], complete
+
+
+def pending_count(cursor):
+    """Names waiting to be indexed"""
+    return cursor.execute("SELECT COUNT(*) FROM fuzzy_pending").fetchone()[0]
+
+
+def index_pending(writes):
+    """Index every queued name through a WriteQueue, one batch per write, without waiting
+    
+    Each batch is submitted when the previous one has been committed, so
+    saves queued in between are not held up by a large first build.
+    """
+    with _draining_lock:
+        if writes in _draining:
+            return
+        _draining.add(writes)
+    
+    def next_batch(future=None):
+        if future is not None and future.exception() is not None:
+            log.warning("Indexing names failed: %s", future.exception())
+        elif future is None or future.result() == REFRESH_BATCH:
+            try:
+                writes.submit(refresh_index).add_done_callback(next_batch)
+                return
+            except RuntimeError:
+                pass  # The queue has been closed
+        with _draining_lock:
+            _draining.discard(writes)
+    
+    next_batch()
+
+
+def benchmark(count=500000, searches=200):
+    """Index count synthetic customers and time misspelt searches"""
+    import database
+    
+    syllables = ["ra", "me", "sh", "ku", "ma", "an", "ni", "ta", "de", "vi", "pr", "ak",
+                 "su", "ni", "la", "go", "pa", "la", "ha", "ri", "ja", "ya", "ch", "nd"]
+    
+    def random_word(rng):
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+    
+    def misspell(name, rng):
+        for _ in range(rng.randint(1, 2)):
+            position = rng.randrange(1, len(name) - 1)
+            edit = rng.choice(("drop", "swap", "change"))
+            if edit == "drop":
+                name = name[:position] + name[position + 1:]
+            elif edit == "swap":
+                name = name[:position] + name[position + 1] + name[position] + name[position + 2:]
+            else:
+                name = name[:position] + rng.choice("aeiouhnrst") + name[position + 1:]
+        return name
+    
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        names = [f"{random_word(rng)} {random_word(rng)}" for _ in range(count)]
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO sync_guard (active) VALUES (1)")
+        conn.executemany("INSERT INTO customers (name, phone, date) VALUES (?, '', '2024-01-01')",
+                         ((name,) for name in names))
+        conn.execute("DELETE FROM sync_guard")
+        conn.commit()
+        
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        queued = pending_count(cursor)
+        while refresh_index(cursor, 20000):
+            pass
+        conn.commit()
+        print(f"{count} customers, {queued} distinct names indexed in {time.perf_counter() - start:.1f}s")
+        
+        timings = []
+        reachable = found = 0
+        for _ in range(searches):
+            name = rng.choice(names)
+            typed = misspell(name, rng)
+            start = time.perf_counter()
+            matches, _ = search_names(cursor, typed)
+            timings.append(time.perf_counter() - start)
+            # Edits at neighbouring positions can add up to more than two
+            if edit_distance(name_form(typed), name_form(name)) is not None:
+                reachable += 1
+                found += any(key == name.lower() for _, key in matches)
+        timings.sort()
+        print(f"Misspelt searches: median {timings[len(timings) // 2] * 1000:.1f} ms, "
+              f"95% {timings[int(len(timings) * 0.95)] * 1000:.1f} ms, "
+              f"worst {timings[-1] * 1000:.1f} ms; intended name found for {found} of {reachable} "
+              f"misspellings within {MAX_DISTANCE} edits")
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Typo-tolerant name search")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
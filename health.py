@@ -0,0 +1,347 @@
+"""
+Database and application health for Shivam Opticals.
+
+The Health panel in the Tools tab shows what a store needs to know before
+calling for maintenance: how large the database, its WAL and the archive
+have grown, how much of the file is free pages, when the last backup ran,
+how fast everyday operations are, and how much memory the app uses.
+
+* ``LatencyStats`` keeps the last few hundred timings of each operation
+  (list, search, save, export) in bounded deques; recording one is an
+  append, so it can sit on the save path.
+* ``HealthReader`` collects a snapshot on its own thread and read-only
+  connection (PRAGMAs and file sizes only, well under a millisecond at
+  100,000 customers) and hands it to the Tk thread through ``call_in_ui``.
+* ``advice`` turns a snapshot into the maintenance hints shown under it.
+
+Python's sqlite3 module does not expose SQLite's page cache hit counters,
+so the panel shows how much of the database the page cache and memory map
+can hold, next to the hit rate of the autocomplete caches.
+
+Run ``python health.py --bench 100000`` to time a snapshot.
+"""
+import argparse
+import collections
+import ctypes
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import backups
+import database
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Operations timed by the app, in display order
+OPERATIONS = ("list", "search", "save", "export")
+
+# Timings kept per operation
+LATENCY_SAMPLES = 500
+
+# Settings written after each backup
+LAST_BACKUP_KEY = "last_backup_at"
+LAST_BACKUP_SECONDS_KEY = "last_backup_seconds"
+
+# Thresholds for the maintenance hints
+FREELIST_ADVICE_RATIO = 0.2
+WAL_ADVICE_BYTES = 64 * MB
+BACKUP_ADVICE_HOURS = 24
+ARCHIVE_ADVICE_BYTES = 512 * MB
+SLOW_OPERATION_MS = 500
+
+
+class LatencyStats:
+    """Recent timings of each operation, for percentiles"""
+    
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self.timings = {operation: collections.deque(maxlen=samples) for operation in OPERATIONS}
+    
+    def record(self, operation, seconds):
+        timings = self.timings.get(operation)
+        if timings is None:
+            timings = self.timings.setdefault(operation, collections.deque(maxlen=self.samples))
+        timings.append(seconds)
+    
+    @contextmanager
+    def timed(self, operation):
+        """Record how long the with block takes (also when it fails)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, time.perf_counter() - start)
+    
+    def percentiles(self, operation):
+        """(count, p50, p95, p99) in milliseconds, or None before the first timing"""
+        timings = sorted(self.timings.get(operation, ()))  # Copies in one step, safe against appends
+        if not timings:
+            return None
+        
+        def at(fraction):
+            return timings[min(len(timings) - 1, int(fraction * len(timings)))] * 1000
+        return len(timings), at(0.5), at(0.95), at(0.99)
+    
+    def summary(self):
+        """{operation: percentiles(operation)} for every operation"""
+        return {operation: self.percentiles(operation) for operation in self.timings}
+
+
+def process_memory():
+    """Resident memory of this process in bytes, or None if unknown"""
+    try:
+        if sys.platform == "win32":
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(ProcessMemoryCounters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        elif os.path.exists("/proc/self/status"):
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        else:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024  # Peak, not current
+    except (OSError, ValueError, AttributeError, ImportError):
+        pass
+    return None
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def database_stats(conn, db_path):
+    """File sizes and page counts of the database at db_path"""
+    def pragma(name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+    
+    page_size = pragma("page_size")
+    page_count = pragma("page_count")
+    cache_size = pragma("cache_size")
+    # Negative cache_size is in KiB, positive in pages
+    cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+    db_bytes = file_size(db_path)
+    return {
+        "db_bytes": db_bytes,
+        "wal_bytes": file_size(db_path + "-wal"),
+        "archive_bytes": file_size(database.get_archive_path()) if db_path == database.get_db_path() else 0,
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": pragma("freelist_count"),
+        "cache_bytes": cache_bytes,
+        "mmap_bytes": pragma("mmap_size"),
+    }
+
+
+def last_backup(conn):
+    """(time, seconds) of the last backup; seconds is None when not recorded"""
+    at = database.get_setting(conn, LAST_BACKUP_KEY)
+    if at:
+        seconds = database.get_setting(conn, LAST_BACKUP_SECONDS_KEY)
+        return datetime.fromisoformat(at), float(seconds) if seconds else None
+    
+    # Backups made before the time was recorded
+    found = backups.list_backups()
+    return (found[0]["created"], None) if found else (None, None)
+
+
+def record_backup(conn, started, seconds):
+    """Remember when the last backup ran and how long it took"""
+    database.set_setting(conn, LAST_BACKUP_KEY, started.isoformat(timespec="seconds"))
+    database.set_setting(conn, LAST_BACKUP_SECONDS_KEY, f"{seconds:.3f}")
+
+
+def cache_coverage(stats):
+    """Fraction of the database the page cache and memory map can hold"""
+    if not stats["db_bytes"]:
+        return 1.0
+    return min(1.0, max(stats["cache_bytes"], stats["mmap_bytes"]) / stats["db_bytes"])
+
+
+def collect(conn, db_path, latency=None, caches=None):
+    """Snapshot of database, backup, latency, cache and memory figures
+    
+    ``caches`` maps a cache name to (hits, misses). Without a connection
+    (thin-client mode) only the figures of this process are included.
+    """
+    snapshot = {
+        "taken": datetime.now(),
+        "memory_bytes": process_memory(),
+        "latency": latency.summary() if latency else {},
+        "caches": {name: hit_rate(*counts) for name, counts in (caches or {}).items()},
+        "database": None,
+        "last_backup": (None, None),
+    }
+    if conn is not None:
+        snapshot["database"] = database_stats(conn, db_path)
+        snapshot["last_backup"] = last_backup(conn)
+    return snapshot
+
+
+def hit_rate(hits, misses):
+    """(hit fraction or None, lookups)"""
+    lookups = hits + misses
+    return (hits / lookups if lookups else None), lookups
+
+
+def advice(snapshot):
+    """Maintenance hints for a snapshot"""
+    hints = []
+    stats = snapshot["database"]
+    if stats:
+        if stats["page_count"] and stats["freelist_count"] / stats["page_count"] >= FREELIST_ADVICE_RATIO:
+            hints.append(f"{stats['freelist_count'] / stats['page_count']:.0%} of the database is free space: "
+                         f"run Optimize Database to shrink it.")
+        if stats["wal_bytes"] >= WAL_ADVICE_BYTES:
+            hints.append("The write-ahead log is large: close other counters' connections and run Optimize.")
+        if stats["db_bytes"] >= ARCHIVE_ADVICE_BYTES:
+            hints.append("The database is large: archive old customers to keep lists and searches fast.")
+        if cache_coverage(stats) < 0.5:
+            hints.append("Less than half of the database fits in memory: archiving old customers will help.")
+        
+        backup_time, _ = snapshot["last_backup"]
+        if backup_time is None:
+            hints.append("No backup has been made yet.")
+        elif (snapshot["taken"] - backup_time).total_seconds() > BACKUP_ADVICE_HOURS * 3600:
+            hints.append(f"The last backup is more than {BACKUP_ADVICE_HOURS} hours old.")
+    
+    for operation, figures in snapshot["latency"].items():
+        if figures and figures[2] >= SLOW_OPERATION_MS:
+            hints.append(f"{operation.capitalize()} is slow (95% within {figures[2]:.0f} ms).")
+    return hints
+
+
+class HealthReader:
+    """Collects snapshots on a background thread with its own read-only connection
+    
+    A refresh asked for while one is still running is skipped, so a slow
+    disk never piles up work. Snapshots are handed back through
+    ``call_in_ui``.
+    """
+    
+    def __init__(self, call_in_ui, db_path=None, latency=None, caches=None):
+        self.call_in_ui = call_in_ui
+        self.db_path = db_path  # None in thin-client mode
+        self.latency = latency
+        self.caches = caches or (lambda: {})
+        self.conn = None
+        self.busy = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Health")
+    
+    def refresh(self, deliver):
+        """Call deliver(snapshot) on the Tk thread"""
+        if self.busy.is_set():
+            return
+        self.busy.set()
+        caches = self.caches()  # Read on the Tk thread, which owns them
+        
+        def done(future):
+            self.busy.clear()
+            try:
+                snapshot = future.result()
+            except Exception as e:
+                log.warning("Health snapshot failed: %s", e)
+                return
+            self.call_in_ui(deliver, snapshot)
+        self.executor.submit(self._collect, caches).add_done_callback(done)
+    
+    def _collect(self, caches):
+        if self.db_path is not None and self.conn is None:
+            self.conn = database.connect_readonly(self.db_path)
+        return collect(self.conn, self.db_path, self.latency, caches)
+    
+    def close(self):
+        def close_connection():
+            if self.conn is not None:
+                self.conn.close()
+        self.executor.submit(close_connection)
+        self.executor.shutdown(wait=True)
+
+
+def format_bytes(size):
+    """Size for display, e.g. 1536 -> "1.5 KB" ("n/a" for None)"""
+    if size is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def benchmark(count=100000, repeats=20):
+    """Time a snapshot of a database with count customers"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        cursor = conn.cursor()
+        for i in range(count):
+            database.insert_customer(
+                cursor, f"Customer {i}", f"9{i:09d}", "2024-01-01", {"right_sph": "-1.00"},
+                {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000})
+        conn.commit()
+        record_backup(conn, datetime.now(), 1.5)
+        conn.close()
+        
+        latency = LatencyStats()
+        for i in range(LATENCY_SAMPLES):
+            latency.record("save", i / 1e5)
+        
+        start = time.perf_counter()
+        for i in range(100000):
+            latency.record("list", 0.001)
+        record_cost = (time.perf_counter() - start) / 100000
+        
+        reader = database.connect_readonly(path)
+        collect(reader, path, latency)  # Warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            snapshot = collect(reader, path, latency)
+        elapsed = (time.perf_counter() - start) / repeats
+        reader.close()
+    
+    stats = snapshot["database"]
+    print(f"{count} customers, {format_bytes(stats['db_bytes'])}, {stats['page_count']} pages, "
+          f"memory {format_bytes(snapshot['memory_bytes'])}")
+    print(f"Snapshot: {elapsed * 1000:.2f} ms   Recording a timing: {record_cost * 1e6:.2f} us")
+    for hint in advice(snapshot):
+        print(f"  {hint}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database and application health")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark a snapshot with COUNT customers")
+    parser.add_argument("--show", metavar="DB", help="Print a snapshot of a database file")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    elif args.show:
+        conn = database.connect_readonly(args.show)
+        snapshot = collect(conn, args.show)
+        conn.close()
+        print(snapshot)
+        for hint in advice(snapshot):
+            print(hint)
+    else:
+        parser.print_help()
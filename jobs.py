@@ -0,0 +1,205 @@
+"""
+Background job executor for Shivam Opticals.
+
+Long-running work (exports, backups, maintenance) runs on a bounded thread
+pool. Workers never touch Tk widgets directly: completion, error and progress
+callbacks are put on a queue that is drained on the Tk thread with
+``root.after``. Each job carries a cancellation token and reports progress.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation token has been triggered"""
+
+
+class CancelToken:
+    """Cooperative cancellation flag shared between the UI and a job"""
+    
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self):
+        """Request cancellation"""
+        self._event.set()
+    
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+    
+    def raise_if_cancelled(self):
+        """Stop the job if cancellation was requested"""
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class Job:
+    """A unit of background work with progress and cancellation"""
+    
+    def __init__(self, job_id, name, executor):
+        self.id = job_id
+        self.name = name
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.progress = 0.0  # 0.0 to 1.0
+        self.message = ""
+        self.token = CancelToken()
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._executor = executor
+        self._on_progress = None
+    
+    @property
+    def duration(self):
+        """Seconds spent running (so far, if still running)"""
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.started
+    
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+    
+    def report(self, progress=None, message=None):
+        """Report progress from the worker thread"""
+        if progress is not None:
+            self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+        if self._on_progress:
+            self._executor.call_in_ui(self._on_progress, self)
+    
+    def check_cancelled(self):
+        """Raise JobCancelled if the job should stop"""
+        self.token.raise_if_cancelled()
+    
+    def cancel(self):
+        """Request cancellation of this job"""
+        self.token.cancel()
+
+
+class JobExecutor:
+    """Bounded thread pool with UI marshalling through root.after"""
+    
+    def __init__(self, root, max_workers=2, history=50, poll_interval=100):
+        self.root = root
+        self.poll_interval = poll_interval  # Milliseconds between UI queue polls
+        self.history = history  # Number of finished jobs to remember
+        
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Job")
+        self._ui_queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._next_id = 1
+        self._closed = False
+        self._after_id = self.root.after(self.poll_interval, self._poll)
+    
+    def submit(self, name, func, *args, on_done=None, on_error=None,
+               on_cancel=None, on_progress=None):
+        """Run func(job, *args) on the pool; callbacks run on the Tk thread"""
+        with self._lock:
+            job = Job(self._next_id, name, self)
+            self._next_id += 1
+            self._jobs.append(job)
+            self._trim_history()
+        job._on_progress = on_progress
+        
+        def run():
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.check_cancelled()
+                job.result = func(job, *args)
+                job.status = "done"
+                job.progress = 1.0
+                callback, value = on_done, job.result
+            except JobCancelled:
+                job.status = "cancelled"
+                callback, value = on_cancel, None
+            except Exception as e:
+                job.status = "failed"
+                job.error = e
+                callback, value = on_error, e
+            finally:
+                job.finished = time.time()
+            
+            if callback:
+                self.call_in_ui(callback, value)
+        
+        self._pool.submit(run)
+        return job
+    
+    def schedule_periodic(self, name, func, interval, *args):
+        """Submit func now and again interval seconds after each run finishes"""
+        def resubmit(_=None):
+            if not self._closed:
+                self.root.after(int(interval * 1000), start)
+        
+        def start():
+            if not self._closed:
+                self.submit(name, func, *args,
+                            on_done=resubmit, on_error=resubmit, on_cancel=resubmit)
+        
+        start()
+    
+    def call_in_ui(self, callback, *args):
+        """Queue a callback to be executed on the Tk thread"""
+        self._ui_queue.put((callback, args))
+    
+    def _poll(self):
+        """Apply queued UI updates on the Tk thread"""
+        while True:
+            try:
+                callback, args = self._ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("Job callback error")
+        
+        if not self._closed:
+            self._after_id = self.root.after(self.poll_interval, self._poll)
+    
+    def _trim_history(self):
+        """Forget the oldest finished jobs beyond the history limit"""
+        finished = [job for job in self._jobs if not job.active]
+        excess = len(finished) - self.history
+        if excess > 0:
+            stale = set(id(job) for job in finished[:excess])
+            self._jobs = [job for job in self._jobs if id(job) not in stale]
+    
+    def jobs(self):
+        """Return running and recent jobs, newest first"""
+        with self._lock:
+            return list(reversed(self._jobs))
+    
+    def get(self, job_id):
+        """Find a job by id"""
+        with self._lock:
+            for job in self._jobs:
+                if job.id == job_id:
+                    return job
+        return None
+    
+    def shutdown(self):
+        """Cancel outstanding jobs and stop polling"""
+        self._closed = True
+        with self._lock:
+            for job in self._jobs:
+                if job.active:
+                    job.cancel()
+        try:
+            self.root.after_cancel(self._after_id)
+        except Exception:
+            pass
+        self._pool.shutdown(wait=False)
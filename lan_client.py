@@ -0,0 +1,134 @@
+"""
+Thin client for the Shivam Opticals LAN server.
+
+Used by the desktop app when it runs against a shared database on another
+counter instead of its own ``data/optical_shop.db``. Each thread keeps its own
+keep-alive HTTP connection. Requests carry the server's shared token (shown
+in the server counter's Tools tab).
+
+Only GET requests are retried after the response is lost: the server may
+already have committed a save, and sending it again would save it twice.
+"""
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit, urlencode
+
+
+class LanClientError(Exception):
+    """Raised when the server cannot be reached or rejects a request"""
+
+
+class LanClient:
+    """Call the LAN server's JSON API"""
+    
+    def __init__(self, base_url, token=None, timeout=10):
+        url = urlsplit(base_url if "://" in base_url else f"http://{base_url}")
+        self.base_url = f"{url.scheme}://{url.netloc}"
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+    
+    def request(self, method, path, body=None):
+        """Send a request and return the decoded JSON response"""
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        
+        # Retry once in case the server closed an idle keep-alive connection;
+        # other methods only when the request could not even be sent
+        for attempt in range(2):
+            conn = self._connection()
+            sent = False
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                data = json.loads(response.read().decode("utf-8") or "null")
+                break
+            except (http.client.HTTPException, ConnectionError, OSError) as e:
+                conn.close()
+                self._local.conn = None
+                if attempt == 1 or (sent and method != "GET"):
+                    raise LanClientError(f"Cannot reach server at {self.base_url}: {e}")
+        
+        if response.status != 200:
+            message = data.get("error") if isinstance(data, dict) else None
+            raise LanClientError(message or f"Server returned status {response.status}")
+        return data
+    
+    def health(self):
+        return self.request("GET", "/api/health")
+    
+    def save_customer(self, name, phone, visit_date, prescription, product):
+        """Save a customer on the server; returns the new id"""
+        body = {"name": name, "phone": phone, "date": visit_date,
+                "prescription": prescription, "product": product}
+        return self.request("POST", "/api/customers", body)["id"]
+    
+    def list_customers(self, search_term="", limit=None, after=None, sort="date", descending=True,
+                       include_archive=False):
+        """Customer list rows; fetches every page when limit is None"""
+        rows = []
+        params = {"search": search_term, "sort": sort, "desc": "1" if descending else "0"}
+        if include_archive:
+            params["archive"] = "1"
+        if after is not None:
+            params.update(after_value=after[0], after_id=after[1])
+        page_size = limit or 500
+        
+        while True:
+            params["limit"] = page_size
+            page = self.request("GET", "/api/customers?" + urlencode(params))
+            rows.extend(tuple(row) for row in page["rows"])
+            if limit is not None or not page["next"]:
+                return rows
+            params.update(page["next"])
+    
+    def count_customers(self, search_term="", include_archive=False):
+        """Number of customers in the whole list"""
+        params = {"search": search_term, "archive": "1" if include_archive else "0"}
+        return self.request("GET", "/api/customer-count?" + urlencode(params))["count"]
+    
+    def find_customer_match(self, search_term):
+        """(customer_id, kind) for an exact or single partial match"""
+        result = self.request("GET", "/api/match?" + urlencode({"term": search_term}))
+        return result["id"], result["kind"]
+    
+    def fuzzy_customers(self, search_term):
+        """(rows, complete) for names within two edits of search_term, closest first"""
+        result = self.request("GET", "/api/fuzzy?" + urlencode({"term": search_term}))
+        return [tuple(row) for row in result["rows"]], result["complete"]
+    
+    def suggest_customers(self, text):
+        """(id, name, phone, date) of customers whose name or phone starts with text"""
+        result = self.request("GET", "/api/suggest?" + urlencode({"term": text}))
+        return [tuple(row) for row in result["rows"]]
+    
+    def customer_detail(self, customer_id):
+        """Full record of one customer, or None"""
+        try:
+            return self.request("GET", f"/api/customers/{int(customer_id)}")
+        except LanClientError as e:
+            if "not found" in str(e).lower():
+                return None
+            raise
+    
+    def product_name_counts(self, field):
+        """[(name, sales)] of every frame_name or lens_name, for autocomplete"""
+        result = self.request("GET", "/api/product-names?" + urlencode({"field": field}))
+        return [tuple(item) for item in result["names"]]
+    
+    def batch(self, requests):
+        """Send several requests at once; returns their responses"""
+        return self.request("POST", "/api/batch", {"requests": requests})["responses"]
@@ -0,0 +1,491 @@
+"""
+LAN server mode for Shivam Opticals.
+
+Serves the shop database over a small HTTP/JSON API so several billing
+counters can share one database. The server is built on asyncio: sockets are
+handled on the event loop while SQLite work runs on a pool of reader
+connections and a single writer that group-commits saves arriving together
+(see ``write_queue.py``). Several operations can be sent in one request
+through ``/api/batch``; saves in a batch share one transaction.
+
+Every request must carry the shop's shared token in an ``Authorization:
+Bearer`` header. The token is generated on first use and kept in the
+``settings`` table. The server listens on the address saved in settings
+(``127.0.0.1`` until one is chosen), so it is only reachable from the shop
+network once a counter deliberately binds it to that interface.
+
+Run standalone with::
+    
+    python lan_server.py --host 192.168.1.10 --port 8765
+
+or start it from the Tools tab of the desktop app.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import queue
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import database
+import fuzzy
+from money import to_paise
+from autocomplete import PRODUCT_NAME_FIELDS, product_name_counts
+from write_queue import WriteQueue
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_HOST = "127.0.0.1"  # Loopback until an interface is configured
+
+# Settings holding the shared token and the address to listen on
+TOKEN_SETTING = "lan_server_token"
+HOST_SETTING = "lan_server_host"
+MAX_BODY_SIZE = 10 * 1024 * 1024  # Refuse request bodies larger than 10 MB
+MAX_PAGE_SIZE = 500
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class RequestError(Exception):
+    """Error returned to the client with an HTTP status"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def server_token(conn):
+    """The shop's shared LAN token, generated and saved on first use"""
+    token = database.get_setting(conn, TOKEN_SETTING)
+    if not token:
+        token = secrets.token_urlsafe(24)
+        database.set_setting(conn, TOKEN_SETTING, token)
+    return token
+
+
+def server_host(conn):
+    """Address the LAN server listens on"""
+    return database.get_setting(conn, HOST_SETTING, DEFAULT_HOST)
+
+
+def load_server_settings(db_path=None):
+    """(host, token) from the database's settings"""
+    conn = database.open_database(db_path)
+    try:
+        return server_host(conn), server_token(conn)
+    finally:
+        conn.close()
+
+
+def check_token(headers, token):
+    """Raise a 401 RequestError unless the request carries the shared token"""
+    scheme, _, value = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(value.strip().encode(), token.encode()):
+        raise RequestError(401, "Missing or wrong server token")
+
+
+class ConnectionPool:
+    """Reader connections on a thread pool plus one dedicated writer"""
+    
+    def __init__(self, db_path=None, readers=4):
+        # Make sure the schema exists before readers open the file
+        database.open_database(db_path).close()
+        
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(database.connect(db_path))
+        # Writes from all clients are group-committed by one writer thread
+        self._writes = WriteQueue(db_path)
+        self.index_names()
+        
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="LanRead")
+    
+    async def read(self, func, *args):
+        """Run func(cursor, *args) on a reader connection"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._run_read, func, args)
+    
+    def index_names(self):
+        """Add names saved since the last run to the typo-tolerant search index"""
+        fuzzy.index_pending(self._writes)
+    
+    async def write(self, func, *args):
+        """Run func(cursor, *args) on the writer; resolves once committed"""
+        return await asyncio.wrap_future(self._writes.submit(func, *args, durable=True))
+    
+    def _run_read(self, func, args):
+        conn = self._readers.get()
+        try:
+            return func(conn.cursor(), *args)
+        finally:
+            self._readers.put(conn)
+    
+    def close(self):
+        """Close all connections"""
+        self._read_executor.shutdown(wait=True)
+        self._writes.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
+def parse_cost(value):
+    """Convert a rupee cost from JSON (number, string or empty) to paise"""
+    try:
+        return to_paise(value)
+    except (TypeError, ValueError):
+        raise RequestError(400, f"Invalid cost value: {value!r}")
+
+
+def parse_content_length(value):
+    """Body length from a Content-Length header; 0 when it is missing"""
+    if value is None or value == "":
+        return 0
+    if not value.isdigit():
+        raise RequestError(400, "Invalid Content-Length header")
+    length = int(value)
+    if length > MAX_BODY_SIZE:
+        raise RequestError(413, "Request body too large")
+    return length
+
+
+def validate_customer(body):
+    """Check a save request and normalise its costs"""
+    if not isinstance(body, dict):
+        raise RequestError(400, "Request body must be a JSON object")
+    if not str(body.get("name") or "").strip():
+        raise RequestError(400, "Customer name is required")
+    
+    prescription = body.get("prescription") or {}
+    product = dict(body.get("product") or {})
+    # Costs arrive as whole paise, or as rupees from older clients; the
+    # total is always frame + lens
+    for paise_field, rupee_field in (("frame_paise", "frame_cost"), ("lens_paise", "lens_cost")):
+        value = product.pop(paise_field, None)
+        if value is None:
+            product[paise_field] = parse_cost(product.pop(rupee_field, None))
+        elif isinstance(value, int) and not isinstance(value, bool):
+            product[paise_field] = value
+        else:
+            raise RequestError(400, f"{paise_field} must be a whole number of paise")
+    
+    return (body["name"], body.get("phone") or "", body.get("date") or "",
+            prescription, product)
+
+
+def save_customers(cursor, customers):
+    """Insert several validated customers; returns their ids"""
+    return [database.insert_customer(cursor, *customer) for customer in customers]
+
+
+class LanServer:
+    """asyncio HTTP/JSON server over the shop database"""
+    
+    def __init__(self, db_path=None, host=None, port=DEFAULT_PORT, readers=4, token=None):
+        self.db_path = db_path
+        self.host = host  # None: the address saved in settings
+        self.port = port
+        self.token = token  # None: the token saved in settings
+        self.readers = readers
+        self.pool = None
+        self._server = None
+        self._client_tasks = set()
+    
+    async def start(self):
+        """Open the connection pool and start listening"""
+        self.pool = ConnectionPool(self.db_path, readers=self.readers)
+        if self.host is None or self.token is None:
+            host, token = load_server_settings(self.db_path)
+            self.host = self.host or host
+            self.token = self.token or token
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # Report the real port when 0 was requested
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+    
+    async def close(self):
+        """Stop listening and close the database connections"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        
+        # Drop idle keep-alive connections
+        for task in list(self._client_tasks):
+            task.cancel()
+        await asyncio.gather(*self._client_tasks, return_exceptions=True)
+        
+        if self.pool:
+            self.pool.close()
+    
+    async def _handle_client(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                
+                try:
+                    length = parse_content_length(headers.get("content-length"))
+                    check_token(headers, self.token)
+                except RequestError as e:
+                    await self._send(writer, e.status, {"error": e.message}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b""
+                
+                status, payload = await self._dispatch_raw(method, target, raw_body)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._client_tasks.discard(task)
+            writer.close()
+    
+    async def _send(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+    
+    async def _dispatch_raw(self, method, target, raw_body):
+        """Decode the body and route the request, converting errors to JSON"""
+        try:
+            body = json.loads(raw_body.decode("utf-8")) if raw_body else None
+        except ValueError:
+            return 400, {"error": "Request body is not valid JSON"}
+        
+        try:
+            return 200, await self.dispatch(method, target, body)
+        except RequestError as e:
+            return e.status, {"error": e.message}
+        except Exception as e:
+            log.exception("LAN server error", extra={"fields": {"method": method, "target": target}})
+            return 500, {"error": str(e)}
+    
+    async def dispatch(self, method, target, body):
+        """Route one request and return its JSON payload"""
+        url = urlsplit(target)
+        path = url.path.rstrip("/")
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        
+        if path == "/api/health" and method == "GET":
+            return {"status": "ok"}
+        
+        if path == "/api/customers":
+            if method == "GET":
+                return await self.list_customers(params)
+            if method == "POST":
+                ids = await self.pool.write(save_customers, [validate_customer(body)])
+                return {"id": ids[0]}
+            raise RequestError(405, "Use GET or POST")
+        
+        if path.startswith("/api/customers/") and method == "GET":
+            try:
+                customer_id = int(path.rsplit("/", 1)[1])
+            except ValueError:
+                raise RequestError(404, "Unknown customer")
+            customer = await self.pool.read(database.query_customer_detail, customer_id)
+            if customer is None:
+                raise RequestError(404, "Customer not found")
+            return customer
+        
+        if path == "/api/customer-count" and method == "GET":
+            count = await self.pool.read(
+                database.count_customers, params.get("search", ""), params.get("archive", "0") == "1")
+            return {"count": count}
+        
+        if path == "/api/match" and method == "GET":
+            customer_id, kind = await self.pool.read(
+                database.find_customer_match, params.get("term", ""))
+            return {"id": customer_id, "kind": kind}
+        
+        if path == "/api/fuzzy" and method == "GET":
+            rows, complete = await self.pool.read(
+                database.query_fuzzy_customers, params.get("term", ""))
+            self.pool.index_names()
+            return {"rows": [list(row) for row in rows], "complete": complete}
+        
+        if path == "/api/suggest" and method == "GET":
+            return {"rows": await self.pool.read(database.suggest_customers, params.get("term", ""))}
+        
+        if path == "/api/product-names" and method == "GET":
+            field = params.get("field", "")
+            if field not in PRODUCT_NAME_FIELDS:
+                raise RequestError(400, f"field must be one of {', '.join(PRODUCT_NAME_FIELDS)}")
+            return {"names": await self.pool.read(product_name_counts, field)}
+        
+        if path == "/api/batch" and method == "POST":
+            return await self.batch(body)
+        
+        raise RequestError(404, f"No route for {method} {path}")
+    
+    async def list_customers(self, params):
+        """One page of the customer list, optionally filtered and sorted"""
+        sort = params.get("sort", "date")
+        if sort not in database.LIST_SORTS:
+            raise RequestError(400, f"Unknown sort column: {sort}")
+        descending = params.get("desc", "1") != "0"
+        include_archive = params.get("archive", "0") == "1"
+        try:
+            limit = min(int(params.get("limit", 100)), MAX_PAGE_SIZE)
+            after = None
+            if "after_id" in params:
+                after = database.parse_list_cursor(
+                    sort, params.get("after_value", ""), params["after_id"])
+        except ValueError:
+            raise RequestError(400, "Invalid paging parameters")
+        
+        rows = await self.pool.read(
+            database.query_customer_list, params.get("search", ""), limit, after,
+            sort, descending, include_archive)
+        
+        next_cursor = None
+        if len(rows) == limit:
+            value, customer_id = database.list_cursor(rows[-1], sort)
+            next_cursor = {"after_value": value, "after_id": customer_id}
+        return {"rows": [list(row) for row in rows], "next": next_cursor}
+    
+    async def batch(self, body):
+        """Run several requests at once; all saves share one transaction"""
+        requests = (body or {}).get("requests")
+        if not isinstance(requests, list):
+            raise RequestError(400, "Batch body must contain a 'requests' list")
+        
+        responses = [None] * len(requests)
+        saves = []
+        reads = []
+        for index, item in enumerate(requests):
+            item = item or {}
+            method = item.get("method", "GET").upper()
+            path = item.get("path", "")
+            if method == "POST" and urlsplit(path).path.rstrip("/") == "/api/customers":
+                try:
+                    saves.append((index, validate_customer(item.get("body"))))
+                except RequestError as e:
+                    responses[index] = {"status": e.status, "body": {"error": e.message}}
+            else:
+                reads.append((index, method, path, item.get("body")))
+        
+        if saves:
+            try:
+                ids = await self.pool.write(save_customers, [customer for _, customer in saves])
+                for (index, _), customer_id in zip(saves, ids):
+                    responses[index] = {"status": 200, "body": {"id": customer_id}}
+            except Exception as e:
+                for index, _ in saves:
+                    responses[index] = {"status": 500, "body": {"error": str(e)}}
+        
+        async def run_one(index, method, path, item_body):
+            if path == "/api/batch":
+                responses[index] = {"status": 400, "body": {"error": "Nested batches are not allowed"}}
+                return
+            raw = json.dumps(item_body).encode("utf-8") if item_body is not None else b""
+            status, payload = await self._dispatch_raw(method, path, raw)
+            responses[index] = {"status": status, "body": payload}
+        
+        await asyncio.gather(*(run_one(*read) for read in reads))
+        return {"responses": responses}
+
+
+class ServerThread(threading.Thread):
+    """Run a LanServer on its own event loop in a background thread"""
+    
+    def __init__(self, db_path=None, host=None, port=DEFAULT_PORT, token=None):
+        super().__init__(name="LanServer")
+        self.daemon = True  # Thread will exit when main program exits
+        self.server = LanServer(db_path, host, port, token=token)
+        self.loop = None
+        self.started = threading.Event()
+        self.error = None
+        self._stop_event = None
+    
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        except Exception as e:
+            self.error = e
+            self.started.set()
+        finally:
+            self.loop.close()
+    
+    async def _main(self):
+        self._stop_event = asyncio.Event()
+        await self.server.start()
+        self.started.set()
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self.server.close()
+    
+    def stop(self):
+        """Ask the server to shut down"""
+        if self.loop and self._stop_event:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shivam Opticals LAN server")
+    parser.add_argument("--host", default=None,
+                        help=f"Address to listen on (default: the saved address, else {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--db", default=None, help="Database file (default: data/optical_shop.db)")
+    parser.add_argument("--readers", type=int, default=4, help="Number of reader connections")
+    args = parser.parse_args()
+    
+    host, token = load_server_settings(args.db)
+    host = args.host or host
+    server = LanServer(args.db, host, args.port, args.readers, token=token)
+    print(f"Serving {args.db or database.get_db_path()} on http://{host}:{args.port}")
+    print(f"Counters connect with --server <address>:{args.port} --token {token}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
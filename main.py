@@ -1,14 +1,45 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, font
 import sqlite3
-from datetime import date, datetime
+from datetime import date
 import os
+import sys
 import time
-import shutil
-import threading
-import pandas as pd
+import logging
+import multiprocessing
 import platform
 from PIL import Image, ImageTk, ImageDraw  # Add PIL for image handling
+from ui_watchdog import StallWatchdog
+from jobs import JobExecutor
+from branch_sync import BranchSync, default_changeset_name
+from duplicates import DuplicateFinder, dismiss_pair
+from rowstore import CustomerColumns
+from store import Store
+import database
+import applog
+import archive
+import autocomplete
+import backups
+import checkpoints
+import documents
+import exporters
+import health
+import recall
+import reports
+from lan_server import ServerThread, DEFAULT_HOST, DEFAULT_PORT, HOST_SETTING
+from lan_client import LanClient, LanClientError
+from money import to_paise, format_rupees
+
+log = logging.getLogger(__name__)
+
+# Customers fetched per page of the customer list
+CUSTOMER_PAGE_SIZE = 200
+
+# Customer list tree columns and the database sort each heading applies
+CUSTOMER_LIST_SORTS = {
+    "id": "id", "name": "name", "phone": "phone",
+    "date": "date", "frame": "frame_name", "total": "total_paise",
+}
 
 class AnimatedButton(tk.Button):
     """Custom animated button class with hover effects"""
@@ -67,7 +98,7 @@ class AnimatedButton(tk.Button):
         self.config(relief=tk.RAISED)
 
 class ShivamOpticals:
-    def __init__(self, root):
+    def __init__(self, root, server_url=None, server_token=None):
         self.root = root
         self.root.title("Shivam Opticals")
         
@@ -105,9 +136,26 @@ class ShivamOpticals:
         self.form_canvas = None
         self.list_canvas = None
         
-        # Database connection
-        self.conn = None
-        self.cursor = None
+        # Local database engine, with its write queue and checkpoint manager
+        # (all None in thin-client mode)
+        self.store = None
+        self.writes = None
+        self.checkpointer = None
+        
+        # Thin-client connection to a LAN server (None when using the local database)
+        self.client = LanClient(server_url, token=server_token) if server_url else None
+        self.server_thread = None
+        
+        # Customer list paging and sort order
+        self.list_sort = "date"
+        self.list_descending = True
+        self.list_search = ""
+        self.list_next = None  # Keyset cursor of the next page, None at the end
+        self.list_total = 0  # Customers in the whole list, loaded or not
+        self.list_archive = False  # Whether the list includes archived customers
+        self.list_fuzzy = False  # Whether the list shows names similar to the search
+        self.list_complete = True  # False while the name index is still being built
+        self.customer_rows = CustomerColumns()  # Rows loaded into the list so far
         
         # Set custom fonts with high DPI support
         self.setup_fonts()
@@ -126,13 +174,29 @@ class ShivamOpticals:
                 icon = ImageTk.PhotoImage(img)
                 self.root.iconphoto(True, icon)
         except Exception as e:
-            print(f"Could not load icon: {e}")
+            log.warning("Could not load icon: %s", e)
+        
+        # Timings of everyday operations
+        self.latency = health.LatencyStats()
         
-        # Initialize database
-        self.setup_database()
+        # Initialize database (the server owns it in thin-client mode)
+        if not self.client:
+            self.setup_database()
+        
+        # Shared executor for long-running background work
+        self.jobs = JobExecutor(self.root, max_workers=2)
+        
+        # The health panel's reader
+        self.health_reader = health.HealthReader(
+            self.jobs.call_in_ui, None if self.client else database.get_db_path(),
+            self.latency, self.cache_counts)
         
         # Start database maintenance schedule
-        self.schedule_database_maintenance()
+        if not self.client:
+            self.schedule_database_maintenance()
+        
+        # Start the event-loop stall watchdog
+        self.setup_stall_watchdog()
         
         # Create header with logo
         self.setup_header()
@@ -151,8 +215,12 @@ class ShivamOpticals:
         
         self.tab_control.pack(expand=1, fill="both", padx=20, pady=10)
         
+        # Returning-customer lookups run on their own reader thread
+        self.customer_suggester = autocomplete.CustomerSuggester(self.jobs.call_in_ui, client=self.client)
+        
         # Set up the customer form
         self.setup_customer_form()
+        self.load_autocomplete()
         
         # Set up the customer list
         self.setup_customer_list()
@@ -180,7 +248,7 @@ class ShivamOpticals:
                 from ctypes import windll
                 windll.shcore.SetProcessDpiAwareness(1)  # Process is system DPI aware
             except Exception as e:
-                print(f"Failed to set DPI awareness: {e}")
+                log.warning("Failed to set DPI awareness: %s", e)
         
         # Set scaling factor for Tk
         scaling_factor = 1.2  # Default scaling factor
@@ -326,7 +394,7 @@ class ShivamOpticals:
                 logo_label.image = logo_img  # Keep a reference
                 logo_label.pack(side="left", padx=15)
         except Exception as e:
-            print(f"Could not load logo: {e}")
+            log.warning("Could not load logo: %s", e)
         
         # App title with larger, more readable text
         title_label = tk.Label(
@@ -340,187 +408,82 @@ class ShivamOpticals:
     
     def setup_database(self):
         try:
-            # Create database directory if it doesn't exist
-            db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-            if not os.path.exists(db_dir):
-                os.makedirs(db_dir)
-            
-            db_path = os.path.join(db_dir, "optical_shop.db")
-            
-            # Connect to database (will create if it doesn't exist)
-            self.conn = sqlite3.connect(db_path, check_same_thread=False)
-            self.conn.execute("PRAGMA foreign_keys = ON")  # Enable foreign key constraints
-            self.conn.execute("PRAGMA journal_mode = WAL")  # Use Write-Ahead Logging for better concurrency
-            self.cursor = self.conn.cursor()
-            
-            # Create tables if they don't exist
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS customers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    phone TEXT,
-                    date TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS prescriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    right_sph TEXT,
-                    right_cyl TEXT,
-                    right_axe TEXT,
-                    right_add TEXT,
-                    left_sph TEXT,
-                    left_cyl TEXT,
-                    left_axe TEXT,
-                    left_add TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            self.cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    frame_name TEXT,
-                    lens_name TEXT,
-                    frame_cost REAL,
-                    lens_cost REAL,
-                    total_cost REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
-                )
-            ''')
-            
-            # Create trigger to update the updated_at timestamp
-            for table in ['customers', 'prescriptions', 'products']:
-                self.cursor.execute(f'''
-                    CREATE TRIGGER IF NOT EXISTS update_{table}_timestamp
-                    AFTER UPDATE ON {table}
-                    BEGIN
-                        UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-                    END
-                ''')
-            
-            # Create index on frequently searched fields
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_name ON customers(name)')
-            self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_phone ON customers(phone)')
-            
-            self.conn.commit()
-            
-            # Create backups directory
-            backup_dir = os.path.join(db_dir, "backups")
-            if not os.path.exists(backup_dir):
-                os.makedirs(backup_dir)
-            
+            # Open the database (creating directories, tables and indexes if
+            # needed) with its write queue and checkpoint manager
+            self.store = Store(latency=self.latency)
+            self.writes = self.store.writes
+            self.checkpointer = self.store.checkpointer
+        
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"Failed to connect to database: {e}")
             raise
     
     def backup_database(self):
-        """Create a backup of the database"""
+        """Create a backup of the database; returns (success, path or error)"""
         try:
-            # Get paths
-            db_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-            db_path = os.path.join(db_dir, "optical_shop.db")
-            backup_dir = os.path.join(db_dir, "backups")
-            
-            # Format timestamp for filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = os.path.join(backup_dir, f"optical_shop_backup_{timestamp}.db")
-            
-            # Close current connection
-            if self.conn:
-                self.conn.close()
-            
-            # Copy database file
-            shutil.copy2(db_path, backup_path)
-            
-            # Reconnect to database
-            self.conn = sqlite3.connect(db_path, check_same_thread=False)
-            self.conn.execute("PRAGMA foreign_keys = ON")
-            self.conn.execute("PRAGMA journal_mode = WAL")
-            self.cursor = self.conn.cursor()
-            
-            # Clean old backups (keep only 10 most recent)
-            self.clean_old_backups(backup_dir)
-            
-            return True, backup_path
+            return True, self.store.backup()
         except Exception as e:
-            print(f"Backup error: {e}")
-            # Reconnect to database in case of error
-            try:
-                db_path = os.path.join(db_dir, "optical_shop.db")
-                self.conn = sqlite3.connect(db_path, check_same_thread=False)
-                self.conn.execute("PRAGMA foreign_keys = ON")
-                self.conn.execute("PRAGMA journal_mode = WAL")
-                self.cursor = self.conn.cursor()
-            except Exception as e2:
-                print(f"Reconnection error: {e2}")
-            
+            log.exception("Backup error")
             return False, str(e)
     
-    def clean_old_backups(self, backup_dir, max_backups=10):
-        """Remove old backups, keeping only the most recent ones"""
-        try:
-            # Get list of backup files
-            backup_files = [f for f in os.listdir(backup_dir) if f.startswith("optical_shop_backup_") and f.endswith(".db")]
-            
-            # Sort by filename (which includes timestamp)
-            backup_files.sort(reverse=True)
-            
-            # Remove old backups
-            if len(backup_files) > max_backups:
-                for old_file in backup_files[max_backups:]:
-                    os.remove(os.path.join(backup_dir, old_file))
-        except Exception as e:
-            print(f"Error cleaning old backups: {e}")
-    
     def schedule_database_maintenance(self):
         """Schedule regular database maintenance tasks"""
-        # Run maintenance in a separate thread
-        maintenance_thread = threading.Thread(target=self.run_maintenance)
-        maintenance_thread.daemon = True  # Thread will exit when main program exits
-        maintenance_thread.start()
-    
-    def run_maintenance(self):
-        """Run maintenance tasks periodically"""
-        # Run every 2 hours
-        while True:
-            try:
-                # Create backup
-                self.backup_database()
-                
-                # Run VACUUM to optimize database
-                if self.conn:
-                    self.conn.execute("VACUUM")
-                    self.conn.commit()
-                
-                # Check database integrity
-                if self.conn:
-                    integrity_check = self.conn.execute("PRAGMA integrity_check").fetchone()
-                    if integrity_check[0] != "ok":
-                        print(f"Database integrity issue: {integrity_check}")
-            except Exception as e:
-                print(f"Maintenance error: {e}")
-            
-            # Sleep for 2 hours
-            time.sleep(7200)
+        # Run maintenance on the job executor every 2 hours
+        self.jobs.schedule_periodic("Database maintenance", self.run_maintenance, 7200)
+    
+    def run_maintenance(self, job):
+        """Run one pass of the maintenance tasks (backup, VACUUM, integrity check)"""
+        try:
+            self.store.maintain(job)
+        except sqlite3.Error:
+            log.exception("Maintenance error")
+            raise
+    
+    def setup_stall_watchdog(self):
+        """Watch the Tk main loop for stalls and log what was running"""
+        database.ensure_data_dirs()
+        
+        # Every public method of the app is a potential UI handler
+        handler_names = [name for name in dir(type(self))
+                         if not name.startswith("__") and callable(getattr(type(self), name))]
+        
+        self.watchdog = StallWatchdog(
+            self.root,
+            os.path.join(database.DATA_DIR, "stall_log.txt"),
+            handler_names=handler_names,
+            source_file=__file__,
+            threshold=0.5
+        )
+        self.watchdog.start()
     
     def on_closing(self):
         """Handle application closing"""
+        # Stop the stall watchdog
+        if getattr(self, "watchdog", None):
+            self.watchdog.stop()
+        
+        # Cancel background jobs
+        if getattr(self, "jobs", None):
+            self.jobs.shutdown()
+        if getattr(self, "customer_suggester", None):
+            self.customer_suggester.close()
+        if getattr(self, "health_reader", None):
+            self.health_reader.close()
+        
+        # Stop the LAN server if this counter is hosting it
+        if self.server_thread:
+            self.server_thread.stop()
+        
         try:
-            # Close database connection properly
-            if self.conn:
-                self.conn.close()
-        except Exception as e:
-            print(f"Error during closing: {e}")
+            # Commit any queued saves and close the database properly
+            if self.store:
+                self.store.close()
+        except Exception:
+            log.exception("Error during closing")
+        
+        # Write out the log before exiting
+        log.info("Application closed")
+        applog.shutdown_logging()
         
         # Close the application
         self.root.destroy()
@@ -616,6 +579,12 @@ class ShivamOpticals:
         self.phone_entry = ttk.Entry(phone_frame, width=20, font=self.fonts['default'])
         self.phone_entry.pack(side="left", padx=8, expand=True, fill="x")
         
+        # Suggest returning customers as their name or phone is typed
+        for entry in (self.name_entry, self.phone_entry):
+            autocomplete.DebouncedDropdown(entry, self.customer_suggester.suggest, font=self.fonts['default'],
+                                           label=autocomplete.customer_label,
+                                           on_accept=self.select_returning_customer)
+        
         # Prescription section with visual improvements
         prescription_frame = ttk.LabelFrame(center_frame, text="Prescription Details", padding=20)
         prescription_frame.grid(column=0, row=4, columnspan=4, pady=15, sticky=tk.W+tk.E)
@@ -683,6 +652,8 @@ class ShivamOpticals:
         ttk.Label(frame_row, text="Frame Name:").pack(side="left", padx=5)
         self.frame_name_entry = ttk.Entry(frame_row, width=30, font=self.fonts['default'])
         self.frame_name_entry.pack(side="left", padx=5, expand=True, fill="x")
+        autocomplete.AutocompleteDropdown(self.frame_name_entry, lambda text: self.suggest_names("frame_name", text),
+                                          font=self.fonts['default'])
         
         # Lens info - centered
         lens_row = ttk.Frame(product_frame)
@@ -695,6 +666,8 @@ class ShivamOpticals:
         ttk.Label(lens_row, text="Lens Name:").pack(side="left", padx=5)
         self.lens_name_entry = ttk.Entry(lens_row, width=30, font=self.fonts['default'])
         self.lens_name_entry.pack(side="left", padx=5, expand=True, fill="x")
+        autocomplete.AutocompleteDropdown(self.lens_name_entry, lambda text: self.suggest_names("lens_name", text),
+                                          font=self.fonts['default'])
         
         # Cost details with visual elements
         cost_frame = ttk.LabelFrame(center_frame, text="Cost Details", padding=20)
@@ -899,6 +872,20 @@ class ShivamOpticals:
         )
         clear_button.pack(side="left", padx=8)
         
+        # Archived customers are only searched when asked for (or when
+        # nothing current matches)
+        self.include_archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_controls, text="Include archive",
+                        variable=self.include_archive_var,
+                        command=lambda: self.refresh_customer_list(self.list_search)).pack(side="left", padx=8)
+        
+        # Names within two edits of the search (always tried when nothing
+        # else matches)
+        self.fuzzy_search_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_controls, text="Typo-tolerant",
+                        variable=self.fuzzy_search_var,
+                        command=lambda: self.refresh_customer_list(self.list_search)).pack(side="left", padx=8)
+        
         # Treeview for customer list with visual enhancements
         self.tree_frame = ttk.Frame(list_frame)
         self.tree_frame.pack(fill="both", expand=True, pady=15)  # Increased padding
@@ -920,12 +907,15 @@ class ShivamOpticals:
         self.customer_tree = ttk.Treeview(tree_container, columns=columns, show="headings")
         
         # Define headings with center alignment and improved visibility
-        self.customer_tree.heading("id", text="ID", anchor="center")
-        self.customer_tree.heading("name", text="Name", anchor="center")
-        self.customer_tree.heading("phone", text="Phone", anchor="center")
-        self.customer_tree.heading("date", text="Date", anchor="center")
-        self.customer_tree.heading("frame", text="Frame", anchor="center")
-        self.customer_tree.heading("total", text="Total Cost", anchor="center")
+        # (click a heading to sort by it, click again to reverse)
+        self.customer_headings = {
+            "id": "ID", "name": "Name", "phone": "Phone",
+            "date": "Date", "frame": "Frame", "total": "Total Cost",
+        }
+        for column, text in self.customer_headings.items():
+            self.customer_tree.heading(column, text=text, anchor="center",
+                                       command=lambda c=column: self.sort_customer_list(c))
+        self.update_sort_headings()
         
         # Column widths and alignment - adjusted for higher resolution
         screen_width = self.root.winfo_screenwidth()
@@ -947,9 +937,15 @@ class ShivamOpticals:
         self.customer_tree.configure(xscrollcommand=h_scrollbar.set)
         h_scrollbar.pack(side="bottom", fill="x")
         
-        # Add vertical scrollbar
+        # Add vertical scrollbar; reaching the bottom loads the next page
         v_scrollbar = ttk.Scrollbar(tree_container, orient="vertical", command=self.customer_tree.yview)
-        self.customer_tree.configure(yscrollcommand=v_scrollbar.set)
+        
+        def on_list_scroll(first, last):
+            v_scrollbar.set(first, last)
+            if self.list_next is not None and float(last) > 0.9:
+                self.root.after_idle(self.load_more_customers)
+        
+        self.customer_tree.configure(yscrollcommand=on_list_scroll)
         
         # Pack tree and scrollbar
         self.customer_tree.pack(side="left", fill="both", expand=True)
@@ -976,14 +972,13 @@ class ShivamOpticals:
     
     def calculate_total(self, event=None):
         try:
-            frame_cost = float(self.frame_cost_entry.get()) if self.frame_cost_entry.get() else 0
-            lens_cost = float(self.lens_cost_entry.get()) if self.lens_cost_entry.get() else 0
-            total = frame_cost + lens_cost
+            # Whole paise, so the total is exact
+            total = to_paise(self.frame_cost_entry.get()) + to_paise(self.lens_cost_entry.get())
             
             # Update the total field - need to make it writable temporarily
             self.total_cost_entry.configure(state="normal")
             self.total_cost_entry.delete(0, tk.END)
-            self.total_cost_entry.insert(0, f"{total:.2f}")
+            self.total_cost_entry.insert(0, format_rupees(total))
             self.total_cost_entry.configure(state="readonly")
         except ValueError:
             # Invalid number format
@@ -995,78 +990,159 @@ class ShivamOpticals:
             messagebox.showwarning("Validation Error", "Please enter the customer name")
             return
         
+        # Get cost values in paise (the database derives the total)
         try:
-            # Start transaction
-            self.conn.execute("BEGIN")
-            
-            # Insert customer
-            self.cursor.execute(
-                "INSERT INTO customers (name, phone, date) VALUES (?, ?, ?)",
-                (self.name_entry.get(), self.phone_entry.get(), self.date_entry.get())
-            )
-            
-            # Get customer ID
-            customer_id = self.cursor.lastrowid
-            
-            # Insert prescription
-            self.cursor.execute(
-                '''INSERT INTO prescriptions 
-                   (customer_id, right_sph, right_cyl, right_axe, right_add,
-                    left_sph, left_cyl, left_axe, left_add)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (
-                    customer_id,
-                    self.prescription_entries["right_sph"].get(),
-                    self.prescription_entries["right_cyl"].get(),
-                    self.prescription_entries["right_axe"].get(),
-                    self.prescription_entries["right_add"].get(),
-                    self.prescription_entries["left_sph"].get(),
-                    self.prescription_entries["left_cyl"].get(),
-                    self.prescription_entries["left_axe"].get(),
-                    self.prescription_entries["left_add"].get()
+            frame_paise = to_paise(self.frame_cost_entry.get())
+            lens_paise = to_paise(self.lens_cost_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Failed to save customer: Invalid cost values. Please enter numeric values only.")
+            return
+        
+        prescription = {field: self.prescription_entries[field].get()
+                        for field in database.PRESCRIPTION_FIELDS}
+        product = {
+            'frame_name': self.frame_name_entry.get(),
+            'lens_name': self.lens_name_entry.get(),
+            'frame_paise': frame_paise,
+            'lens_paise': lens_paise
+        }
+        
+        started = time.perf_counter()
+        try:
+            if self.client:
+                # Save on the shared server
+                self.client.save_customer(
+                    self.name_entry.get(), self.phone_entry.get(), self.date_entry.get(),
+                    prescription, product
                 )
-            )
-            
-            # Get cost values
-            try:
-                frame_cost = float(self.frame_cost_entry.get()) if self.frame_cost_entry.get() else 0
-                lens_cost = float(self.lens_cost_entry.get()) if self.lens_cost_entry.get() else 0
-                total_cost = float(self.total_cost_entry.get()) if self.total_cost_entry.get() else 0
-            except ValueError:
-                raise ValueError("Invalid cost values. Please enter numeric values only.")
-            
-            # Insert product details
-            self.cursor.execute(
-                '''INSERT INTO products
-                   (customer_id, frame_name, lens_name, frame_cost, lens_cost, total_cost)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (
-                    customer_id,
-                    self.frame_name_entry.get(),
-                    self.lens_name_entry.get(),
-                    frame_cost,
-                    lens_cost,
-                    total_cost
+            else:
+                # Queue the save; the group commit is flushed to disk before
+                # on_customer_saved runs
+                future = self.store.save_customer(
+                    self.name_entry.get(), self.phone_entry.get(),
+                    self.date_entry.get(), prescription, product
                 )
-            )
-            
-            # Commit transaction
-            self.conn.commit()
-            
-            # Show success message
-            messagebox.showinfo("Success", "Customer saved successfully!")
-            
-            # Clear form for next entry
-            self.clear_form()
+                future.add_done_callback(
+                    lambda f: self.jobs.call_in_ui(self.on_customer_saved, f, product, started)
+                )
+                return
             
-            # Refresh customer list
-            self.refresh_customer_list()
+            self.on_customer_saved(product=product, started=started)
             
         except Exception as e:
-            # Roll back transaction in case of error
-            self.conn.rollback()
+            log.exception("Error saving customer")
             messagebox.showerror("Error", f"Failed to save customer: {e}")
-            print(f"Error saving customer: {e}")
+    
+    def on_customer_saved(self, future=None, product=None, started=None):
+        """Report the result of a save and reset the form"""
+        error = future.exception() if future else None
+        if error:
+            log.error("Error saving customer", exc_info=error)
+            messagebox.showerror("Error", f"Failed to save customer: {error}")
+            return
+        if started is not None:
+            self.latency.record("save", time.perf_counter() - started)
+        log.info("Customer saved", extra={"fields": {
+            "customer_id": future.result() if future else None,
+            "frame": product.get('frame_name') if product else None,
+            "total_paise": product['frame_paise'] + product['lens_paise'] if product else None,
+        }})
+        
+        # Saved names are suggested from now on
+        if product:
+            self.add_suggested_names(product)
+        
+        # Show success message
+        messagebox.showinfo("Success", "Customer saved successfully!")
+        
+        # Clear form for next entry
+        self.clear_form()
+        
+        # Refresh customer list
+        self.refresh_customer_list()
+    
+    def load_autocomplete(self):
+        """Build the frame and lens name tries in the background"""
+        self.name_tries = None
+        self.unindexed_products = []
+        
+        def build(job):
+            counts = {}
+            if self.client:
+                for field in autocomplete.PRODUCT_NAME_FIELDS:
+                    counts[field] = self.client.product_name_counts(field)
+            else:
+                conn = database.connect_readonly()
+                try:
+                    for field in autocomplete.PRODUCT_NAME_FIELDS:
+                        counts[field] = autocomplete.product_name_counts(conn.cursor(), field)
+                finally:
+                    conn.close()
+            job.check_cancelled()
+            return autocomplete.build_tries(counts)
+        
+        def on_done(tries):
+            self.name_tries = tries
+            # Saves made while loading (a few may be counted twice, which
+            # only nudges their ranking)
+            for product in self.unindexed_products:
+                self.add_suggested_names(product)
+            self.unindexed_products = []
+        
+        def on_error(error):
+            log.warning("Could not load name suggestions: %s", error)
+        
+        self.jobs.submit("Loading name suggestions", build, on_done=on_done, on_error=on_error)
+    
+    def add_suggested_names(self, product):
+        if self.name_tries is None:
+            self.unindexed_products.append(product)
+            return
+        for field, trie in self.name_tries.items():
+            trie.add(product.get(field) or "")
+    
+    def suggest_names(self, field, text):
+        if self.name_tries is None:
+            return []
+        return self.name_tries[field].suggest(text)
+    
+    def cache_counts(self):
+        """{cache name: (hits, misses)} for the health panel"""
+        if self.name_tries is None:
+            return {}
+        return {"Name suggestions": (sum(trie.hits for trie in self.name_tries.values()),
+                                     sum(trie.misses for trie in self.name_tries.values()))}
+    
+    def select_returning_customer(self, row):
+        """Fill in a suggested customer and offer their latest visit"""
+        customer_id, name, phone, _ = row
+        self.name_entry.delete(0, tk.END)
+        self.name_entry.insert(0, name)
+        self.phone_entry.delete(0, tk.END)
+        self.phone_entry.insert(0, phone or "")
+        self.customer_suggester.detail(customer_id, self.offer_prefill)
+    
+    def offer_prefill(self, customer):
+        """Ask whether to copy the latest prescription and products into the form"""
+        if not customer or not customer.get("visits"):
+            return
+        visit = customer["visits"][0]
+        if not messagebox.askyesno(
+                "Returning Customer",
+                f"{customer['name']} last visited on {visit.get('visit_date') or 'an unknown date'}.\n\n"
+                "Fill in the prescription and products from that visit?"):
+            return
+        
+        for field, entry in self.prescription_entries.items():
+            entry.delete(0, tk.END)
+            entry.insert(0, visit.get(field) or "")
+        for field, entry in (("frame_name", self.frame_name_entry), ("lens_name", self.lens_name_entry)):
+            entry.delete(0, tk.END)
+            entry.insert(0, visit.get(field) or "")
+        for field, entry in (("frame_paise", self.frame_cost_entry), ("lens_paise", self.lens_cost_entry)):
+            entry.delete(0, tk.END)
+            entry.insert(0, format_rupees(visit.get(field)))
+        self.calculate_total()
     
     def clear_form(self):
         # Reset date to today
@@ -1095,63 +1171,120 @@ class ShivamOpticals:
         for item in self.customer_tree.get_children():
             self.customer_tree.delete(item)
         
+        # Start again from the first page
+        self.list_search = search_term
+        self.list_next = None
+        self.list_archive = self.include_archive_var.get()
+        self.list_fuzzy = bool(search_term) and self.fuzzy_search_var.get()
+        self.customer_rows.clear()
+        self.load_customer_page(None)
+    
+    def load_more_customers(self):
+        """Append the next page of the customer list"""
+        if self.list_next is not None:
+            after, self.list_next = self.list_next, None
+            self.load_customer_page(after)
+    
+    def load_customer_page(self, after):
+        """Fetch one page after the given keyset cursor and display it"""
         try:
-            # Build query based on whether we're searching
-            if search_term:
-                query = '''
-                    SELECT c.id, c.name, c.phone, c.date, p.frame_name, p.total_cost
-                    FROM customers c
-                    LEFT JOIN products p ON c.id = p.customer_id
-                    WHERE c.name LIKE ? OR c.phone LIKE ? OR p.frame_name LIKE ?
-                    ORDER BY c.date DESC
-                '''
-                like_term = f"%{search_term}%"
-                self.cursor.execute(query, (like_term, like_term, like_term))
-            else:
-                query = '''
-                    SELECT c.id, c.name, c.phone, c.date, p.frame_name, p.total_cost
-                    FROM customers c
-                    LEFT JOIN products p ON c.id = p.customer_id
-                    ORDER BY c.date DESC
-                '''
-                self.cursor.execute(query)
-            
-            # Get and display results
-            results = self.cursor.fetchall()
-            for row in results:
-                customer_id, name, phone, date_str, frame, total = row
-                
-                # Handle NULL values from database
-                if total is None:
-                    total = 0
+            # Fetch rows, filtered when we're searching
+            results = self.fetch_customer_page(after)
+            
+            # Nothing current matches the search: look in the archive
+            if not results and after is None and self.list_search and not self.list_archive:
+                self.list_archive = True
+                results = self.fetch_customer_page(after)
+            
+            # Still nothing: look for names spelt differently
+            if not results and after is None and self.list_search and not self.list_fuzzy:
+                self.list_fuzzy = True
+                results = self.fetch_customer_page(after)
+            
+            # Keep the page in the compact store and display it from there
+            shown = len(self.customer_rows)
+            self.customer_rows.extend(results)
+            for i in range(shown, len(self.customer_rows)):
+                customer_id, name, phone, date_str, frame, total = self.customer_rows[i]
                 
+                # Add alternating row colors for better readability
                 self.customer_tree.insert("", "end", values=(
                     customer_id,
                     name if name else "",
                     phone if phone else "",
                     date_str if date_str else "",
                     frame if frame else "",
-                    f"{total:.2f}" if total else "0.00"
-                ))
+                    format_rupees(total or 0)
+                ), tags=("evenrow" if i % 2 == 0 else "oddrow",))
             
-            # Update statistics
-            count = len(results)
-            self.stats_label.configure(text=f"Total Records: {count}")
+            # Remember where the next page starts (similar names come in one page)
+            if len(results) == CUSTOMER_PAGE_SIZE and not self.list_fuzzy:
+                self.list_next = database.list_cursor(results[-1], self.list_sort)
             
-            # Add alternating row colors for better readability
-            for i, item in enumerate(self.customer_tree.get_children()):
-                if i % 2 == 0:
-                    self.customer_tree.item(item, tags=("evenrow",))
-                else:
-                    self.customer_tree.item(item, tags=("oddrow",))
+            # Update statistics
+            count = shown + len(results)
+            if self.list_fuzzy:
+                building = "" if self.list_complete else " (name index still building)"
+                self.stats_label.configure(text=f"Similar Names: {count}{building}")
+            else:
+                # Count every matching customer, not just the pages loaded so far
+                if after is None:
+                    self.list_total = self.count_customers() if self.list_next is not None else count
+                more = f" (showing {count}, scroll down for more)" if self.list_next is not None else ""
+                archived = " including archive" if self.list_archive else ""
+                self.stats_label.configure(text=f"Total Records{archived}: {self.list_total}{more}")
             
             # Configure tag colors
             self.customer_tree.tag_configure("evenrow", background="#f0f0f0")
             self.customer_tree.tag_configure("oddrow", background="white")
                 
-        except sqlite3.Error as e:
+        except (sqlite3.Error, LanClientError) as e:
             messagebox.showerror("Database Error", f"Error refreshing customer list: {e}")
     
+    def fetch_customer_page(self, after):
+        """Rows of one customer list page from the server or local database"""
+        with self.latency.timed("search" if self.list_search else "list"):
+            return self._fetch_customer_page(after)
+    
+    def _fetch_customer_page(self, after):
+        if self.list_fuzzy:
+            if self.client:
+                rows, self.list_complete = self.client.fuzzy_customers(self.list_search)
+            else:
+                rows, self.list_complete = self.store.similar(self.list_search)
+            return rows
+        if self.client:
+            return self.client.list_customers(
+                self.list_search, CUSTOMER_PAGE_SIZE, after,
+                self.list_sort, self.list_descending, self.list_archive)
+        return self.store.page(
+            self.list_search, CUSTOMER_PAGE_SIZE, after,
+            self.list_sort, self.list_descending, self.list_archive)
+    
+    def count_customers(self):
+        """Number of customers matching the current list search"""
+        if self.client:
+            return self.client.count_customers(self.list_search, self.list_archive)
+        return self.store.count(self.list_search, self.list_archive)
+    
+    def sort_customer_list(self, column):
+        """Sort the customer list by a heading; clicking again reverses it"""
+        sort = CUSTOMER_LIST_SORTS[column]
+        if sort == self.list_sort:
+            self.list_descending = not self.list_descending
+        else:
+            self.list_sort = sort
+            self.list_descending = sort in ("id", "date", "total_paise")
+        self.update_sort_headings()
+        self.refresh_customer_list(self.list_search)
+    
+    def update_sort_headings(self):
+        """Mark the sorted column with an arrow"""
+        for column, text in self.customer_headings.items():
+            if CUSTOMER_LIST_SORTS[column] == self.list_sort:
+                text += " \u25bc" if self.list_descending else " \u25b2"
+            self.customer_tree.heading(column, text=text)
+    
     def search_customers(self):
         search_term = self.search_entry.get().strip()
         if not search_term:
@@ -1159,87 +1292,94 @@ class ShivamOpticals:
             self.refresh_customer_list()
             return
             
-        # First check if we have an exact match on name or phone
+        # First check if we have an exact match on name or phone,
+        # then for a single partial match
         try:
-            query = '''
-                SELECT c.id
-                FROM customers c
-                WHERE c.name = ? OR c.phone = ?
-                LIMIT 1
-            '''
-            self.cursor.execute(query, (search_term, search_term))
-            exact_match = self.cursor.fetchone()
-            
-            if exact_match:
+            if self.client:
+                customer_id, match_kind = self.client.find_customer_match(search_term)
+            else:
+                customer_id, match_kind = self.store.find_match(search_term)
+            
+            if match_kind == "exact":
                 # If we have an exact match, directly show that customer's details
-                customer_id = exact_match[0]
                 self.show_customer_details(customer_id)
                 # Also highlight this record in the list
                 self.highlight_customer_in_list(customer_id)
                 return
-                
-            # If no exact match, let's check for a single partial match
-            query = '''
-                SELECT c.id, COUNT(*) as count
-                FROM customers c
-                WHERE c.name LIKE ? OR c.phone LIKE ?
-            '''
-            like_term = f"%{search_term}%"
-            self.cursor.execute(query, (like_term, like_term))
-            match_count = self.cursor.fetchone()
-            
-            if match_count and match_count[1] == 1:
-                # If there's only one partial match, show it directly
-                customer_id = match_count[0]
+            
+            if match_kind in ("single", "similar"):
+                # If there's only one partial (or one-typo) match, show it directly
                 self.show_customer_details(customer_id)
-                # Also highlight this record in the list
-                self.highlight_customer_in_list(customer_id)
-                # Still refresh the list to show the single result
-                self.refresh_customer_list(search_term)
+                # List the search results with this record highlighted
+                self.highlight_customer_in_list(customer_id, search_term)
                 return
                 
             # If we have multiple matches or no matches, just refresh the list
             self.refresh_customer_list(search_term)
             
-        except sqlite3.Error as e:
+        except (sqlite3.Error, LanClientError) as e:
             messagebox.showerror("Search Error", f"Error during search: {e}")
             self.refresh_customer_list()
     
-    def highlight_customer_in_list(self, customer_id):
-        """Highlight a specific customer in the list view"""
-        # First make sure we have the customer in the visible list
-        self.refresh_customer_list()
+    def highlight_customer_in_list(self, customer_id, search_term=""):
+        """Highlight a specific customer in the list view
+        
+        The list is refreshed with search_term. A customer beyond its first
+        page is reached by starting the list at their row instead of loading
+        every page before it.
+        """
+        customer_id = int(customer_id)
+        self.refresh_customer_list(search_term)
+        index = self.customer_rows.index_of(customer_id)
+        if index is None and self.list_next is not None:
+            index = self.seek_customer_list(customer_id)
         
         # Find and select the customer in the tree
+        if index is None:
+            # Archived, deleted or not matching the search
+            self.stats_label.configure(
+                text=self.stats_label.cget("text") + f"  (customer {customer_id} is not in this list)")
+        else:
+            item = self.customer_tree.get_children()[index]
+            # Select this item
+            self.customer_tree.selection_set(item)
+            # Ensure it's visible by scrolling to it
+            self.customer_tree.see(item)
+            # Highlight with a special tag
+            self.customer_tree.item(item, tags=("highlight",))
+            # Configure the highlight color
+            self.customer_tree.tag_configure("highlight", background="#ffeb99")  # Light yellow
+    
+    def seek_customer_list(self, customer_id):
+        """Restart the list at a customer's row; returns its index or None"""
+        try:
+            if self.client:
+                customer = self.client.customer_detail(customer_id)
+            else:
+                customer = self.store.detail(customer_id)
+        except (sqlite3.Error, LanClientError) as e:
+            messagebox.showerror("Database Error", f"Error finding customer: {e}")
+            return None
+        if customer is None or (customer["archived"] and not self.list_archive):
+            return None
+        
+        # The customer's list row, for its sort key
+        row = tuple(customer.get(column) for column in database.LIST_COLUMNS)
         for item in self.customer_tree.get_children():
-            item_values = self.customer_tree.item(item, "values")
-            if item_values and str(item_values[0]) == str(customer_id):
-                # Select this item
-                self.customer_tree.selection_set(item)
-                # Ensure it's visible by scrolling to it
-                self.customer_tree.see(item)
-                # Highlight with a special tag
-                self.customer_tree.item(item, tags=("highlight",))
-                # Configure the highlight color
-                self.customer_tree.tag_configure("highlight", background="#ffeb99")  # Light yellow
-                break
+            self.customer_tree.delete(item)
+        self.customer_rows.clear()
+        self.list_next = None
+        self.load_customer_page(database.list_cursor_at(row, self.list_sort, self.list_descending))
+        return self.customer_rows.index_of(customer_id)
     
     def show_customer_details(self, customer_id):
         """Show customer details - extracted for reuse from view_customer_details"""
         try:
             # Query customer details
-            query = '''
-                SELECT c.*, 
-                       pr.right_sph, pr.right_cyl, pr.right_axe, pr.right_add,
-                       pr.left_sph, pr.left_cyl, pr.left_axe, pr.left_add,
-                       p.frame_name, p.lens_name, p.frame_cost, p.lens_cost, p.total_cost
-                FROM customers c
-                LEFT JOIN prescriptions pr ON c.id = pr.customer_id
-                LEFT JOIN products p ON c.id = p.customer_id
-                WHERE c.id = ?
-            '''
-            self.cursor.execute(query, (customer_id,))
-            customer = self.cursor.fetchone()
+            if self.client:
+                customer = self.client.customer_detail(customer_id)
+            else:
+                customer = self.store.detail(customer_id)
             
             if not customer:
                 messagebox.showerror("Error", "Customer not found")
@@ -1339,7 +1479,7 @@ class ShivamOpticals:
             name_icon.pack(side="left", padx=10)  # Increased padding
             
             ttk.Label(name_frame, text="Name:", width=10, font=self.fonts['bold']).pack(side="left")
-            customer_name_label = ttk.Label(name_frame, text=customer[1] or "", font=self.fonts['large'])
+            customer_name_label = ttk.Label(name_frame, text=customer['name'] or "", font=self.fonts['large'])
             customer_name_label.pack(side="left")
             
             # Phone with icon
@@ -1352,7 +1492,7 @@ class ShivamOpticals:
             phone_icon.pack(side="left", padx=10)  # Increased padding
             
             ttk.Label(phone_frame, text="Phone:", width=10, font=self.fonts['bold']).pack(side="left")
-            ttk.Label(phone_frame, text=customer[2] or "", font=self.fonts['default']).pack(side="left")
+            ttk.Label(phone_frame, text=customer['phone'] or "", font=self.fonts['default']).pack(side="left")
             
             # Date with icon
             date_frame = ttk.Frame(basic_frame)
@@ -1363,7 +1503,7 @@ class ShivamOpticals:
             date_icon.pack(side="left", padx=10)  # Increased padding
             
             ttk.Label(date_frame, text="Date:", width=10, font=self.fonts['bold']).pack(side="left")
-            ttk.Label(date_frame, text=customer[3] or "", font=self.fonts['default']).pack(side="left")
+            ttk.Label(date_frame, text=customer['date'] or "", font=self.fonts['default']).pack(side="left")
             
             # Prescription sections with visual separation for right and left eye
             prescription_frame = ttk.LabelFrame(main_frame, text="Prescription Details", padding=25)  # Increased padding
@@ -1375,6 +1515,40 @@ class ShivamOpticals:
             
             # ... rest of the existing customer details implementation ...
 
+            # Visit history, newest first
+            history_frame = ttk.LabelFrame(main_frame, text="Visit History", padding=25)
+            history_frame.pack(fill="x", pady=15)
+            
+            visits = customer.get('visits', [])
+            ttk.Label(history_frame, text=f"{len(visits)} visit(s)",
+                      font=self.fonts['bold']).pack(anchor="w", pady=(0, 10))
+            
+            history_columns = ("date", "right", "left", "frame", "lens", "total")
+            history_tree = ttk.Treeview(history_frame, columns=history_columns, show="headings",
+                                        height=min(max(len(visits), 1), 8))
+            history_tree.heading("date", text="Date", anchor="center")
+            history_tree.heading("right", text="Right (SPH/CYL/AXE/ADD)", anchor="center")
+            history_tree.heading("left", text="Left (SPH/CYL/AXE/ADD)", anchor="center")
+            history_tree.heading("frame", text="Frame", anchor="center")
+            history_tree.heading("lens", text="Lens", anchor="center")
+            history_tree.heading("total", text="Total", anchor="center")
+            history_tree.column("date", width=90, anchor="center")
+            history_tree.column("right", width=150, anchor="center")
+            history_tree.column("left", width=150, anchor="center")
+            history_tree.column("frame", width=110, anchor="w")
+            history_tree.column("lens", width=110, anchor="w")
+            history_tree.column("total", width=80, anchor="e")
+            history_tree.pack(fill="x")
+            
+            for visit in visits:
+                right = " / ".join(visit[f"right_{part}"] or "-" for part in ("sph", "cyl", "axe", "add"))
+                left = " / ".join(visit[f"left_{part}"] or "-" for part in ("sph", "cyl", "axe", "add"))
+                total = f"₹{format_rupees(visit['total_paise'])}" if visit['total_paise'] is not None else ""
+                history_tree.insert("", "end", values=(
+                    visit['visit_date'] or "", right, left,
+                    visit['frame_name'] or "", visit['lens_name'] or "", total
+                ))
+            
             # Close button with animation
             button_frame = ttk.Frame(main_frame)
             button_frame.pack(pady=20)  # Increased padding
@@ -1382,6 +1556,28 @@ class ShivamOpticals:
             close_button_frame = ttk.Frame(button_frame)
             close_button_frame.pack()
             
+            # Archived customers can be moved back to the current records
+            if customer.get('archived') and not self.client:
+                ttk.Label(button_frame, text="This customer is in the archive.",
+                          font=self.fonts['italic']).pack(before=close_button_frame, pady=(0, 10))
+                restore_button = self.create_animated_button(
+                    close_button_frame,
+                    text="Restore to Current Records",
+                    command=lambda: self.restore_archived_customer(customer['id'], detail_window),
+                    bg_color="#27ae60",
+                    hover_color="#2ecc71"
+                )
+                restore_button.pack(side="left", padx=(0, 10))
+            
+            print_button = self.create_animated_button(
+                close_button_frame,
+                text="Print Card & Invoice",
+                command=lambda: self.print_customer_documents(customer),
+                bg_color=self.primary_color,
+                hover_color=self.secondary_color
+            )
+            print_button.pack(side="left", padx=(0, 10))
+            
             close_icon = tk.Canvas(close_button_frame, width=25, height=25, highlightthickness=0)  # Increased size
             close_icon.create_rectangle(4, 4, 21, 21, fill="#e74c3c")
             close_icon.create_line(8, 8, 17, 17, width=2, fill="white")
@@ -1398,9 +1594,34 @@ class ShivamOpticals:
             )
             close_button.pack(side="left")
             
-        except sqlite3.Error as e:
+        except (sqlite3.Error, LanClientError) as e:
             messagebox.showerror("Database Error", f"Error retrieving customer details: {e}")
     
+    def restore_archived_customer(self, customer_id, detail_window=None):
+        """Move an archived customer back to the live database"""
+        def do_restore(job):
+            # Own connection: the move commits on its own
+            conn = database.connect()
+            try:
+                return archive.restore_customers(conn, [customer_id])
+            finally:
+                conn.close()
+        
+        def on_done(count):
+            if detail_window is not None:
+                detail_window.destroy()
+            self.refresh_customer_list(self.list_search)
+            self.update_archive_status()
+            if count:
+                messagebox.showinfo("Restore Complete", f"Customer #{customer_id} is a current record again.")
+        
+        self.jobs.submit(
+            "Restore archived customer",
+            do_restore,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to restore customer: {e}")
+        )
+    
     def view_customer_details(self, event):
         # Get selected item
         selected_item = self.customer_tree.selection()
@@ -1510,6 +1731,28 @@ class ShivamOpticals:
         line_canvas2 = tk.Canvas(center_title, width=80, height=2, bg=self.primary_color, highlightthickness=0)
         line_canvas2.pack(side="left", padx=10)
         
+        # Sections that work on the local database
+        if self.client:
+            self.setup_client_section(tools_frame)
+        else:
+            self.setup_export_section(tools_frame)
+            self.setup_documents_section(tools_frame)
+            self.setup_recall_section(tools_frame)
+            self.setup_reports_section(tools_frame)
+            self.setup_database_section(tools_frame)
+            self.setup_restore_section(tools_frame)
+            self.setup_archive_section(tools_frame)
+            self.setup_server_section(tools_frame)
+            self.setup_sync_section(tools_frame)
+            self.setup_duplicates_section(tools_frame)
+        
+        self.setup_health_section(tools_frame)
+        self.setup_jobs_section(tools_frame)
+        self.setup_monitor_section(tools_frame)
+        self.setup_log_section(tools_frame)
+    
+    def setup_export_section(self, tools_frame):
+        """Data export options"""
         # Data Export Section
         export_frame = ttk.LabelFrame(tools_frame, text="Data Export", padding=15)
         export_frame.pack(fill="x", pady=10)
@@ -1529,11 +1772,14 @@ class ShivamOpticals:
         export_desc_frame.pack(side="left", fill="x", expand=True, padx=10)
         
         ttk.Label(export_desc_frame, 
-                 text="Export customer data to Excel", 
+                 text="Export customer data",
                  font=self.fonts['bold']).pack(anchor="w")
         
         ttk.Label(export_desc_frame, 
-                 text="Export all your customer records, including prescriptions and product details to Excel format.", 
+                 text="Export your customer records, including prescriptions and product details, to Excel, "
+                      "CSV, JSON Lines (gzip writes one line per customer with their visits) or a SQLite "
+                      "snapshot. \"Changed Since Last Export\" only includes records added or edited "
+                      "since the previous changes export.",
                  wraplength=400).pack(anchor="w", pady=5)
         
         # Export options
@@ -1551,6 +1797,23 @@ class ShivamOpticals:
                       variable=self.export_type, value="all").pack(side="left", padx=10)
         ttk.Radiobutton(export_type_frame, text="Current Search Results", 
                       variable=self.export_type, value="search").pack(side="left", padx=10)
+        ttk.Radiobutton(export_type_frame, text="Changed Since Last Export",
+                      variable=self.export_type, value="changed").pack(side="left", padx=10)
+        
+        # File format selection
+        export_format_frame = ttk.Frame(options_frame)
+        export_format_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(export_format_frame, text="Format:").pack(side="left", padx=5)
+        
+        self.export_format = tk.StringVar(value="xlsx")
+        for fmt, label in exporters.EXPORT_FORMATS.items():
+            ttk.Radiobutton(export_format_frame, text=label,
+                          variable=self.export_format, value=fmt).pack(side="left", padx=10)
+        
+        self.export_watermark_label = ttk.Label(options_frame, text="")
+        self.export_watermark_label.pack(anchor="w", padx=5, pady=5)
+        self.update_export_watermark()
         
         # Export button with animation
         export_button_frame = ttk.Frame(export_frame)
@@ -1558,13 +1821,273 @@ class ShivamOpticals:
         
         export_button = self.create_animated_button(
             export_button_frame, 
-            text="Export to Excel", 
-            command=self.export_to_excel,
+            text="Export Data",
+            command=self.export_data,
             bg_color=self.primary_color,
             hover_color="#1D6F42"  # Excel green
         )
         export_button.pack(padx=10)
+    
+    def setup_documents_section(self, tools_frame):
+        """Batch printing of prescription cards and invoices"""
+        documents_frame = ttk.LabelFrame(tools_frame, text="Print Documents", padding=15)
+        documents_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(documents_frame,
+                 text="Render the prescription card and invoice of every visit in a date range "
+                      "into one PDF file for printing.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        range_frame = ttk.Frame(documents_frame)
+        range_frame.pack(fill="x", padx=10, pady=5)
+        
+        today = date.today()
+        ttk.Label(range_frame, text="From:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.documents_from_entry = ttk.Entry(range_frame, width=12, font=self.fonts['default'])
+        self.documents_from_entry.insert(0, today.replace(day=1).isoformat())
+        self.documents_from_entry.pack(side="left", padx=(0, 15))
+        
+        ttk.Label(range_frame, text="To:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.documents_to_entry = ttk.Entry(range_frame, width=12, font=self.fonts['default'])
+        self.documents_to_entry.insert(0, today.isoformat())
+        self.documents_to_entry.pack(side="left")
+        
+        render_button = self.create_animated_button(
+            documents_frame,
+            text="Create PDF",
+            command=self.render_document_batch,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        render_button.pack(pady=10)
+    
+    def render_document_batch(self):
+        """Render the documents of a date range on all processor cores"""
+        start_date = self.documents_from_entry.get().strip()
+        end_date = self.documents_to_entry.get().strip()
+        try:
+            date.fromisoformat(start_date)
+            date.fromisoformat(end_date)
+        except ValueError:
+            messagebox.showerror("Invalid Date", "Enter dates as YYYY-MM-DD")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
+            initialfile=f"documents_{start_date}_{end_date}.pdf",
+            title="Save Documents As"
+        )
+        if not file_path:
+            return
+        
+        def do_render(job):
+            # Queued saves should be printed too
+            self.writes.flush()
+            return documents.render_batch(file_path, start_date, end_date, job=job)
+        
+        def on_done(pages):
+            if pages:
+                messagebox.showinfo("Documents Created", f"{pages} page(s) written to:\n{file_path}")
+            else:
+                messagebox.showinfo("Documents Created", "No visits were found in this date range.")
+        
+        self.jobs.submit(
+            "Render documents",
+            do_render,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to create documents: {e}")
+        )
+    
+    def setup_recall_section(self, tools_frame):
+        """Monthly list of customers due for an eye test"""
+        recall_frame = ttk.LabelFrame(tools_frame, text="Eye Test Recall", padding=15)
+        recall_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(recall_frame,
+                 text="Customers whose last eye test was 12 or 24 months before the chosen month and who "
+                      "have not been back since, saved as a CSV file for reminder calls and messages.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        month_frame = ttk.Frame(recall_frame)
+        month_frame.pack(fill="x", padx=10, pady=5)
+        
+        ttk.Label(month_frame, text="Month:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.recall_month_entry = ttk.Entry(month_frame, width=10, font=self.fonts['default'])
+        self.recall_month_entry.insert(0, date.today().strftime("%Y-%m"))
+        self.recall_month_entry.pack(side="left", padx=(0, 15))
+        
+        # Customers due for their 24-month recall are often archived already
+        self.recall_archive_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(month_frame, text="Include archive",
+                        variable=self.recall_archive_var).pack(side="left")
+        
+        recall_button = self.create_animated_button(
+            recall_frame,
+            text="Export Recall List",
+            command=self.export_recall_list,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        recall_button.pack(pady=10)
+    
+    def export_recall_list(self):
+        """Save the recall list of the chosen month as a CSV file"""
+        try:
+            month = recall.parse_month(self.recall_month_entry.get())
+        except ValueError:
+            messagebox.showerror("Invalid Month", "Enter the month as YYYY-MM")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            initialfile=f"recall_{month:%Y-%m}.csv",
+            title="Save Recall List As"
+        )
+        if not file_path:
+            return
+        include_archive = self.recall_archive_var.get()
+        
+        def do_export(job):
+            return self.store.export_recall(file_path, month, include_archive, job=job)
+        
+        def on_done(result):
+            customers, _ = result
+            if customers:
+                messagebox.showinfo("Recall List",
+                                    f"{customers} customer(s) due for an eye test in {month:%B %Y} "
+                                    f"written to:\n{file_path}")
+            else:
+                messagebox.showinfo("Recall List", f"No customers are due for an eye test in {month:%B %Y}.")
+        
+        self.jobs.submit(
+            "Export recall list",
+            do_export,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to export the recall list: {e}")
+        )
+    
+    def setup_reports_section(self, tools_frame):
+        """Revenue totals by day, month or frame"""
+        reports_frame = ttk.LabelFrame(tools_frame, text="Revenue Reports", padding=15)
+        reports_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(reports_frame,
+                 text="Sales and revenue for a date range, totalled by day, by month or by frame.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        type_frame = ttk.Frame(reports_frame)
+        type_frame.pack(fill="x", padx=10, pady=5)
+        self.report_type_var = tk.StringVar(value="monthly")
+        for report, text in (("daily", "Daily"), ("monthly", "Monthly"), ("frame", "By frame")):
+            ttk.Radiobutton(type_frame, text=text, value=report,
+                            variable=self.report_type_var).pack(side="left", padx=(0, 15))
+        
+        range_frame = ttk.Frame(reports_frame)
+        range_frame.pack(fill="x", padx=10, pady=5)
+        
+        today = date.today()
+        ttk.Label(range_frame, text="From:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.report_from_entry = ttk.Entry(range_frame, width=12, font=self.fonts['default'])
+        self.report_from_entry.insert(0, today.replace(month=1, day=1).isoformat())
+        self.report_from_entry.pack(side="left", padx=(0, 15))
+        
+        ttk.Label(range_frame, text="To:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.report_to_entry = ttk.Entry(range_frame, width=12, font=self.fonts['default'])
+        self.report_to_entry.insert(0, today.isoformat())
+        self.report_to_entry.pack(side="left", padx=(0, 15))
+        
+        self.report_archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(range_frame, text="Include archive",
+                        variable=self.report_archive_var).pack(side="left")
+        
+        report_button = self.create_animated_button(
+            reports_frame,
+            text="Show Report",
+            command=self.show_revenue_report,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        report_button.pack(pady=10)
+    
+    def show_revenue_report(self):
+        """Run the chosen revenue report in the background and show it"""
+        report = self.report_type_var.get()
+        start_date = self.report_from_entry.get().strip()
+        end_date = self.report_to_entry.get().strip()
+        include_archive = self.report_archive_var.get()
+        try:
+            date.fromisoformat(start_date)
+            date.fromisoformat(end_date)
+        except ValueError:
+            messagebox.showerror("Invalid Date", "Enter dates as YYYY-MM-DD")
+            return
+        
+        def run_report(job):
+            self.writes.flush()
+            conn = database.connect_readonly()
+            try:
+                return reports.revenue_report(conn.cursor(), report, start_date, end_date, include_archive)
+            finally:
+                conn.close()
+        
+        def on_done(rows):
+            window = tk.Toplevel(self.root)
+            window.title(f"Revenue {start_date} to {end_date}")
+            window.geometry("520x480")
+            window.transient(self.root)
+            
+            tree_frame = ttk.Frame(window, padding=10)
+            tree_frame.pack(fill="both", expand=True)
+            tree = ttk.Treeview(tree_frame, columns=("period", "sales", "revenue"), show="headings")
+            tree.heading("period", text=reports.REPORTS[report][0])
+            tree.heading("sales", text="Sales")
+            tree.heading("revenue", text="Revenue (₹)")
+            tree.column("period", width=220)
+            tree.column("sales", width=80, anchor="e")
+            tree.column("revenue", width=140, anchor="e")
+            scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side="left", fill="both", expand=True)
+            scrollbar.pack(side="right", fill="y")
+            for values in reports.format_report(rows):
+                tree.insert("", "end", values=values)
+            
+            sales, revenue = reports.revenue_totals(rows)
+            ttk.Label(window, text=f"Total: {sales:,} sales, ₹{format_rupees(revenue, grouped=True)}",
+                      font=self.fonts['bold']).pack(pady=(0, 10))
+        
+        self.jobs.submit(
+            "Revenue report",
+            run_report,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to run report: {e}")
+        )
+    
+    def print_customer_documents(self, customer):
+        """Save the prescription card and invoice of a customer's latest visit"""
+        pages = documents.customer_pages(customer)
+        if not pages:
+            messagebox.showwarning("Print Documents", "This customer has no visits to print.")
+            return
         
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
+            initialfile=f"customer_{customer['id']}.pdf",
+            title="Save Prescription Card & Invoice As"
+        )
+        if not file_path:
+            return
+        try:
+            documents.write_pdf(file_path, pages)
+            messagebox.showinfo("Documents Created", f"Prescription card and invoice saved to:\n{file_path}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save documents: {e}")
+    
+    def setup_database_section(self, tools_frame):
+        """Backup and optimization controls"""
         # Database Management Section
         db_frame = ttk.LabelFrame(tools_frame, text="Database Management", padding=15)
         db_frame.pack(fill="x", pady=10)
@@ -1620,48 +2143,1003 @@ class ShivamOpticals:
         # Show when last backup was created
         self.last_backup_label = ttk.Label(status_frame, text="Automatic backups are created every 2 hours.")
         self.last_backup_label.pack(anchor="w", padx=10)
+        
+        # Write durability
+        durability_frame = ttk.Frame(db_frame)
+        durability_frame.pack(fill="x", padx=10, pady=(10, 5))
+        
+        ttk.Label(durability_frame, text="Write durability:",
+                  font=self.fonts['bold']).pack(side="left", padx=(0, 10))
+        
+        self.durability_var = tk.StringVar(value=self.writes.durability)
+        ttk.Radiobutton(durability_frame, text="Full (flush every commit)",
+                        variable=self.durability_var, value="full",
+                        command=self.change_write_durability).pack(side="left", padx=5)
+        ttk.Radiobutton(durability_frame, text="Normal (faster, periodic checkpoint)",
+                        variable=self.durability_var, value="normal",
+                        command=self.change_write_durability).pack(side="left", padx=5)
+        
+        # Write-ahead log checkpoints
+        wal_frame = ttk.Frame(db_frame)
+        wal_frame.pack(fill="x", padx=10, pady=(10, 5))
+        
+        ttk.Label(wal_frame, text="Auto-checkpoint (pages):", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.wal_autocheckpoint_entry = ttk.Entry(wal_frame, width=8, font=self.fonts['default'])
+        self.wal_autocheckpoint_entry.insert(0, str(database.WAL_PRAGMAS['wal_autocheckpoint']))
+        self.wal_autocheckpoint_entry.pack(side="left", padx=(0, 15))
+        
+        ttk.Label(wal_frame, text="WAL size limit (MB):", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.wal_limit_entry = ttk.Entry(wal_frame, width=8, font=self.fonts['default'])
+        self.wal_limit_entry.insert(0, str(database.WAL_PRAGMAS['journal_size_limit'] // (1024 * 1024)))
+        self.wal_limit_entry.pack(side="left", padx=(0, 15))
+        
+        ttk.Button(wal_frame, text="Apply", command=self.change_wal_settings).pack(side="left", padx=(0, 5))
+        ttk.Button(wal_frame, text="Checkpoint Now", command=self.checkpoint_now).pack(side="left")
+        
+        self.wal_status_label = ttk.Label(db_frame, text="", wraplength=600)
+        self.wal_status_label.pack(anchor="w", padx=10)
+    
+    def change_wal_settings(self):
+        """Store the WAL settings and apply them to the open connections"""
+        try:
+            autocheckpoint = int(self.wal_autocheckpoint_entry.get())
+            size_limit = int(float(self.wal_limit_entry.get()) * 1024 * 1024)
+            self.store.change_wal_settings(autocheckpoint, size_limit)
+        except ValueError:
+            messagebox.showwarning("Validation Error", "Please enter whole numbers of pages and megabytes")
+    
+    def checkpoint_now(self):
+        """Copy the whole WAL into the database file and empty it"""
+        def on_done(entry):
+            if not entry['complete']:
+                messagebox.showwarning(
+                    "Checkpoint", "Some of the WAL is still in use by a reader and could not be "
+                                  "copied. It will be checkpointed once the reader finishes.")
+        
+        self.jobs.submit(
+            "WAL checkpoint",
+            lambda job: self.checkpointer.checkpoint("TRUNCATE", "Manual"),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Checkpoint failed: {e}")
+        )
+    
+    def change_write_durability(self):
+        """Apply and remember the selected write durability"""
+        durability = self.durability_var.get()
+        self.store.set_durability(durability)
+    
+    def setup_restore_section(self, tools_frame):
+        """Backup list with verification and online restore"""
+        restore_frame = ttk.LabelFrame(tools_frame, text="Backups & Restore", padding=15)
+        restore_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(restore_frame,
+                 text="Check that backups can be read, or bring the database back to an earlier backup. "
+                      "The current data is saved as a \"pre_restore\" backup first, so a restore can be undone.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        backup_columns = ("name", "created", "size", "customers", "visits", "status")
+        self.backups_tree = ttk.Treeview(restore_frame, columns=backup_columns, show="headings", height=6)
+        self.backups_tree.heading("name", text="Backup", anchor="center")
+        self.backups_tree.heading("created", text="Created", anchor="center")
+        self.backups_tree.heading("size", text="Size", anchor="center")
+        self.backups_tree.heading("customers", text="Customers", anchor="center")
+        self.backups_tree.heading("visits", text="Visits", anchor="center")
+        self.backups_tree.heading("status", text="Check", anchor="center")
+        self.backups_tree.column("name", width=250, anchor="w")
+        self.backups_tree.column("created", width=130, anchor="center")
+        self.backups_tree.column("size", width=80, anchor="e")
+        self.backups_tree.column("customers", width=80, anchor="e")
+        self.backups_tree.column("visits", width=70, anchor="e")
+        self.backups_tree.column("status", width=160, anchor="w")
+        self.backups_tree.pack(fill="x", padx=10, pady=5)
+        self.backup_paths = {}
+        
+        restore_buttons_frame = ttk.Frame(restore_frame)
+        restore_buttons_frame.pack(pady=10)
+        
+        refresh_button = self.create_animated_button(
+            restore_buttons_frame,
+            text="Refresh List",
+            command=self.refresh_backup_list,
+            bg_color="#3498db",
+            hover_color="#2980b9"
+        )
+        refresh_button.pack(side="left", padx=10)
+        
+        verify_button = self.create_animated_button(
+            restore_buttons_frame,
+            text="Verify Backups",
+            command=self.verify_selected_backups,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        verify_button.pack(side="left", padx=10)
+        
+        restore_button = self.create_animated_button(
+            restore_buttons_frame,
+            text="Restore Selected",
+            command=self.restore_selected_backup,
+            bg_color="#e74c3c",
+            hover_color="#c0392b"
+        )
+        restore_button.pack(side="left", padx=10)
+        
+        self.refresh_backup_list()
+    
+    def refresh_backup_list(self):
+        """List the backups with their sizes and row counts"""
+        def do_list(job):
+            found = backups.list_backups()
+            for index, backup in enumerate(found):
+                job.check_cancelled()
+                job.report(index / max(len(found), 1), "Counting backup rows")
+                backup["counts"] = backups.count_rows(backup["path"])
+            return found
+        
+        def on_done(found):
+            self.backups_tree.delete(*self.backups_tree.get_children())
+            self.backup_paths = {}
+            for backup in found:
+                counts = backup["counts"]
+                item = self.backups_tree.insert("", "end", values=(
+                    backup["name"],
+                    backup["created"].strftime("%Y-%m-%d %H:%M"),
+                    f"{backup['size'] / 2 ** 20:.1f} MB",
+                    counts["customers"] if counts else "?",
+                    counts["prescriptions"] if counts else "?",
+                    "" if counts else "Unreadable"
+                ))
+                self.backup_paths[item] = backup["path"]
+        
+        self.jobs.submit(
+            "List backups",
+            do_list,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to list backups: {e}")
+        )
+    
+    def verify_selected_backups(self):
+        """Run quick_check on the selected backups (all when none is selected)"""
+        items = [item for item in self.backups_tree.selection() if item in self.backup_paths]
+        items = items or list(self.backup_paths)
+        if not items:
+            messagebox.showinfo("Verify Backups", "There are no backups to verify.")
+            return
+        for item in items:
+            self.backups_tree.set(item, "status", "Checking...")
+        
+        def on_done(results):
+            for item, (_, ok, message) in zip(items, results):
+                if self.backups_tree.exists(item):
+                    self.backups_tree.set(item, "status", "OK" if ok else f"FAILED: {message}")
+            failed = sum(1 for _, ok, _ in results if not ok)
+            if failed:
+                messagebox.showwarning("Verify Backups", f"{failed} of {len(results)} backup(s) failed the check.")
+        
+        self.jobs.submit(
+            "Verify backups",
+            lambda job: backups.verify_backups([self.backup_paths[item] for item in items], job=job),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to verify backups: {e}")
+        )
+    
+    def restore_selected_backup(self):
+        """Replace the live database with the selected backup"""
+        items = [item for item in self.backups_tree.selection() if item in self.backup_paths]
+        if len(items) != 1:
+            messagebox.showwarning("Restore Backup", "Select one backup to restore")
+            return
+        backup_path = self.backup_paths[items[0]]
+        if self.server_thread:
+            # The server's own writer can't be paused from here
+            messagebox.showwarning("Restore Backup", "Stop the LAN server before restoring a backup")
+            return
+        if not messagebox.askyesno(
+                "Restore Backup",
+                f"Replace all current data with {os.path.basename(backup_path)}?\n\n"
+                "Customers saved after this backup was made will no longer be listed "
+                "(they stay in the pre-restore backup)."):
+            return
+        
+        def do_restore(job):
+            self.store.restore(backup_path, database.BACKUP_DIR, job=job)
+        
+        def on_done(_):
+            self.refresh_customer_list()
+            self.refresh_backup_list()
+            self.update_archive_status()
+            self.update_export_watermark()
+            messagebox.showinfo("Restore Complete", "The database has been restored from the backup.")
+        
+        self.jobs.submit(
+            "Restore backup",
+            do_restore,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Restore Error", f"Failed to restore backup: {e}")
+        )
+    
+    def setup_archive_section(self, tools_frame):
+        """Move customers who have not visited for a long time to the archive"""
+        archive_frame = ttk.LabelFrame(tools_frame, text="Archive", padding=15)
+        archive_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(archive_frame,
+                 text="Customers whose last visit is older than the age below are moved to a separate "
+                      "archive file. The customer list, backups and optimization then only handle recent "
+                      "customers; archived ones are still found with \"Include archive\" or when nothing "
+                      "current matches a search.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        age_frame = ttk.Frame(archive_frame)
+        age_frame.pack(fill="x", padx=10, pady=5)
+        
+        ttk.Label(age_frame, text="Archive customers not seen for (days):",
+                  font=self.fonts['bold']).pack(side="left", padx=(0, 10))
+        self.archive_days_var = tk.StringVar(value=self.store.get_setting(
+            "archive_after_days", str(archive.DEFAULT_ARCHIVE_DAYS)))
+        ttk.Spinbox(age_frame, from_=180, to=3650, increment=30, width=8,
+                    textvariable=self.archive_days_var).pack(side="left")
+        
+        archive_button = self.create_animated_button(
+            archive_frame,
+            text="Archive Old Records",
+            command=self.archive_old_customers,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        archive_button.pack(pady=10)
+        
+        self.archive_status_label = ttk.Label(archive_frame, text="")
+        self.archive_status_label.pack(anchor="w", padx=10)
+        self.update_archive_status()
+    
+    def update_archive_status(self):
+        """Show how many customers are current and archived"""
+        if self.client or not hasattr(self, "archive_status_label"):
+            return
+        try:
+            live, archived = self.store.archive_counts()
+            self.archive_status_label.configure(
+                text=f"Current customers: {live}    Archived customers: {archived}")
+        except sqlite3.Error as e:
+            self.archive_status_label.configure(text=f"Archive unavailable: {e}")
+    
+    def archive_old_customers(self):
+        """Archive customers older than the configured age in the background"""
+        try:
+            days = int(self.archive_days_var.get())
+            if days < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid Age", "Enter the age in days as a positive whole number")
+            return
+        self.store.set_setting("archive_after_days", str(days))
+        cutoff = archive.archive_cutoff(days)
+        
+        if not messagebox.askyesno("Archive Old Records",
+                                   f"Move customers last seen before {cutoff} to the archive?"):
+            return
+        
+        def do_archive(job):
+            # Queued saves must be in the database before rows are moved
+            self.writes.flush()
+            # Own connection: each batch commits on its own
+            conn = database.connect()
+            try:
+                count = archive.archive_customers_before(conn, cutoff, job=job)
+                if count:
+                    job.report(1.0, "Backing up archive")
+                    archive.backup_archive(conn)
+                return count
+            finally:
+                conn.close()
+        
+        def on_done(count):
+            self.refresh_customer_list(self.list_search)
+            self.update_archive_status()
+            messagebox.showinfo("Archive Complete", f"{count} customer(s) moved to the archive.")
+        
+        self.jobs.submit(
+            "Archive old customers",
+            do_archive,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Archive Error", f"Failed to archive customers: {e}")
+        )
+    
+    def setup_server_section(self, tools_frame):
+        """Controls for sharing this database with other counters"""
+        server_frame = ttk.LabelFrame(tools_frame, text="LAN Server", padding=15)
+        server_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(server_frame,
+                 text="Share this computer's database with other billing counters on the shop network. "
+                      "Enter this computer's address on the shop network (127.0.0.1 keeps the server "
+                      "private to this computer). Other counters start the app with "
+                      "--server <address>:<port> --token <token shown once the server is running>.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        port_frame = ttk.Frame(server_frame)
+        port_frame.pack(fill="x", pady=5)
+        
+        ttk.Label(port_frame, text="Address:").pack(side="left", padx=5)
+        self.server_host_entry = ttk.Entry(port_frame, width=16, font=self.fonts['default'])
+        self.server_host_entry.insert(0, self.store.get_setting(HOST_SETTING, DEFAULT_HOST))
+        self.server_host_entry.pack(side="left", padx=5)
+        
+        ttk.Label(port_frame, text="Port:").pack(side="left", padx=5)
+        self.server_port_entry = ttk.Entry(port_frame, width=8, font=self.fonts['default'])
+        self.server_port_entry.insert(0, str(DEFAULT_PORT))
+        self.server_port_entry.pack(side="left", padx=5)
+        
+        self.server_button = self.create_animated_button(
+            port_frame,
+            text="Start Server",
+            command=self.toggle_lan_server,
+            bg_color=self.primary_color,
+            hover_color=self.secondary_color
+        )
+        self.server_button.pack(side="left", padx=10)
+        
+        self.server_status_label = ttk.Label(server_frame, text="Server is not running.")
+        self.server_status_label.pack(anchor="w", padx=10, pady=5)
+    
+    def setup_client_section(self, tools_frame):
+        """Connection status when running as a thin client"""
+        client_frame = ttk.LabelFrame(tools_frame, text="LAN Server Connection", padding=15)
+        client_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(client_frame,
+                 text=f"This counter uses the shared database at {self.client.base_url}. "
+                      "Export, backup and maintenance are done on the server computer.",
+                 wraplength=400).pack(anchor="w", pady=5)
+    
+    def setup_sync_section(self, tools_frame):
+        """Change-set export and import between branches"""
+        # Branch Sync Section
+        sync_frame = ttk.LabelFrame(tools_frame, text="Branch Sync", padding=15)
+        sync_frame.pack(fill="x", pady=10)
+        
+        sync_icon_frame = ttk.Frame(sync_frame)
+        sync_icon_frame.pack(fill="x", pady=10)
+        
+        # Sync icon
+        sync_canvas = tk.Canvas(sync_icon_frame, width=40, height=40, highlightthickness=0)
+        sync_canvas.create_rectangle(5, 5, 35, 35, fill="#8e44ad")  # Purple
+        sync_canvas.create_text(20, 20, text="S", fill="white", font=("Arial", 16, "bold"))
+        sync_canvas.pack(side="left", padx=10)
+        
+        sync_desc_frame = ttk.Frame(sync_icon_frame)
+        sync_desc_frame.pack(side="left", fill="x", expand=True, padx=10)
+        
+        ttk.Label(sync_desc_frame,
+                 text="Share changes between branches",
+                 font=self.fonts['bold']).pack(anchor="w")
+        
+        ttk.Label(sync_desc_frame,
+                 text="Export this branch's changes to a file (USB stick or shared folder) and import files from other branches. Importing the same file twice is safe.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        self.sync_status_label = ttk.Label(sync_frame, text="")
+        self.sync_status_label.pack(anchor="w", padx=10)
+        self.update_sync_status()
+        
+        sync_buttons_frame = ttk.Frame(sync_frame)
+        sync_buttons_frame.pack(pady=10)
+        
+        export_changes_button = self.create_animated_button(
+            sync_buttons_frame,
+            text="Export Changes",
+            command=self.export_branch_changes,
+            bg_color=self.primary_color,
+            hover_color="#8e44ad"
+        )
+        export_changes_button.pack(side="left", padx=10)
+        
+        import_changes_button = self.create_animated_button(
+            sync_buttons_frame,
+            text="Import Changes",
+            command=self.import_branch_changes,
+            bg_color=self.primary_color,
+            hover_color="#8e44ad"
+        )
+        import_changes_button.pack(side="left", padx=10)
+    
+    def setup_duplicates_section(self, tools_frame):
+        """Review screen for customers entered more than once"""
+        # Duplicate Customers Section
+        duplicates_frame = ttk.LabelFrame(tools_frame, text="Duplicate Customers", padding=15)
+        duplicates_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(duplicates_frame,
+                 text="Find customers who were entered more than once with differently spelled names (for example \"R. Sarma\" and \"Ramesh Sharma\"). Merging moves all visits to the older record.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        self.duplicates_all_cores_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(duplicates_frame, text="Use all processor cores",
+                        variable=self.duplicates_all_cores_var).pack(anchor="w", padx=10)
+        
+        duplicate_columns = ("score", "keep", "duplicate")
+        self.duplicates_tree = ttk.Treeview(duplicates_frame, columns=duplicate_columns,
+                                            show="headings", height=8)
+        self.duplicates_tree.heading("score", text="Match", anchor="center")
+        self.duplicates_tree.heading("keep", text="Keep", anchor="center")
+        self.duplicates_tree.heading("duplicate", text="Merge Into It", anchor="center")
+        self.duplicates_tree.column("score", width=70, anchor="center")
+        self.duplicates_tree.column("keep", width=300, anchor="w")
+        self.duplicates_tree.column("duplicate", width=300, anchor="w")
+        self.duplicates_tree.pack(fill="x", padx=10, pady=5)
+        self.duplicate_pairs = {}
+        
+        duplicates_buttons_frame = ttk.Frame(duplicates_frame)
+        duplicates_buttons_frame.pack(pady=10)
+        
+        find_duplicates_button = self.create_animated_button(
+            duplicates_buttons_frame,
+            text="Find Duplicates",
+            command=self.find_duplicate_customers,
+            bg_color=self.primary_color,
+            hover_color="#2980b9"
+        )
+        find_duplicates_button.pack(side="left", padx=10)
+        
+        merge_button = self.create_animated_button(
+            duplicates_buttons_frame,
+            text="Merge Selected",
+            command=self.merge_selected_duplicates,
+            bg_color="#27ae60",
+            hover_color="#2ecc71"
+        )
+        merge_button.pack(side="left", padx=10)
+        
+        dismiss_button = self.create_animated_button(
+            duplicates_buttons_frame,
+            text="Not Duplicates",
+            command=self.dismiss_selected_duplicates,
+            bg_color="#e74c3c",
+            hover_color="#c0392b"
+        )
+        dismiss_button.pack(side="left", padx=10)
+    
+    def find_duplicate_customers(self):
+        """Refresh blocking keys and list likely duplicates in the background"""
+        workers = (os.cpu_count() or 1) if self.duplicates_all_cores_var.get() else 1
+        
+        def do_find(job):
+            # Own connection so the UI connection stays free
+            conn = database.connect()
+            try:
+                finder = DuplicateFinder(conn)
+                finder.refresh_keys(job=job)
+                return finder.find(workers=workers, job=job, limit=1000)
+            finally:
+                conn.close()
+        
+        def on_done(pairs):
+            self.duplicates_tree.delete(*self.duplicates_tree.get_children())
+            self.duplicate_pairs = {}
+            for score, keeper, duplicate in pairs:
+                item = self.duplicates_tree.insert("", "end", values=(
+                    f"{score:.0%}",
+                    f"#{keeper[0]} {keeper[1]}  {keeper[2] or ''}  ({keeper[3] or ''})",
+                    f"#{duplicate[0]} {duplicate[1]}  {duplicate[2] or ''}  ({duplicate[3] or ''})"
+                ))
+                self.duplicate_pairs[item] = (keeper[0], duplicate[0])
+            if not pairs:
+                messagebox.showinfo("Duplicate Customers", "No likely duplicates were found.")
+        
+        self.jobs.submit(
+            "Find duplicate customers",
+            do_find,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Failed to find duplicates: {e}")
+        )
+    
+    def merge_selected_duplicates(self):
+        """Merge each selected pair into its older customer record"""
+        items = [item for item in self.duplicates_tree.selection() if item in self.duplicate_pairs]
+        if not items:
+            messagebox.showwarning("Duplicate Customers", "Select one or more pairs to merge")
+            return
+        if not messagebox.askyesno("Merge Customers",
+                                   f"Merge {len(items)} selected pair(s)? This cannot be undone."):
+            return
+        
+        def do_merge(cursor, pairs):
+            for keeper_id, duplicate_id in pairs:
+                # Skip pairs whose records were merged away earlier in the list
+                cursor.execute("SELECT COUNT(*) FROM customers WHERE id IN (?, ?)",
+                               (keeper_id, duplicate_id))
+                if cursor.fetchone()[0] == 2:
+                    database.merge_customers(cursor, keeper_id, [duplicate_id])
+        
+        pairs = [self.duplicate_pairs.pop(item) for item in items]
+        self.duplicates_tree.delete(*items)
+        future = self.writes.submit(do_merge, pairs, durable=True)
+        future.add_done_callback(
+            lambda f: self.jobs.call_in_ui(self.on_duplicates_merged, f)
+        )
+    
+    def on_duplicates_merged(self, future):
+        """Refresh the customer list after a merge"""
+        if future.exception():
+            messagebox.showerror("Error", f"Failed to merge customers: {future.exception()}")
+            return
+        self.refresh_customer_list()
+    
+    def dismiss_selected_duplicates(self):
+        """Remember that the selected pairs are different people"""
+        items = [item for item in self.duplicates_tree.selection() if item in self.duplicate_pairs]
+        for item in items:
+            self.writes.submit(dismiss_pair, *self.duplicate_pairs.pop(item))
+        self.duplicates_tree.delete(*items)
+    
+    def setup_jobs_section(self, tools_frame):
+        """List of running and recent background jobs"""
+        # Background Jobs Section
+        jobs_frame = ttk.LabelFrame(tools_frame, text="Background Jobs", padding=15)
+        jobs_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(jobs_frame,
+                 text="Exports, backups and maintenance run in the background. Running and recent jobs are listed here.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        job_columns = ("job", "status", "progress", "duration")
+        self.jobs_tree = ttk.Treeview(jobs_frame, columns=job_columns, show="headings", height=6)
+        self.jobs_tree.heading("job", text="Job", anchor="center")
+        self.jobs_tree.heading("status", text="Status", anchor="center")
+        self.jobs_tree.heading("progress", text="Progress", anchor="center")
+        self.jobs_tree.heading("duration", text="Duration", anchor="center")
+        self.jobs_tree.column("job", width=250, anchor="w")
+        self.jobs_tree.column("status", width=100, anchor="center")
+        self.jobs_tree.column("progress", width=220, anchor="w")
+        self.jobs_tree.column("duration", width=100, anchor="center")
+        self.jobs_tree.pack(fill="x", padx=10, pady=5)
+        
+        cancel_job_button = self.create_animated_button(
+            jobs_frame,
+            text="Cancel Selected Job",
+            command=self.cancel_selected_job,
+            bg_color="#e74c3c",
+            hover_color="#c0392b"
+        )
+        cancel_job_button.pack(pady=5)
+        
+        # Refresh the jobs list periodically
+        self.update_jobs_panel()
+    
+    def setup_monitor_section(self, tools_frame):
+        """Stall watchdog summary"""
+        # Responsiveness Monitor Section
+        monitor_frame = ttk.LabelFrame(tools_frame, text="Responsiveness Monitor", padding=15)
+        monitor_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(monitor_frame,
+                 text="Records moments when the window stops responding and what it was doing.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        self.stall_summary_label = ttk.Label(monitor_frame, text="No stalls recorded.",
+                                           font=self.fonts['bold'])
+        self.stall_summary_label.pack(anchor="w", padx=10, pady=5)
+        
+        self.stall_detail_label = ttk.Label(monitor_frame, text="", wraplength=600)
+        self.stall_detail_label.pack(anchor="w", padx=10)
+        
+        ttk.Label(monitor_frame, text=f"Stall log: {self.watchdog.log_path}",
+                 font=self.fonts['small']).pack(anchor="w", padx=10, pady=(5, 0))
+        
+        # Refresh the summary periodically
+        self.update_stall_summary()
+    
+    def setup_health_section(self, tools_frame):
+        """Live database, backup, latency and memory figures"""
+        health_frame = ttk.LabelFrame(tools_frame, text="Performance & Health", padding=15)
+        health_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(health_frame,
+                 text="Database size, backups and how fast everyday work is running. "
+                      "Suggestions below tell you when to optimize, back up or archive.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        self.health_db_label = ttk.Label(health_frame, text="Reading...", font=self.fonts['bold'])
+        self.health_db_label.pack(anchor="w", padx=10, pady=(5, 0))
+        self.health_detail_label = ttk.Label(health_frame, text="", wraplength=600, justify="left")
+        self.health_detail_label.pack(anchor="w", padx=10)
+        
+        latency_columns = ("operation", "count", "p50", "p95", "p99")
+        self.latency_tree = ttk.Treeview(health_frame, columns=latency_columns, show="headings",
+                                         height=len(health.OPERATIONS))
+        self.latency_tree.heading("operation", text="Operation", anchor="center")
+        self.latency_tree.heading("count", text="Timed", anchor="center")
+        self.latency_tree.heading("p50", text="Median", anchor="center")
+        self.latency_tree.heading("p95", text="95%", anchor="center")
+        self.latency_tree.heading("p99", text="99%", anchor="center")
+        self.latency_tree.column("operation", width=150, anchor="w")
+        for column in latency_columns[1:]:
+            self.latency_tree.column(column, width=100, anchor="e")
+        self.latency_tree.pack(fill="x", padx=10, pady=5)
+        
+        self.health_advice_label = ttk.Label(health_frame, text="", wraplength=600, justify="left",
+                                             foreground="#c0392b")
+        self.health_advice_label.pack(anchor="w", padx=10, pady=(5, 0))
+        
+        # Refresh the panel periodically
+        self.update_health_panel()
+    
+    def update_health_panel(self):
+        """Ask the health reader for a new snapshot and show it when ready"""
+        self.health_reader.refresh(self.show_health_snapshot)
+        self.root.after(5000, self.update_health_panel)
+    
+    def show_health_snapshot(self, snapshot):
+        """Fill the health panel from a health.collect snapshot"""
+        stats = snapshot['database']
+        lines = []
+        if stats:
+            free = stats['freelist_count'] / stats['page_count'] if stats['page_count'] else 0
+            self.health_db_label.configure(
+                text=f"Database: {health.format_bytes(stats['db_bytes'])}    "
+                     f"WAL: {health.format_bytes(stats['wal_bytes'])}    "
+                     f"Archive: {health.format_bytes(stats['archive_bytes'])}")
+            lines.append(f"Pages: {stats['page_count']:,} of {stats['page_size']:,} bytes, "
+                         f"{stats['freelist_count']:,} free ({free:.0%})")
+            lines.append(f"Page cache {health.format_bytes(stats['cache_bytes'])}, memory map "
+                         f"{health.format_bytes(stats['mmap_bytes'])}: "
+                         f"{health.cache_coverage(stats):.0%} of the database fits")
+            
+            backup_time, backup_seconds = snapshot['last_backup']
+            if backup_time is None:
+                lines.append("Last backup: never")
+            else:
+                took = f", took {backup_seconds:.1f} s" if backup_seconds is not None else ""
+                lines.append(f"Last backup: {backup_time.strftime('%Y-%m-%d %H:%M')}{took}")
+        else:
+            self.health_db_label.configure(text="Database figures are on the server counter.")
+        
+        for name, (rate, lookups) in snapshot['caches'].items():
+            if rate is not None:
+                lines.append(f"{name} cache: {rate:.0%} hits of {lookups:,} lookups")
+        lines.append(f"App memory: {health.format_bytes(snapshot['memory_bytes'])}")
+        self.health_detail_label.configure(text="\n".join(lines))
+        
+        self.latency_tree.delete(*self.latency_tree.get_children())
+        for operation, figures in snapshot['latency'].items():
+            if figures is None:
+                values = (operation.capitalize(), 0, "-", "-", "-")
+            else:
+                count, p50, p95, p99 = figures
+                values = (operation.capitalize(), count, f"{p50:.1f} ms", f"{p95:.1f} ms", f"{p99:.1f} ms")
+            self.latency_tree.insert("", "end", values=values)
+        
+        hints = health.advice(snapshot)
+        if self.checkpointer:
+            checkpoint_status = self.checkpointer.status()
+            hints.extend(checkpoints.advice(checkpoint_status))
+            if getattr(self, "wal_status_label", None):
+                self.wal_status_label.configure(text=checkpoints.describe(checkpoint_status))
+        self.health_advice_label.configure(text="\n".join(hints))
+    
+    def setup_log_section(self, tools_frame):
+        """Recent application log events with level and text filters"""
+        log_frame = ttk.LabelFrame(tools_frame, text="Application Log", padding=15)
+        log_frame.pack(fill="x", pady=10)
+        
+        ttk.Label(log_frame,
+                 text="Recent events and errors. Double-click an event for its details.",
+                 wraplength=400).pack(anchor="w", pady=5)
+        
+        filter_frame = ttk.Frame(log_frame)
+        filter_frame.pack(fill="x", padx=10, pady=5)
+        
+        ttk.Label(filter_frame, text="Level:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.log_level_var = tk.StringVar(value="Info")
+        level_box = ttk.Combobox(filter_frame, textvariable=self.log_level_var, values=list(applog.LEVELS),
+                                 state="readonly", width=10)
+        level_box.pack(side="left", padx=(0, 15))
+        level_box.bind("<<ComboboxSelected>>", lambda event: self.refresh_log_view())
+        
+        ttk.Label(filter_frame, text="Filter:", font=self.fonts['bold']).pack(side="left", padx=(0, 5))
+        self.log_filter_entry = ttk.Entry(filter_frame, width=30, font=self.fonts['default'])
+        self.log_filter_entry.pack(side="left", padx=(0, 15))
+        self.log_filter_entry.bind("<Return>", lambda event: self.refresh_log_view())
+        
+        ttk.Button(filter_frame, text="Refresh", command=self.refresh_log_view).pack(side="left")
+        
+        log_columns = ("time", "level", "source", "message")
+        self.log_tree = ttk.Treeview(log_frame, columns=log_columns, show="headings", height=8)
+        self.log_tree.heading("time", text="Time", anchor="center")
+        self.log_tree.heading("level", text="Level", anchor="center")
+        self.log_tree.heading("source", text="Source", anchor="center")
+        self.log_tree.heading("message", text="Message", anchor="center")
+        self.log_tree.column("time", width=170, anchor="w")
+        self.log_tree.column("level", width=80, anchor="center")
+        self.log_tree.column("source", width=120, anchor="w")
+        self.log_tree.column("message", width=400, anchor="w")
+        self.log_tree.pack(fill="x", padx=10, pady=5)
+        self.log_tree.bind("<Double-1>", self.show_log_event)
+        self.log_events = {}
+        
+        ttk.Label(log_frame, text=f"Log files: {applog.get_log_dir()}",
+                 font=self.fonts['small']).pack(anchor="w", padx=10, pady=(5, 0))
+        
+        self.refresh_log_view()
+    
+    def refresh_log_view(self):
+        """Show the newest events matching the level and filter text"""
+        ring = applog.ring_buffer()
+        if ring is None:
+            return
+        events = ring.matching(applog.LEVELS[self.log_level_var.get()],
+                               self.log_filter_entry.get().strip(), limit=500)
+        
+        self.log_tree.delete(*self.log_tree.get_children())
+        self.log_events = {}
+        for event in events:
+            message = event['message']
+            if event['fields']:
+                message += "  " + " ".join(f"{key}={value}" for key, value in event['fields'].items())
+            item = self.log_tree.insert("", "end", values=(
+                event['time'].replace("T", " "), event['level'], event['logger'], message))
+            self.log_events[item] = event
+    
+    def show_log_event(self, event=None):
+        """Show the fields and traceback of the selected log event"""
+        selection = self.log_tree.selection()
+        if not selection or selection[0] not in self.log_events:
+            return
+        log_event = self.log_events[selection[0]]
+        
+        window = tk.Toplevel(self.root)
+        window.title(f"{log_event['level']} at {log_event['time'].replace('T', ' ')}")
+        window.geometry("700x400")
+        window.transient(self.root)
+        
+        lines = [f"{log_event['logger']} ({log_event['thread']})", log_event['message'], ""]
+        lines.extend(f"{key}: {value}" for key, value in log_event['fields'].items())
+        if log_event['exception']:
+            lines.extend(["", log_event['exception']])
+        
+        text = tk.Text(window, wrap="none", font=("Courier", 10))
+        scrollbar = ttk.Scrollbar(window, orient="vertical", command=text.yview)
+        text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        text.pack(fill="both", expand=True, padx=10, pady=10)
+        text.insert("1.0", "\n".join(lines))
+        text.configure(state="disabled")
+    
+    def toggle_lan_server(self):
+        """Start or stop serving this database to other counters"""
+        if self.server_thread:
+            self.server_thread.stop()
+            self.server_thread = None
+            self.server_button.configure(text="Start Server")
+            self.server_status_label.configure(text="Server is not running.")
+            return
+        
+        try:
+            port = int(self.server_port_entry.get())
+        except ValueError:
+            messagebox.showwarning("Validation Error", "Please enter a valid port number")
+            return
+        
+        host = self.server_host_entry.get().strip()
+        if not host:
+            messagebox.showwarning("Validation Error", "Please enter the address to listen on")
+            return
+        self.store.set_setting(HOST_SETTING, host)
+        
+        server_thread = ServerThread(database.get_db_path(), host, port)
+        server_thread.start()
+        server_thread.started.wait(10)
+        
+        if server_thread.error:
+            messagebox.showerror("Server Error", f"Could not start the LAN server: {server_thread.error}")
+            return
+        
+        self.server_thread = server_thread
+        self.server_button.configure(text="Stop Server")
+        self.server_status_label.configure(
+            text=f"Serving on {host}:{server_thread.server.port} ({platform.node()}). "
+                 f"Token: {server_thread.server.token}")
+    
+    def update_sync_status(self):
+        """Show the branch name and number of changes waiting to be exported"""
+        try:
+            branch_name, pending = self.store.branch_status()
+            self.sync_status_label.configure(
+                text=f"Branch: {branch_name}    Changes not yet exported: {pending}")
+        except sqlite3.Error as e:
+            self.sync_status_label.configure(text=f"Sync status unavailable: {e}")
+    
+    def export_branch_changes(self):
+        """Export changes since the last export to a change-set file"""
+        branch_name, _ = self.store.branch_status()
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".gz",
+            initialfile=default_changeset_name(branch_name),
+            filetypes=[("Change-set files", "*.json.gz"), ("All files", "*.*")],
+            title="Save Branch Changes As"
+        )
+        
+        if not file_path:
+            return  # User cancelled
+        
+        def on_done(count):
+            self.update_sync_status()
+            messagebox.showinfo("Export Complete",
+                               f"{count} changed records were exported to:\n{file_path}")
+        
+        def do_export(job):
+            # Queued saves belong in this change set
+            self.writes.flush()
+            # Own connection: the export runs its own transaction
+            conn = database.connect()
+            try:
+                return BranchSync(conn).export_changes(file_path, job=job)
+            finally:
+                conn.close()
+        
+        self.jobs.submit(
+            "Export branch changes",
+            do_export,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+        )
+    
+    def import_branch_changes(self):
+        """Apply change-set files exported by other branches"""
+        file_paths = filedialog.askopenfilenames(
+            filetypes=[("Change-set files", "*.json.gz"), ("All files", "*.*")],
+            title="Select Change-Set Files"
+        )
+        
+        if not file_paths:
+            return  # User cancelled
+        
+        def do_import(job):
+            # Queued saves go in first; the import then waits its turn for
+            # the write lock like any other writer
+            self.writes.flush()
+            # Own connection: each file is applied in its own transaction
+            conn = database.connect()
+            try:
+                sync = BranchSync(conn)
+                results = []
+                for path in sorted(file_paths):
+                    results.append((os.path.basename(path), sync.import_changes(path, job=job)))
+                return results
+            finally:
+                conn.close()
+        
+        def on_done(results):
+            lines = []
+            for name, summary in results:
+                if summary['already_applied']:
+                    lines.append(f"{name}: already applied")
+                else:
+                    lines.append(f"{name} ({summary['branch']}): {summary['inserted']} added, "
+                                 f"{summary['updated']} updated, {summary['deleted']} deleted, "
+                                 f"{summary['skipped']} unchanged")
+            self.refresh_customer_list()
+            self.update_sync_status()
+            messagebox.showinfo("Import Complete", "\n".join(lines))
+        
+        self.jobs.submit(
+            "Import branch changes",
+            do_import,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Import Error", f"An error occurred during import: {e}")
+        )
+    
+    def update_jobs_panel(self):
+        """Refresh the list of running and recent jobs"""
+        selected = self.jobs_tree.selection()
+        self.jobs_tree.delete(*self.jobs_tree.get_children())
+        
+        for job in self.jobs.jobs():
+            progress = f"{job.progress * 100:.0f}%"
+            if job.message and job.active:
+                progress = f"{progress} - {job.message}"
+            self.jobs_tree.insert("", "end", iid=str(job.id), values=(
+                job.name,
+                job.status.capitalize(),
+                progress,
+                f"{job.duration:.1f} s"
+            ))
+        
+        # Keep the selection across refreshes
+        for item in selected:
+            if self.jobs_tree.exists(item):
+                self.jobs_tree.selection_add(item)
+        
+        self.root.after(1000, self.update_jobs_panel)
+    
+    def cancel_selected_job(self):
+        """Cancel the job selected in the jobs panel"""
+        for item in self.jobs_tree.selection():
+            job = self.jobs.get(int(item))
+            if job and job.active:
+                job.cancel()
+    
+    def update_stall_summary(self):
+        """Show stall counts and worst-case latency in the Tools tab"""
+        summary = self.watchdog.summary()
+        
+        if summary['count']:
+            self.stall_summary_label.configure(
+                text=f"Stalls: {summary['count']}    Worst: {summary['worst_ms']:.0f} ms")
+            
+            # Most frequent handlers first
+            handlers = sorted(summary['by_handler'].items(), key=lambda item: item[1], reverse=True)
+            handler_text = ", ".join(f"{name} ({count})" for name, count in handlers[:5])
+            last_time = summary['last_time'].strftime("%H:%M:%S")
+            self.stall_detail_label.configure(
+                text=f"Last stall at {last_time} in {summary['last_handler']}. By handler: {handler_text}")
+        
+        self.root.after(2000, self.update_stall_summary)
     
     def manual_backup(self):
         """Manually create a database backup"""
-        try:
-            success, result = self.backup_database()
-            
+        def on_done(outcome):
+            success, result = outcome
             if success:
                 messagebox.showinfo("Backup Complete", 
                                    f"Database backup created successfully at:\n{result}")
             else:
                 messagebox.showerror("Backup Failed", 
                                     f"Failed to create backup: {result}")
-        except Exception as e:
-            messagebox.showerror("Backup Error", f"An error occurred: {e}")
+        
+        self.jobs.submit(
+            "Manual backup",
+            lambda job: self.backup_database(),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Backup Error", f"An error occurred: {e}")
+        )
     
     def optimize_database(self):
         """Run database optimization tasks"""
-        try:
+        if not self.store:
+            messagebox.showerror("Optimization Failed",
+                                "No database connection available.")
+            return
+        
+        def do_optimize(job):
             # Perform VACUUM operation
-            if self.conn:
-                self.conn.execute("VACUUM")
-                self.conn.commit()
-                
-                # Check integrity
-                integrity_check = self.conn.execute("PRAGMA integrity_check").fetchone()
-                if integrity_check[0] == "ok":
-                    messagebox.showinfo("Optimization Complete", 
-                                       "Database has been optimized successfully.")
-                else:
-                    messagebox.showwarning("Optimization Warning", 
-                                         f"Database optimization completed but integrity check found issues: {integrity_check}")
+            job.report(0.0, "Running VACUUM")
+            self.store.vacuum("Optimize")
+            job.check_cancelled()
+            
+            # Check integrity
+            job.report(0.5, "Checking integrity")
+            return self.store.integrity_check()
+        
+        def on_done(integrity_check):
+            if integrity_check == "ok":
+                messagebox.showinfo("Optimization Complete",
+                                   "Database has been optimized successfully.")
             else:
-                messagebox.showerror("Optimization Failed", 
-                                    "No database connection available.")
-        except Exception as e:
-            messagebox.showerror("Optimization Error", f"An error occurred: {e}")
+                messagebox.showwarning("Optimization Warning",
+                                     f"Database optimization completed but integrity check found issues: {integrity_check}")
+        
+        self.jobs.submit(
+            "Optimize database",
+            do_optimize,
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Optimization Error", f"An error occurred: {e}")
+        )
     
-    def export_to_excel(self):
-        """Export customer data to Excel file"""
+    def update_export_watermark(self):
+        """Show where the next changes export starts"""
+        watermark = self.store.export_watermark()
+        self.export_watermark_label.configure(
+            text=f"Changes exported up to: {watermark}" if watermark else "No changes export yet.")
+    
+    def export_data(self):
+        """Export customer data in the selected format"""
         try:
             # Determine what to export based on selection
             export_type = self.export_type.get()
+            export_format = self.export_format.get()
             search_term = ""
             
             if export_type == "search":
@@ -1669,10 +3147,11 @@ class ShivamOpticals:
                 search_term = self.search_entry.get().strip()
             
             # Ask user for save location
+            extension = f".{export_format}"
             file_path = filedialog.asksaveasfilename(
-                defaultextension=".xlsx",
-                filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")],
-                title="Save Excel Export As"
+                defaultextension=extension,
+                filetypes=[(exporters.EXPORT_FORMATS[export_format], f"*{extension}"), ("All files", "*.*")],
+                title="Save Export As"
             )
             
             if not file_path:
@@ -1681,88 +3160,61 @@ class ShivamOpticals:
             # Show progress dialog
             progress_window = tk.Toplevel(self.root)
             progress_window.title("Exporting Data")
-            progress_window.geometry("300x100")
+            progress_window.geometry("320x150")
             progress_window.transient(self.root)
             progress_window.grab_set()
             
-            progress_label = ttk.Label(progress_window, text="Exporting data to Excel...", padding=10)
+            progress_label = ttk.Label(progress_window, text="Exporting data...", padding=10)
             progress_label.pack()
             
-            progress_bar = ttk.Progressbar(progress_window, mode="indeterminate")
+            progress_bar = ttk.Progressbar(progress_window, mode="determinate", maximum=100)
             progress_bar.pack(fill="x", padx=20, pady=10)
-            progress_bar.start()
             
-            # Function to perform the export
-            def do_export():
-                try:
-                    # Fetch customer data
-                    if export_type == "all" or not search_term:
-                        query = '''
-                            SELECT c.id, c.name, c.phone, c.date, c.created_at
-                            FROM customers c
-                            ORDER BY c.date DESC
-                        '''
-                        customers = pd.read_sql_query(query, self.conn)
-                    else:
-                        # Export search results
-                        query = '''
-                            SELECT c.id, c.name, c.phone, c.date, c.created_at
-                            FROM customers c
-                            WHERE c.name LIKE ? OR c.phone LIKE ? OR c.id IN (
-                                SELECT customer_id FROM products WHERE frame_name LIKE ?
-                            )
-                            ORDER BY c.date DESC
-                        '''
-                        like_term = f"%{search_term}%"
-                        customers = pd.read_sql_query(query, self.conn, params=(like_term, like_term, like_term))
-                    
-                    # Fetch prescription data
-                    query = '''
-                        SELECT customer_id, right_sph, right_cyl, right_axe, right_add,
-                               left_sph, left_cyl, left_axe, left_add
-                        FROM prescriptions
-                    '''
-                    prescriptions = pd.read_sql_query(query, self.conn)
-                    
-                    # Fetch product data
-                    query = '''
-                        SELECT customer_id, frame_name, lens_name, frame_cost, lens_cost, total_cost
-                        FROM products
-                    '''
-                    products = pd.read_sql_query(query, self.conn)
-                    
-                    # Create Excel writer
-                    with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                        # Write customers sheet
-                        customers.to_excel(writer, sheet_name='Customers', index=False)
-                        
-                        # Write prescriptions sheet
-                        prescriptions.to_excel(writer, sheet_name='Prescriptions', index=False)
-                        
-                        # Write products sheet
-                        products.to_excel(writer, sheet_name='Products', index=False)
-                        
-                        # Create a summary sheet
-                        summary_data = {
-                            'Category': ['Total Customers', 'Total Revenue'],
-                            'Count': [len(customers), products['total_cost'].sum()]
-                        }
-                        summary_df = pd.DataFrame(summary_data)
-                        summary_df.to_excel(writer, sheet_name='Summary', index=False)
-                    
-                    # Close progress window and show success
-                    progress_window.destroy()
-                    messagebox.showinfo("Export Complete", 
-                                       f"Data has been exported to:\n{file_path}")
-                
-                except Exception as e:
-                    progress_window.destroy()
-                    messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+            # Function to perform the export (runs on a worker thread)
+            def do_export(job):
+                with self.latency.timed("export"):
+                    return export_files(job)
+            
+            def export_files(job):
+                # Read from one snapshot; the changes watermark only moves
+                # once the files are written
+                return self.store.export(
+                    file_path, export_format, search_term, export_type == "changed", job=job)
+            
+            # Callbacks below run on the Tk thread
+            def on_progress(job):
+                progress_bar['value'] = job.progress * 100
+                progress_label.configure(text=job.message or "Exporting data...")
+            
+            def on_done(result):
+                files, counts, rate = result
+                progress_window.destroy()
+                self.update_export_watermark()
+                summary = ", ".join(f"{count} {table}" for table, count in counts.items())
+                messagebox.showinfo("Export Complete",
+                                   f"Exported {summary} ({rate:,.0f} rows/s) to:\n" + "\n".join(files))
+            
+            def on_error(e):
+                progress_window.destroy()
+                messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+            
+            def on_cancel(_):
+                progress_window.destroy()
+                messagebox.showinfo("Export Cancelled", "The export was cancelled.")
+            
+            # Run export on the job executor
+            job = self.jobs.submit(
+                "Export data",
+                do_export,
+                on_done=on_done,
+                on_error=on_error,
+                on_cancel=on_cancel,
+                on_progress=on_progress
+            )
             
-            # Run export in a separate thread
-            export_thread = threading.Thread(target=do_export)
-            export_thread.daemon = True
-            export_thread.start()
+            cancel_button = ttk.Button(progress_window, text="Cancel", command=job.cancel)
+            cancel_button.pack(pady=5)
+            progress_window.protocol("WM_DELETE_WINDOW", job.cancel)
             
         except Exception as e:
             messagebox.showerror("Export Error", f"An error occurred: {e}")
@@ -1792,6 +3244,11 @@ def main():
         except Exception as e:
             print(f"Failed to set DPI awareness: {e}")
     
+    # Start the application log before anything else can fail
+    applog.setup_logging()
+    log.info("Application started", extra={"fields": {
+        "python": platform.python_version(), "platform": platform.platform()}})
+    
     # Create a dummy icon if it doesn't exist
     if not os.path.exists("icon.png"):
         try:
@@ -1811,13 +3268,29 @@ def main():
             
             # Save the icon
             img.save("icon.png")
-            print("Created default icon.png")
+            log.info("Created default icon.png")
         except Exception as e:
-            print(f"Could not create icon: {e}")
+            log.warning("Could not create icon: %s", e)
+    
+    # Run as a thin client against a LAN server when one is given
+    server_url = os.environ.get("SHIVAM_SERVER_URL")
+    server_token = os.environ.get("SHIVAM_SERVER_TOKEN")
+    if "--server" in sys.argv[1:]:
+        index = sys.argv.index("--server")
+        if index + 1 < len(sys.argv):
+            server_url = sys.argv[index + 1]
+    if "--token" in sys.argv[1:]:
+        index = sys.argv.index("--token")
+        if index + 1 < len(sys.argv):
+            server_token = sys.argv[index + 1]
     
     root = tk.Tk()
-    app = ShivamOpticals(root)
+    # Errors in Tk callbacks go to the log instead of a hidden console
+    root.report_callback_exception = lambda exc_type, exc_value, exc_traceback: log.error(
+        "Error in UI callback", exc_info=(exc_type, exc_value, exc_traceback))
+    app = ShivamOpticals(root, server_url=server_url, server_token=server_token)
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Process pools in the packaged executable
     main() 
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+Money amounts for Shivam Opticals.
+
+Costs are stored as whole paise (``products.frame_paise`` / ``lens_paise``,
+with ``total_paise`` generated from them), so totals and revenue sums are
+exact integer arithmetic in SQLite rather than float rupees. Text typed by
+staff or sent by a LAN client is converted with ``to_paise``; amounts are
+only turned back into rupees for display and for human-facing exports.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+
+def to_paise(value):
+    """Whole paise from a rupee amount given as text or a number
+    
+    Blank values are 0. Raises ValueError for anything that is not an
+    amount.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        value = value.replace(",", "").replace("₹", "").strip()
+        if value[:3].lower() == "rs.":
+            value = value[3:].strip()
+        if not value:
+            return 0
+    try:
+        # str() first: floats convert by their shortest repr, so 0.1 is 0.1
+        rupees = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value!r}")
+    if not rupees.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    return int((rupees * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_rupees(paise):
+    """Rupees as a Decimal (None stays None)"""
+    return None if paise is None else Decimal(paise) / 100
+
+
+def format_rupees(paise, grouped=False):
+    """Amount with two decimals, e.g. 150050 -> "1500.50" ("" for None)"""
+    if paise is None:
+        return ""
+    sign = "-" if paise < 0 else ""
+    rupees, rest = divmod(abs(int(paise)), 100)
+    whole = f"{rupees:,}" if grouped else str(rupees)
+    return f"{sign}{whole}.{rest:02d}"
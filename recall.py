@@ -0,0 +1,253 @@
+"""
+Eye test recall lists for Shivam Opticals.
+
+Customers are reminded to have their eyes tested again 12 and 24 months
+after their last test. The list for a month holds, for each interval, the
+customers whose last prescription falls in that month one interval earlier,
+so a customer who does not come back after the 12-month reminder is
+reminded again a year later.
+
+Visit dates are typed text, so prescriptions carry ``visit_day``, the ISO
+date SQLite generates from ``visit_date`` (see ``database.iso_date_sql``),
+indexed as ``idx_prescriptions_day (visit_day, customer_id)``. A list is one
+range scan of that index per interval; customers who have been tested since
+are dropped by looking up their later visits through
+``idx_prescriptions_latest``. With the archive included, a later visit counts
+in either database, under the same id or the same phone and name (found
+through ``idx_customer_identity``), so an archived customer who came back as
+a new record is not recalled. Visits whose date cannot be read are ignored.
+
+Lists are exported as CSV from a read snapshot, a batch of rows at a time.
+
+Run ``python recall.py --bench 500000`` to time a monthly list.
+"""
+import argparse
+import calendar
+import csv
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import database
+import exporters
+
+log = logging.getLogger(__name__)
+
+# Months after the last eye test at which customers are reminded
+RECALL_MONTHS = (12, 24)
+
+RECALL_COLUMNS = ["id", "name", "phone", "last_test", "months", "due"]
+
+
+def add_months(day, months):
+    """day moved by whole months, on the last day of the month if it is too short"""
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return day.replace(year=year, month=month + 1,
+                       day=min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def parse_month(month=None):
+    """First day of a "YYYY-MM" month (or of a date's month; default this month)
+    
+    Raises ValueError for text that is not a month.
+    """
+    if month is None:
+        return date.today().replace(day=1)
+    if isinstance(month, date):
+        return month.replace(day=1)
+    return date.fromisoformat(f"{month.strip()}-01")
+
+
+def recall_window(month, months):
+    """(first day, day after the last) of the tests due for recall in month
+    
+    Both are ISO dates; month is the first day of the recall month.
+    """
+    return add_months(month, -months).isoformat(), add_months(month, 1 - months).isoformat()
+
+
+def tested_later_sql(schemas):
+    """SQL condition true when customer c has a visit on or after ? in any schema
+    
+    Takes two parameters (the same day) per schema.
+    """
+    return " OR ".join(
+        f'''EXISTS (SELECT 1 FROM {schema}.prescriptions later
+                   WHERE later.customer_id = c.id AND later.visit_day >= ?)
+           OR EXISTS (SELECT 1 FROM {schema}.customers same
+                      JOIN {schema}.prescriptions later ON later.customer_id = same.id
+                      WHERE c.phone_key != '' AND same.phone_key = c.phone_key
+                        AND same.name_key = c.name_key AND later.visit_day >= ?)'''
+        for schema in schemas
+    )
+
+
+def recall_query(schemas=("main",), intervals=RECALL_MONTHS):
+    """SQL of a recall list; parameters come from recall_parameters()"""
+    sources = " UNION ALL ".join(
+        f'''SELECT c.id, c.name, c.phone, due.last_test, {int(months)} AS months
+            FROM (SELECT customer_id, MAX(visit_day) AS last_test
+                  FROM {schema}.prescriptions
+                  WHERE visit_day >= ? AND visit_day < ?
+                  GROUP BY customer_id) due
+            JOIN {schema}.customers c ON c.id = due.customer_id
+            WHERE NOT ({tested_later_sql(schemas)})'''
+        for schema in schemas for months in intervals
+    )
+    return f"SELECT * FROM ({sources}) ORDER BY months, last_test, name, id"
+
+
+def recall_parameters(month, schemas=("main",), intervals=RECALL_MONTHS):
+    """(start, end) then end twice per schema, for each schema and interval"""
+    parameters = []
+    for _ in schemas:
+        for months in intervals:
+            start, end = recall_window(month, months)
+            parameters += [start, end] + [end] * (2 * len(schemas))
+    return parameters
+
+
+def with_due_date(row):
+    """A recall row with the date the customer's test is due added"""
+    return row + (add_months(date.fromisoformat(row[3]), row[4]).isoformat(),)
+
+
+def recall_schemas(conn, include_archive):
+    """Schemas to read; attaches the archive (outside any transaction) if asked"""
+    if include_archive and database.attach_archive(conn):
+        return ["main", "archive"]
+    return ["main"]
+
+
+def recall_queue(cursor, month=None, intervals=RECALL_MONTHS, include_archive=False):
+    """Customers due for an eye test in month, as rows of RECALL_COLUMNS
+    
+    ``month`` is "YYYY-MM" (default this month). Rows come 12-month
+    recalls first, by date of the last test.
+    """
+    month = parse_month(month)
+    schemas = recall_schemas(cursor.connection, include_archive)
+    cursor.execute(recall_query(schemas, intervals), recall_parameters(month, schemas, intervals))
+    return [with_due_date(row) for row in cursor.fetchall()]
+
+
+def export_recall(path, month=None, intervals=RECALL_MONTHS, include_archive=True,
+                  db_path=None, job=None):
+    """Write a month's recall list to a CSV file; returns (customers, rows per second)
+    
+    The list is read from a snapshot on a read-only connection and written
+    a batch at a time.
+    """
+    month = parse_month(month)
+    progress = exporters.Progress(job)
+    conn = database.connect_readonly(db_path)
+    try:
+        schemas = recall_schemas(conn, include_archive)
+        with exporters.partial_files({None: path}) as partials:
+            with database.read_snapshot(conn, "Recall list"):
+                progress.start(f"Recall list for {month:%B %Y}", 0.0)
+                cursor = conn.execute(recall_query(schemas, intervals),
+                                      recall_parameters(month, schemas, intervals))
+                # utf-8-sig so Excel recognises the encoding when the file is opened
+                with open(partials[None], "w", newline="", encoding="utf-8-sig") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(RECALL_COLUMNS)
+                    for rows in exporters.batches(cursor):
+                        writer.writerows(with_due_date(row) for row in rows)
+                        progress.add(len(rows))
+    finally:
+        conn.close()
+    
+    rate = progress.rate()
+    log.info("Recall list written", extra={"fields": {
+        "month": f"{month:%Y-%m}", "customers": progress.rows,
+        "seconds": round(progress.seconds(), 3), "archive": len(schemas) > 1}})
+    return progress.rows, rate
+
+
+def benchmark(count=500000):
+    """Time a monthly recall list over count customers with up to three visits each"""
+    rng = random.Random(7)
+    today = date.today()
+    first_day = add_months(today, -60)
+    days = (today - first_day).days
+    
+    def typed(day):
+        # Most dates as the app enters them, some typed day first
+        form = rng.random()
+        if form < 0.85:
+            return day.isoformat()
+        if form < 0.95:
+            return f"{day.day}/{day.month}/{day.year}"
+        return f"{day.day:02d}.{day.month:02d}.{day.year % 100:02d}"
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        conn.execute("BEGIN")
+        conn.execute("INSERT INTO sync_guard (active) VALUES (1)")
+        conn.executemany("INSERT INTO customers (id, name, phone, date) VALUES (?, ?, ?, '')",
+                         ((i, f"Customer {i}", f"9{i:09d}") for i in range(1, count + 1)))
+        visits = []
+        for customer_id in range(1, count + 1):
+            for _ in range(rng.choice((1, 1, 2, 3))):
+                visits.append((customer_id, typed(first_day + timedelta(days=rng.randrange(days)))))
+        conn.executemany("INSERT INTO prescriptions (customer_id, visit_date) VALUES (?, ?)", visits)
+        conn.execute("DELETE FROM sync_guard")
+        conn.commit()
+        
+        # What opening an existing database costs the first time
+        conn.execute("DROP INDEX idx_prescriptions_day")
+        start = time.perf_counter()
+        conn.execute("CREATE INDEX idx_prescriptions_day ON prescriptions(visit_day, customer_id)")
+        conn.commit()
+        print(f"{count} customers, {len(visits)} visits; visit date index built in "
+              f"{time.perf_counter() - start:.1f}s")
+        
+        cursor = conn.cursor()
+        month = parse_month(today)
+        query = recall_query()
+        parameters = recall_parameters(month)
+        plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {query}", parameters)]
+        print(f"Plan: {'; '.join(plan)}")
+        
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            rows = recall_queue(cursor, month)
+            timings.append(time.perf_counter() - start)
+        print(f"Recall list for {month:%B %Y}: {len(rows)} customers "
+              f"({sum(row[4] == 12 for row in rows)} at 12 months), "
+              f"best {min(timings) * 1000:.0f} ms, worst {max(timings) * 1000:.0f} ms")
+        
+        # The same list from every visit, as without the index
+        start = time.perf_counter()
+        last_tests = {}
+        for customer_id, visit_day in cursor.execute(
+                "SELECT customer_id, visit_day FROM prescriptions NOT INDEXED"):
+            if visit_day and visit_day > last_tests.get(customer_id, ""):
+                last_tests[customer_id] = visit_day
+        windows = {months: recall_window(month, months) for months in RECALL_MONTHS}
+        expected = {(customer_id, months) for customer_id, last_test in last_tests.items()
+                    for months, (first, end) in windows.items() if first <= last_test < end}
+        print(f"Full scan of every visit: {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"same customers: {expected == {(row[0], row[4]) for row in rows}}")
+        conn.close()
+        
+        export_path = os.path.join(temp_dir, "recall.csv")
+        customers, rate = export_recall(export_path, month, db_path=path)
+        print(f"Exported {customers} customers at {rate:,.0f} rows/s "
+              f"({os.path.getsize(export_path) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eye test recall lists")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
@@ -0,0 +1,114 @@
+"""
+Revenue reports for Shivam Opticals.
+
+Sales are summed in SQLite over integer paise, so the figures are exact and
+no rows are loaded into Python. Every report is one aggregate query over a
+visit-date range that reads only the covering index ``idx_products_revenue
+(visit_date, frame_name, frame_paise, lens_paise)``; the table itself is
+never touched. The sum is written out as ``database.TOTAL_PAISE_SQL``
+rather than ``total_paise``: SQLite does not use an index containing a
+generated column as a covering index.
+
+Run ``python reports.py --bench 365`` to time a year of reports.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import database
+from money import format_rupees
+
+# Report name -> (heading of the first column, SQL grouping expression)
+REPORTS = {
+    "daily": ("Date", "visit_date"),
+    "monthly": ("Month", "substr(visit_date, 1, 7)"),
+    "frame": ("Frame", "COALESCE(frame_name, '')"),
+}
+
+
+def revenue_query(report, schemas=("main",)):
+    """SQL of a report; parameters are (start, end) once per schema"""
+    if report not in REPORTS:
+        raise ValueError(f"Unknown report: {report}")
+    group = REPORTS[report][1]
+    sources = " UNION ALL ".join(
+        f"SELECT visit_date, frame_name, {database.TOTAL_PAISE_SQL} AS total_paise FROM {schema}.products "
+        f"WHERE visit_date BETWEEN ? AND ?"
+        for schema in schemas
+    )
+    order = "revenue DESC, period" if report == "frame" else "period"
+    return f'''
+        SELECT {group} AS period, COUNT(*) AS sales, SUM(total_paise) AS revenue
+        FROM ({sources})
+        GROUP BY period
+        ORDER BY {order}
+    '''
+
+
+def revenue_report(cursor, report, start, end, include_archive=False):
+    """(period, sales, revenue in paise) rows for visits from start to end
+    
+    ``report`` is "daily", "monthly" or "frame". Dates are inclusive
+    YYYY-MM-DD strings. With ``include_archive`` sales of archived
+    customers are counted too.
+    """
+    schemas = ["main"]
+    if include_archive and database.attach_archive(cursor.connection):
+        schemas.append("archive")
+    cursor.execute(revenue_query(report, schemas), [start, end] * len(schemas))
+    return cursor.fetchall()
+
+
+def revenue_totals(rows):
+    """(sales, revenue in paise) over a report's rows"""
+    return sum(row[1] for row in rows), sum(row[2] for row in rows)
+
+
+def format_report(rows):
+    """Rows as display text"""
+    return [(period or "(none)", f"{sales:,}", format_rupees(revenue, grouped=True))
+            for period, sales, revenue in rows]
+
+
+def benchmark(days=365, sales_per_day=400):
+    """Time each report over days of sales"""
+    rng = random.Random(11)
+    frames = [f"Frame {i}" for i in range(300)]
+    first_day = date(2024, 1, 1)
+    last_day = first_day + timedelta(days=days - 1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        conn.executemany(
+            "INSERT INTO products (customer_id, visit_date, frame_name, frame_paise, lens_paise) "
+            "VALUES (NULL, ?, ?, ?, ?)",
+            (((first_day + timedelta(days=day)).isoformat(), rng.choice(frames),
+              rng.randrange(500, 20000) * 100, rng.randrange(0, 8000) * 100 + rng.randrange(100))
+             for day in range(days) for _ in range(sales_per_day)))
+        conn.commit()
+        print(f"{days * sales_per_day} sales over {days} days")
+        
+        cursor = conn.cursor()
+        for report in REPORTS:
+            query = revenue_query(report)
+            plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {query}", ["", ""])]
+            start = time.perf_counter()
+            rows = revenue_report(cursor, report, first_day.isoformat(), last_day.isoformat())
+            elapsed = time.perf_counter() - start
+            sales, revenue = revenue_totals(rows)
+            print(f"{report:8} {len(rows):4} rows  {elapsed * 1000:7.1f} ms  "
+                  f"{sales} sales, Rs. {format_rupees(revenue, grouped=True)}  [{'; '.join(plan)}]")
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Revenue reports")
+    parser.add_argument("--bench", type=int, metavar="DAYS", help="Benchmark with DAYS days of sales")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
@@ -0,0 +1,266 @@
+"""
+Compact in-memory storage for customer list rows.
+
+A list of ``fetchall()`` tuples costs a Python object per value (two ints
+and four str objects per customer, plus the tuple). ``CustomerColumns``
+keeps the same rows column by column instead:
+
+* ids and totals (paise) in ``array('q')``, dates as ordinal days in an
+  ``array('i')``
+* names and phones as UTF-8 bytes in one buffer with an offsets array
+* frame names dictionary-encoded: each distinct name is stored once and rows
+  keep its number
+
+Rows are read back through ``CustomerRow`` views created on demand.
+
+Run ``python rowstore.py --bench 100000`` to compare bytes per customer.
+"""
+import argparse
+import random
+import tracemalloc
+from array import array
+from datetime import date
+
+from money import format_rupees
+
+# Date stored for rows without a date
+NO_DATE = 0
+
+# Total stored for customers without a sale
+NO_TOTAL = -2 ** 63
+
+
+class StringColumn:
+    """Strings packed as UTF-8 in a single buffer"""
+    
+    __slots__ = ("_data", "_offsets")
+    
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array("q", [0])
+    
+    def append(self, value):
+        self._data += (value or "").encode("utf-8")
+        self._offsets.append(len(self._data))
+    
+    def __getitem__(self, index):
+        return self._data[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    def nbytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+class InternedColumn:
+    """Repetitive strings stored once each, rows keep a code"""
+    
+    __slots__ = ("_values", "_codes", "_lookup")
+    
+    def __init__(self):
+        self._values = [None]
+        self._lookup = {None: 0}
+        self._codes = array("I")
+    
+    def append(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self._values)
+            self._values.append(value)
+        self._codes.append(code)
+    
+    def __getitem__(self, index):
+        return self._values[self._codes[index]]
+    
+    def __len__(self):
+        return len(self._codes)
+    
+    def nbytes(self):
+        return self._codes.itemsize * len(self._codes)
+
+
+class CustomerRow:
+    """View of one row of a CustomerColumns store"""
+    
+    __slots__ = ("_store", "_index")
+    
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+    
+    @property
+    def id(self):
+        return self._store.ids[self._index]
+    
+    @property
+    def name(self):
+        return self._store.names[self._index]
+    
+    @property
+    def phone(self):
+        return self._store.phones[self._index]
+    
+    @property
+    def date(self):
+        return self._store.date_text(self._index)
+    
+    @property
+    def frame_name(self):
+        return self._store.frame_names[self._index]
+    
+    @property
+    def total_paise(self):
+        total = self._store.totals[self._index]
+        return None if total == NO_TOTAL else total
+    
+    def __iter__(self):
+        """Unpack like a database row (see database.LIST_COLUMNS)"""
+        return iter((self.id, self.name, self.phone, self.date, self.frame_name, self.total_paise))
+
+
+class CustomerColumns:
+    """Column-oriented store of customer list rows"""
+    
+    def __init__(self, rows=()):
+        self.ids = array("q")
+        self.names = StringColumn()
+        self.phones = StringColumn()
+        self.dates = array("i")
+        self.frame_names = InternedColumn()
+        self.totals = array("q")
+        self._odd_dates = {}  # Row index -> date text that is not ISO formatted
+        self.extend(rows)
+    
+    def append(self, row):
+        """Add one (id, name, phone, date, frame_name, total_paise) row"""
+        customer_id, name, phone, date_text, frame_name, total = row
+        index = len(self.ids)
+        self.ids.append(customer_id)
+        self.names.append(name)
+        self.phones.append(phone)
+        
+        ordinal = NO_DATE
+        if date_text:
+            try:
+                ordinal = date.fromisoformat(date_text).toordinal()
+            except ValueError:
+                self._odd_dates[index] = date_text
+        self.dates.append(ordinal)
+        
+        self.frame_names.append(frame_name)
+        self.totals.append(NO_TOTAL if total is None else total)
+    
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+    
+    def date_text(self, index):
+        ordinal = self.dates[index]
+        if ordinal != NO_DATE:
+            return date.fromordinal(ordinal).isoformat()
+        return self._odd_dates.get(index, "")
+    
+    def index_of(self, customer_id):
+        """Position of a customer in the store, or None"""
+        try:
+            return self.ids.index(customer_id)
+        except ValueError:
+            return None
+    
+    def clear(self):
+        self.__init__()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return CustomerRow(self, index)
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield CustomerRow(self, index)
+    
+    def nbytes(self):
+        """Approximate memory held by the columns"""
+        return (self.ids.itemsize * len(self.ids) + self.names.nbytes() + self.phones.nbytes()
+                + self.dates.itemsize * len(self.dates) + self.frame_names.nbytes()
+                + self.totals.itemsize * len(self.totals))
+
+
+def sample_rows(count, seed=1):
+    """Rows shaped like database.query_customer_list() output"""
+    rng = random.Random(seed)
+    frames = ["Ray-Ban Aviator", "Titan Eye+", "Fastrack Square", "Lenskart Air", None]
+    start = date(2015, 1, 1).toordinal()
+    rows = []
+    for customer_id in range(1, count + 1):
+        rows.append((
+            customer_id,
+            f"Customer {rng.randrange(10 ** 6)} Kumar",
+            f"9{rng.randrange(10 ** 9):09d}",
+            date.fromordinal(start + rng.randrange(3650)).isoformat(),
+            rng.choice(frames),
+            rng.randrange(500, 20000) * 100 if rng.random() > 0.05 else None,
+        ))
+    return rows
+
+
+def measure(build):
+    """Bytes allocated by build() and still held by its result"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return result, size
+
+
+def format_row(row):
+    """Display tuple as the customer list builds it"""
+    customer_id, name, phone, date_text, frame, total = row
+    return (customer_id, name or "", phone or "", date_text or "", frame or "",
+            format_rupees(total or 0))
+
+
+def benchmark(count=100000):
+    """Compare bytes per customer of row tuples and CustomerColumns"""
+    # Build the source rows from scratch inside each measurement so every
+    # value object is counted, as fetchall() would create them
+    def tuples():
+        rows = sample_rows(count)
+        return rows, [format_row(row) for row in rows]
+    
+    _, tuple_bytes = measure(tuples)
+    print(f"fetchall() rows + formatted tuples: {tuple_bytes / count:8.1f} bytes/customer")
+    
+    rows_only, plain_bytes = measure(lambda: sample_rows(count))
+    print(f"fetchall() rows only:               {plain_bytes / count:8.1f} bytes/customer")
+    
+    def columns():
+        store = CustomerColumns()
+        for row in sample_rows(count):
+            store.append(row)
+        return store
+    
+    store, column_bytes = measure(columns)
+    print(f"CustomerColumns:                    {column_bytes / count:8.1f} bytes/customer "
+          f"({plain_bytes / column_bytes:.1f}x smaller than rows)")
+    
+    # Round trip check
+    assert [tuple(row) for row in store] == rows_only
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact customer row storage")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    else:
+        parser.print_help()
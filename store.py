@@ -0,0 +1,421 @@
+"""
+Database engine for Shivam Opticals.
+
+``Store`` is everything the app does with its own database, without any
+widgets: saves, the customer list and searches, customer records, exports,
+recall lists, backups and maintenance. It owns
+
+* the shop's connection for quick reads on the calling thread, behind a
+  lock because background jobs use it too,
+* the group-commit write queue (``write_queue.py``) that all saves go
+  through,
+* the WAL checkpoint manager (``checkpoints.py``).
+
+Rows come back as named tuples (``CustomerRow``, ``Suggestion``, ``Match``,
+``RecallRow``),
+so callers can use ``row.total_paise`` or unpack them as before. The module
+imports neither tkinter, PIL nor pandas (only an Excel export loads pandas),
+so it can be used from scripts, benchmarks and servers::
+    
+    with Store() as store:
+        rows = store.page("sharma")
+
+Run ``python store.py --search sharma`` to search from the command line, or
+``python store.py --bench 20000`` to time the everyday operations.
+"""
+import argparse
+import collections
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import archive
+import backups
+import checkpoints
+import database
+import exporters
+import fuzzy
+import health
+import recall
+from branch_sync import BranchSync
+from money import format_rupees
+from write_queue import WriteQueue
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 200
+
+# Timestamped backups kept by backup()
+MAX_BACKUPS = 10
+BACKUP_PREFIX = "optical_shop_backup_"
+
+CustomerRow = collections.namedtuple("CustomerRow", database.LIST_COLUMNS)
+Suggestion = collections.namedtuple("Suggestion", ["id", "name", "phone", "date"])
+Match = collections.namedtuple("Match", ["customer_id", "kind"])
+RecallRow = collections.namedtuple("RecallRow", recall.RECALL_COLUMNS)
+Maintenance = collections.namedtuple("Maintenance", ["backup_path", "integrity"])
+
+
+class Store:
+    """The local shop database and the operations on it"""
+    
+    def __init__(self, db_path=None, latency=None, durability=None):
+        self.db_path = db_path or database.get_db_path()
+        self.latency = latency  # health.LatencyStats for checkpoint timings, optional
+        self._lock = threading.RLock()  # Guards self.conn and self.cursor
+        
+        self.conn = database.open_database(self.db_path)
+        self.cursor = self.conn.cursor()
+        
+        # WAL settings before the writer connection is opened
+        checkpoints.load_wal_settings(self.conn)
+        
+        # Saves go through the group-commit write queue; the checkpoint
+        # manager checkpoints the WAL instead of the queue
+        durability = durability or database.get_setting(self.conn, "write_durability", "normal")
+        self.writes = WriteQueue(self.db_path, durability=durability, checkpoint_interval=None)
+        self.checkpointer = checkpoints.CheckpointManager(self.db_path, latency=latency)
+        
+        # Index names saved since the last run (every name on first use)
+        # for typo-tolerant search
+        fuzzy.index_pending(self.writes)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    # Saves
+    
+    def save_customer(self, name, phone, visit_date, prescription, product, durable=True):
+        """Queue a visit; the future's result is the customer id once committed
+        
+        Costs in ``product`` must already be whole paise (money.to_paise).
+        """
+        return self.writes.save_customer(name, phone, visit_date, prescription, product,
+                                         durable=durable)
+    
+    def submit(self, func, *args, durable=False):
+        """Queue func(cursor, *args) on the writer; returns a Future"""
+        return self.writes.submit(func, *args, durable=durable)
+    
+    def flush(self):
+        """Wait until every queued save has been committed"""
+        self.writes.flush()
+    
+    # Reads
+    
+    def page(self, search_term="", limit=PAGE_SIZE, after=None, sort="date", descending=True,
+             include_archive=False):
+        """One page of the customer list as CustomerRows (see database.query_customer_list)"""
+        with self._lock:
+            rows = database.query_customer_list(
+                self.cursor, search_term, limit, after, sort, descending, include_archive)
+        return [CustomerRow._make(row) for row in rows]
+    
+    def count(self, search_term="", include_archive=False):
+        """Number of customers in the whole list (see database.count_customers)"""
+        with self._lock:
+            return database.count_customers(self.cursor, search_term, include_archive)
+    
+    def similar(self, search_term, limit=None):
+        """CustomerRows for names within two edits of search_term; returns (rows, complete)"""
+        with self._lock:
+            rows, complete = database.query_fuzzy_customers(self.cursor, search_term, limit)
+        fuzzy.index_pending(self.writes)
+        return [CustomerRow._make(row) for row in rows], complete
+    
+    def find_match(self, search_term):
+        """Match for an exact, single partial or similar match (see database.find_customer_match)"""
+        with self._lock:
+            return Match._make(database.find_customer_match(self.cursor, search_term))
+    
+    def suggest(self, text, limit=8):
+        """Suggestions for customers whose name or phone starts with text"""
+        with self._lock:
+            rows = database.suggest_customers(self.cursor, text, limit)
+        return [Suggestion._make(row) for row in rows]
+    
+    def detail(self, customer_id):
+        """Full record of one customer as a dictionary, or None"""
+        with self._lock:
+            return database.query_customer_detail(self.cursor, customer_id)
+    
+    def get_setting(self, key, default=None):
+        with self._lock:
+            return database.get_setting(self.conn, key, default)
+    
+    def set_setting(self, key, value):
+        with self._lock:
+            database.set_setting(self.conn, key, value)
+    
+    # Exports
+    
+    def export(self, path, fmt="xlsx", search_term="", incremental=False, job=None):
+        """Export customers (or those changed since the last changes export); returns (files, counts, rows per second)
+        
+        Every table is read from one snapshot on a read-only connection, so
+        saves neither wait for the export nor show up in only some of the
+        tables. The changes watermark only moves once the files are written.
+        """
+        if incremental:
+            # Include saves still waiting in the write queue
+            self.writes.flush()
+        files, counts, watermark, rate = exporters.export(
+            path, fmt, search_term, incremental, db_path=self.db_path, job=job)
+        if incremental and watermark:
+            self.writes.submit(exporters.save_watermark, watermark, durable=True).result()
+        return files, counts, rate
+    
+    def export_watermark(self):
+        """Time up to which changes have been exported, or None"""
+        with self._lock:
+            return exporters.get_watermark(self.conn)
+    
+    # Archive and branch sync
+    
+    def archive_counts(self):
+        """(live customers, archived customers)"""
+        with self._lock:
+            return archive.archive_counts(self.conn)
+    
+    def branch_status(self):
+        """(branch name, changes not yet exported to other branches)"""
+        with self._lock:
+            sync = BranchSync(self.conn)
+            return sync.branch_name, sync.pending_changes()
+    
+    # Recall lists
+    
+    def recall_list(self, month=None, include_archive=False):
+        """RecallRows of the customers due for an eye test in month (see recall.recall_queue)"""
+        with self._lock:
+            rows = recall.recall_queue(self.cursor, month, include_archive=include_archive)
+        return [RecallRow._make(row) for row in rows]
+    
+    def export_recall(self, path, month=None, include_archive=True, job=None):
+        """Write a month's recall list to a CSV file; returns (customers, rows per second)"""
+        # Include saves still waiting in the write queue
+        self.writes.flush()
+        return recall.export_recall(path, month, include_archive=include_archive,
+                                    db_path=self.db_path, job=job)
+    
+    # Backups and maintenance
+    
+    def backup(self, backup_dir=None, keep=MAX_BACKUPS):
+        """Copy the database to a timestamped file in backup_dir; returns its path
+        
+        Queued saves are committed first. The copy is made with the online
+        backup API from one read snapshot (WAL included), so saves that
+        arrive meanwhile can't tear it, and it is a single self-contained
+        file. Only the newest ``keep`` backups are kept.
+        """
+        backup_dir = backup_dir or os.path.join(os.path.dirname(self.db_path), "backups")
+        os.makedirs(backup_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{timestamp}.db")
+        
+        self.writes.flush()
+        started = datetime.now()
+        copy_start = time.perf_counter()
+        source = database.connect_readonly(self.db_path)
+        target = sqlite3.connect(backup_path)
+        try:
+            # One step: a stepped copy restarts whenever the writer commits
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        seconds = time.perf_counter() - copy_start
+        with self._lock:
+            health.record_backup(self.conn, started, seconds)
+        
+        self._clean_old_backups(backup_dir, keep)
+        return backup_path
+    
+    def restore(self, backup_path, backup_dir=None, job=None):
+        """Replace the database with a backup, keeping a pre-restore copy
+        
+        Queued saves are committed first so they are in the copy; the writer
+        and the checkpoint thread then wait until the restore is done.
+        """
+        backup_dir = backup_dir or os.path.join(os.path.dirname(self.db_path), "backups")
+        self.writes.flush()
+        with self.writes.paused(), self.checkpointer.paused():
+            if job:
+                job.report(0.0, "Saving current data")
+            backups.save_pre_restore_copy(self.db_path, backup_dir)
+            backups.restore_backup(backup_path, self.db_path, job=job)
+    
+    def _clean_old_backups(self, backup_dir, keep):
+        try:
+            # The timestamp in the name sorts by age
+            backup_files = sorted((name for name in os.listdir(backup_dir)
+                                   if name.startswith(BACKUP_PREFIX) and name.endswith(".db")),
+                                  reverse=True)
+            for old_file in backup_files[keep:]:
+                os.remove(os.path.join(backup_dir, old_file))
+        except OSError:
+            log.exception("Error cleaning old backups")
+    
+    def vacuum(self, reason="Optimize"):
+        """Rebuild the database file and empty the WAL it went through"""
+        with self._lock:
+            self.conn.execute("VACUUM")
+            self.conn.commit()
+        self.checkpointer.checkpoint("TRUNCATE", reason)
+    
+    def integrity_check(self):
+        """Result of PRAGMA integrity_check, "ok" when the database is sound"""
+        with self._lock, database.track_read("Integrity check"):
+            return self.conn.execute("PRAGMA main.integrity_check").fetchone()[0]
+    
+    def maintain(self, job=None):
+        """Back up, VACUUM and check integrity; returns a Maintenance
+        
+        A failed backup is logged and the other steps still run
+        (``backup_path`` is then None).
+        """
+        if job:
+            job.report(0.0, "Creating backup")
+        try:
+            backup_path = self.backup()
+        except Exception:
+            log.exception("Backup error")
+            backup_path = None
+        
+        if job:
+            job.check_cancelled()
+            job.report(0.3, "Optimizing database")
+        self.vacuum("Maintenance")
+        
+        if job:
+            job.check_cancelled()
+            job.report(0.7, "Checking integrity")
+        integrity = self.integrity_check()
+        if integrity != "ok":
+            log.error("Database integrity issue: %s", integrity)
+        return Maintenance(backup_path, integrity)
+    
+    def set_durability(self, durability):
+        """Switch the write queue between "full" and "normal" and remember the choice"""
+        self.writes.set_durability(durability)
+        self.set_setting("write_durability", durability)
+    
+    def change_wal_settings(self, autocheckpoint, size_limit):
+        """Store new WAL settings and apply them to every open connection
+        
+        Raises ValueError for negative values (see checkpoints.save_wal_settings).
+        """
+        with self._lock:
+            settings = checkpoints.save_wal_settings(self.conn, autocheckpoint, size_limit)
+        # The writer and checkpoint connections were opened with the old values
+        self.writes.submit(checkpoints.apply_wal_settings)
+        self.checkpointer.apply_settings()
+        return settings
+    
+    def close(self):
+        """Commit queued saves, stop the background threads and close the connection"""
+        self.writes.close()
+        self.checkpointer.close()
+        with self._lock:
+            self.conn.close()
+
+
+def print_rows(rows):
+    for row in rows:
+        print(f"{row.id:>7}  {row.name or '':30.30}  {row.phone or '':14.14}  {row.date or '':10}  "
+              f"{row.frame_name or '':20.20}  {format_rupees(row.total_paise or 0):>12}")
+
+
+def benchmark(count=20000, repeats=50):
+    """Time saves, list pages, searches and records through a Store"""
+    sample = ({"right_sph": "-1.00"}, {"frame_name": "Frame", "lens_name": "Lens",
+                                        "frame_paise": 150000, "lens_paise": 80000})
+    
+    def timed(label, func, times=repeats):
+        start = time.perf_counter()
+        for i in range(times):
+            func(i)
+        print(f"{label:28} {(time.perf_counter() - start) / times * 1000:8.2f} ms")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with Store(os.path.join(temp_dir, "bench.db")) as store:
+            start = time.perf_counter()
+            futures = [store.save_customer(f"Customer {i}", f"9{i:09d}", "2024-01-01", *sample,
+                                           durable=False) for i in range(count)]
+            futures[-1].result()
+            print(f"{count} saves through the write queue: "
+                  f"{count / (time.perf_counter() - start):.0f}/s")
+            store.flush()
+            
+            timed("First list page", lambda i: store.page())
+            timed("List page by name", lambda i: store.page(sort="name", after=("Customer 5", 0)))
+            timed("Search (LIKE)", lambda i: store.page(f"Customer {i * 37 % count}"))
+            timed("Match shortcut", lambda i: store.find_match(f"Customer {i * 37 % count}"))
+            timed("Typo search (names alike)", lambda i: store.similar(f"Custmoer {i * 37 % count}"))
+            timed("Suggestions", lambda i: store.suggest(f"Customer {i}"))
+            timed("Customer record", lambda i: store.detail(i * 37 % count + 1))
+            timed("Save (durable)", lambda i: store.save_customer(
+                f"Walk-in {i}", f"8{i:09d}", "2024-01-02", *sample).result(), times=20)
+            timed("Backup", lambda i: store.backup(), times=3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shivam Opticals database engine")
+    parser.add_argument("--db", default=None, help="Database file (default: data/optical_shop.db)")
+    actions = parser.add_mutually_exclusive_group()
+    actions.add_argument("--search", metavar="TERM", help="List customers matching TERM")
+    actions.add_argument("--detail", type=int, metavar="ID", help="Show one customer's record")
+    actions.add_argument("--export", metavar="PATH", help="Export customers to PATH")
+    actions.add_argument("--recall", metavar="YYYY-MM", help="List customers due for an eye test that month")
+    actions.add_argument("--backup", action="store_true", help="Back up the database")
+    actions.add_argument("--maintain", action="store_true", help="Back up, VACUUM and check integrity")
+    actions.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark with COUNT customers")
+    parser.add_argument("--format", default="csv", choices=sorted(exporters.EXPORT_FORMATS),
+                        help="Export format")
+    args = parser.parse_args()
+    
+    if args.bench:
+        benchmark(args.bench)
+        return
+    if args.search is None and args.detail is None and not (args.export or args.recall or args.backup
+                                                            or args.maintain):
+        parser.print_help()
+        return
+    
+    with Store(args.db) as store:
+        if args.search is not None:
+            rows = store.page(args.search, limit=None)
+            if not rows and args.search:
+                rows, _ = store.similar(args.search)
+                print("No exact matches; similar names:")
+            print_rows(rows)
+        elif args.detail is not None:
+            customer = store.detail(args.detail)
+            if customer is None:
+                print("Customer not found")
+            for field, value in (customer or {}).items():
+                if field != "visits":
+                    print(f"{field:16} {value}")
+        elif args.export:
+            files, counts, rate = store.export(args.export, args.format)
+            print(", ".join(f"{count} {table}" for table, count in counts.items()), f"({rate:,.0f} rows/s)",
+                  "->", ", ".join(files))
+        elif args.recall:
+            for row in store.recall_list(args.recall, include_archive=True):
+                print(f"{row.id:>7}  {row.name or '':30.30}  {row.phone or '':14.14}  "
+                      f"last test {row.last_test}, due {row.due} ({row.months} months)")
+        elif args.backup:
+            print(store.backup())
+        else:
+            print(store.maintain())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import archive
+import database
+from write_queue import WriteQueue
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+def archive_everyone(db_path):
+    conn = database.connect(db_path)
+    try:
+        return archive.archive_customers_before(conn, "2100-01-01")
+    finally:
+        conn.close()
+
+
+def test_returning_archived_customer_keeps_one_record(tmp_path):
+    db_path = str(tmp_path / "shop.db")
+    conn = database.open_database(db_path)
+    customer_id = database.insert_customer(conn.cursor(), "Old Timer", "9876543210", "2020-03-01",
+                                           PRESCRIPTION, PRODUCT)
+    conn.commit()
+    conn.close()
+    assert archive_everyone(db_path) == 1
+    
+    writes = WriteQueue(db_path)
+    try:
+        assert writes.save_customer("Old Timer", "98765 43210", "2026-10-01",
+                                    PRESCRIPTION, PRODUCT).result(5) == customer_id
+    finally:
+        writes.close()
+    
+    conn = database.connect(db_path)
+    try:
+        assert archive.archive_counts(conn) == (1, 0)
+        rows = database.query_customer_list(conn.cursor(), include_archive=True)
+        assert [row[0] for row in rows] == [customer_id]
+        detail = database.query_customer_detail(conn.cursor(), customer_id)
+        assert not detail["archived"]
+        assert [visit["visit_date"] for visit in detail["visits"]] == ["2026-10-01", "2020-03-01"]
+    finally:
+        conn.close()
+
+
+def test_archive_skips_unreadable_and_recent_dates(tmp_path):
+    db_path = str(tmp_path / "shop.db")
+    conn = database.open_database(db_path)
+    cursor = conn.cursor()
+    for name, visit_date in [("Recent Day First", "05/10/2026"), ("Old Day First", "05/10/2018"),
+                             ("Old", "2019-01-01"), ("Unreadable", "sometime")]:
+        database.insert_customer(cursor, name, "", visit_date, PRESCRIPTION, PRODUCT)
+    conn.commit()
+    
+    try:
+        assert archive.archive_customers_before(conn, "2024-01-01") == 2
+        names = sorted(row[0] for row in conn.execute("SELECT name FROM main.customers"))
+        assert names == ["Recent Day First", "Unreadable"]
+    finally:
+        conn.close()
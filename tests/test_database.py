@@ -0,0 +1,61 @@
+import database
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+
+
+def product(frame):
+    return {"frame_name": frame, "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+def test_latest_visit_is_chosen_by_date_not_text(tmp_path):
+    conn = database.open_database(str(tmp_path / "shop.db"))
+    cursor = conn.cursor()
+    # "05/01/2025" sorts before "2024-12-01" as text but is the later visit
+    customer_id = database.insert_customer(cursor, "Asha", "9876543210", "05/01/2025",
+                                           PRESCRIPTION, product("Newer"))
+    assert database.insert_customer(cursor, "Asha", "9876543210", "2024-12-01",
+                                    PRESCRIPTION, product("Older")) == customer_id
+    conn.commit()
+    
+    detail = database.query_customer_detail(cursor, customer_id)
+    assert detail["date"] == "05/01/2025"
+    assert detail["frame_name"] == "Newer"
+    assert [visit["visit_date"] for visit in detail["visits"]] == ["05/01/2025", "2024-12-01"]
+    
+    [row] = database.query_customer_list(cursor)
+    assert row[3] == "05/01/2025"
+    assert row[4] == "Newer"
+    conn.close()
+
+
+def test_merged_customer_takes_latest_visit_date(tmp_path):
+    conn = database.open_database(str(tmp_path / "shop.db"))
+    cursor = conn.cursor()
+    keeper = database.insert_customer(cursor, "Ravi", "9000000001", "2024-12-01", PRESCRIPTION, product("A"))
+    duplicate = database.insert_customer(cursor, "Ravi K", "9000000002", "05/01/2025", PRESCRIPTION, product("B"))
+    database.merge_customers(cursor, keeper, [duplicate])
+    conn.commit()
+    
+    assert database.query_customer_detail(cursor, keeper)["date"] == "05/01/2025"
+    conn.close()
+
+
+def test_list_page_can_start_at_a_customer(tmp_path):
+    conn = database.open_database(str(tmp_path / "shop.db"))
+    cursor = conn.cursor()
+    for i in range(60):
+        # Repeated names, dates and totals so ties are broken by id
+        database.insert_customer(cursor, f"Customer {i % 7}", f"98765{i:05d}", f"2024-01-{i % 5 + 1:02d}",
+                                 PRESCRIPTION, dict(product(f"Frame {i % 3}"), lens_paise=i % 4))
+    conn.commit()
+    
+    for sort in database.LIST_SORTS:
+        for descending in (True, False):
+            rows = database.query_customer_list(cursor, sort=sort, descending=descending)
+            target = rows[37]
+            detail = database.query_customer_detail(cursor, target[0])
+            row = tuple(detail[column] for column in database.LIST_COLUMNS)
+            after = database.list_cursor_at(row, sort, descending)
+            page = database.query_customer_list(cursor, limit=5, after=after, sort=sort, descending=descending)
+            assert page == rows[37:42], (sort, descending)
+    conn.close()
@@ -0,0 +1,33 @@
+import database
+from duplicates import DuplicateFinder
+
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+class RecordingJob:
+    """Job stub noting whether a transaction was open at each batch start"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.open_transactions = []
+    
+    def check_cancelled(self):
+        self.open_transactions.append(self.conn.in_transaction)
+    
+    def report(self, fraction, message):
+        pass
+
+
+def test_refresh_keys_commits_each_batch(tmp_path):
+    conn = database.open_database(str(tmp_path / "shop.db"))
+    cursor = conn.cursor()
+    for i in range(25):
+        database.insert_customer(cursor, f"Customer {i}", f"98765{i:05d}", "2024-01-01", {}, PRODUCT)
+    conn.commit()
+    
+    job = RecordingJob(conn)
+    assert DuplicateFinder(conn).refresh_keys(job=job, batch_size=10) == 25
+    assert job.open_transactions == [False, False, False]
+    # Everything was keyed
+    assert DuplicateFinder(conn).refresh_keys() == 0
+    conn.close()
@@ -0,0 +1,152 @@
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import database
+import exporters
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80050}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "shop.db")
+    conn = database.open_database(path)
+    cursor = conn.cursor()
+    for i in range(5):
+        database.insert_customer(cursor, f"Customer {i}", f"98765{i:05d}", "2024-01-0" + str(i + 1),
+                                 PRESCRIPTION, PRODUCT)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def assert_no_partials(directory):
+    assert not [name for name in os.listdir(directory) if ".part" in name]
+
+
+def test_export_xlsx(db_path, tmp_path):
+    import pandas as pd
+    
+    path = str(tmp_path / "export.xlsx")
+    files, counts, _, _ = exporters.export(path, "xlsx", db_path=db_path)
+    
+    assert files == [path]
+    assert counts == {"customers": 5, "prescriptions": 5, "products": 5}
+    sheets = pd.read_excel(path, sheet_name=None)
+    assert set(sheets) == {"Customers", "Prescriptions", "Products", "Summary"}
+    assert len(sheets["Customers"]) == 5
+    # Costs are shown in rupees
+    assert sheets["Products"]["lens_cost"].tolist() == [800.5] * 5
+    assert_no_partials(tmp_path)
+
+
+def test_export_csv(db_path, tmp_path):
+    path = str(tmp_path / "export.csv")
+    files, counts, _, _ = exporters.export(path, "csv", db_path=db_path)
+    
+    assert sorted(files) == sorted(exporters.csv_paths(path).values())
+    for table, file in exporters.csv_paths(path).items():
+        with open(file, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == exporters.EXPORT_COLUMNS[table]
+        assert len(rows) - 1 == counts[table] == 5
+    assert_no_partials(tmp_path)
+
+
+def test_export_jsonl(db_path, tmp_path):
+    path = str(tmp_path / "export.jsonl")
+    _, counts, _, _ = exporters.export(path, "jsonl", db_path=db_path)
+    
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == sum(counts.values()) == 15
+    products = [record for record in records if record["table"] == "products"]
+    assert products[0]["lens_paise"] == 80050
+    assert_no_partials(tmp_path)
+
+
+def test_export_jsonl_gz(db_path, tmp_path):
+    path = str(tmp_path / "export.jsonl.gz")
+    _, counts, _, _ = exporters.export(path, "jsonl.gz", db_path=db_path)
+    
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == counts["customers"] == 5
+    for record in records:
+        assert len(record["prescriptions"]) == len(record["products"]) == 1
+    assert_no_partials(tmp_path)
+
+
+def test_export_sqlite(db_path, tmp_path):
+    path = str(tmp_path / "export.sqlite")
+    _, counts, watermark, _ = exporters.export(path, "sqlite", db_path=db_path)
+    
+    conn = sqlite3.connect(path)
+    try:
+        for table in exporters.EXPORT_COLUMNS:
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == counts[table] == 5
+        info = dict(conn.execute("SELECT key, value FROM export_info"))
+        assert info["watermark"] == watermark
+    finally:
+        conn.close()
+    assert_no_partials(tmp_path)
+
+
+def test_failed_export_leaves_no_file(db_path, tmp_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setitem(exporters.STREAM_WRITERS, "jsonl", fail)
+    
+    with pytest.raises(RuntimeError):
+        exporters.export(str(tmp_path / "export.jsonl"), "jsonl", db_path=db_path)
+    assert not os.path.exists(tmp_path / "export.jsonl")
+    assert_no_partials(tmp_path)
+
+
+def test_export_is_consistent_while_saving(db_path, tmp_path):
+    import pandas as pd
+    from write_queue import WriteQueue
+    
+    writes = WriteQueue(db_path)
+    saving = threading.Event()
+    stop = threading.Event()
+    
+    def save_customers():
+        i = 0
+        while not stop.is_set():
+            futures = [writes.save_customer(f"New Customer {i}-{j}", f"91234{i:03d}{j:02d}", "2024-02-01",
+                                            PRESCRIPTION, PRODUCT) for j in range(20)]
+            for future in futures:
+                future.result()
+            saving.set()
+            i += 1
+    
+    saver = threading.Thread(target=save_customers)
+    saver.start()
+    try:
+        saving.wait(10)
+        for n in range(5):
+            path = str(tmp_path / f"export{n}.xlsx")
+            _, counts, _, _ = exporters.export(path, "xlsx", db_path=db_path)
+            sheets = pd.read_excel(path, sheet_name=None)
+            
+            customer_ids = set(sheets["Customers"]["id"])
+            for table in ("prescriptions", "products"):
+                sheet = sheets[exporters.SHEET_NAMES[table]]
+                assert set(sheet["customer_id"]) <= customer_ids
+                assert len(sheet) == counts[table]
+            assert len(customer_ids) == counts["customers"]
+            # Every save adds one customer with one prescription and one sale
+            assert counts["customers"] == counts["prescriptions"] == counts["products"]
+    finally:
+        stop.set()
+        saver.join()
+        writes.close()
+    assert counts["customers"] > 5  # The exports ran while saves were landing
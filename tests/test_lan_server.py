@@ -0,0 +1,84 @@
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+import database
+from lan_client import LanClient, LanClientError
+from lan_server import ServerThread, TOKEN_SETTING
+
+TOKEN = "test-token"
+
+
+@pytest.fixture
+def server(tmp_path):
+    db_path = str(tmp_path / "shop.db")
+    thread = ServerThread(db_path, "127.0.0.1", 0, token=TOKEN)
+    thread.start()
+    thread.started.wait(10)
+    assert thread.error is None
+    yield thread.server
+    thread.stop()
+    thread.join(10)
+
+
+def raw_request(server, method, path, headers=None, body=b""):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+    try:
+        conn.putrequest(method, path)
+        for name, value in (headers or {}).items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+
+
+def test_requests_need_the_token(server):
+    status, _ = raw_request(server, "GET", "/api/health")
+    assert status == 401
+    status, _ = raw_request(server, "GET", "/api/health", {"Authorization": "Bearer wrong"})
+    assert status == 401
+    assert LanClient(f"127.0.0.1:{server.port}", token=TOKEN).health() == {"status": "ok"}
+
+
+@pytest.mark.parametrize("length, status", [("abc", 400), ("-5", 400), (str(11 * 1024 * 1024), 413)])
+def test_bad_content_length(server, length, status):
+    headers = {"Authorization": f"Bearer {TOKEN}", "Content-Length": length}
+    assert raw_request(server, "POST", "/api/customers", headers)[0] == status
+
+
+def test_save_is_not_sent_twice(server, monkeypatch):
+    client = LanClient(f"127.0.0.1:{server.port}", token=TOKEN)
+    sends = []
+    
+    def lose_response(self):
+        sends.append(1)
+        raise http.client.RemoteDisconnected("connection dropped")
+    monkeypatch.setattr(http.client.HTTPConnection, "getresponse", lose_response)
+    
+    with pytest.raises(LanClientError):
+        client.save_customer("Asha", "9876543210", "2024-01-01", {}, {})
+    assert len(sends) == 1
+    
+    sends.clear()
+    with pytest.raises(LanClientError):
+        client.health()
+    assert len(sends) == 2  # GETs are retried once
+
+
+def test_token_is_generated_once(tmp_path):
+    from lan_server import load_server_settings
+    
+    db_path = str(tmp_path / "shop.db")
+    host, token = load_server_settings(db_path)
+    assert host == "127.0.0.1"
+    assert load_server_settings(db_path)[1] == token
+    conn = database.connect(db_path)
+    try:
+        assert database.get_setting(conn, TOKEN_SETTING) == token
+    finally:
+        conn.close()
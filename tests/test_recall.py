@@ -0,0 +1,29 @@
+import archive
+import database
+import recall
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+def test_later_visit_in_other_database_is_not_recalled(tmp_path):
+    db_path = str(tmp_path / "shop.db")
+    conn = database.open_database(db_path)
+    cursor = conn.cursor()
+    for name, phone in [("Came Back", "9876543210"), ("Stayed Away", "9123456780")]:
+        database.insert_customer(cursor, name, phone, "2025-10-05", PRESCRIPTION, PRODUCT)
+    conn.commit()
+    assert archive.archive_customers_before(conn, "2026-01-01") == 2
+    conn.close()
+    
+    # Saved as a new live record while the archive was not attached
+    conn = database.connect(db_path)
+    database.insert_customer(conn.cursor(), "came back", "98765 43210", "2026-06-01",
+                             PRESCRIPTION, PRODUCT)
+    conn.commit()
+    try:
+        assert archive.archive_counts(conn) == (1, 2)
+        rows = recall.recall_queue(conn.cursor(), "2026-10", include_archive=True)
+        assert [(row[1], row[3], row[4]) for row in rows] == [("Stayed Away", "2025-10-05", 12)]
+    finally:
+        conn.close()
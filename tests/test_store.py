@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import threading
+
+import archive
+import database
+from store import Store
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+def test_backup_while_saving(tmp_path):
+    store = Store(str(tmp_path / "shop.db"))
+    stop = threading.Event()
+    
+    def save_customers():
+        i = 0
+        while not stop.is_set():
+            store.save_customer(f"Customer {i}", f"9{i:09d}", "2024-01-01", PRESCRIPTION, PRODUCT,
+                                durable=False).result()
+            i += 1
+    
+    saver = threading.Thread(target=save_customers)
+    saver.start()
+    try:
+        paths = [store.backup(str(tmp_path / "backups")) for _ in range(3)]
+    finally:
+        stop.set()
+        saver.join()
+        store.close()
+    
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+            customers, prescriptions, products = (
+                conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("customers", "prescriptions", "products"))
+            assert customers == prescriptions == products
+        finally:
+            conn.close()
+
+
+def test_restore_backup_made_before_archive_run(tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    store = Store(str(tmp_path / "shop.db"))
+    try:
+        for name, visit_date in [("Old Customer", "2019-01-01"), ("Recent Customer", "2026-10-01")]:
+            store.save_customer(name, "", visit_date, PRESCRIPTION, PRODUCT).result(5)
+        backup_path = store.backup(backup_dir)
+        
+        conn = database.connect(store.db_path)
+        try:
+            assert archive.archive_customers_before(conn, "2024-01-01") == 1
+        finally:
+            conn.close()
+        store.save_customer("After Backup", "", "2026-10-02", PRESCRIPTION, PRODUCT).result(5)
+        
+        store.restore(backup_path, backup_dir)
+        
+        # The old customer is live again and no longer archived
+        assert store.archive_counts() == (2, 0)
+        names = sorted(row[1] for row in store.page(include_archive=True))
+        assert names == ["Old Customer", "Recent Customer"]
+        # The safety copy covers the archive too
+        saved = os.listdir(backup_dir)
+        for prefix in ("pre_restore_", "archive_backup_"):
+            assert any(name.startswith(prefix) for name in saved)
+        
+        # The writer runs again once the restore is done
+        store.save_customer("After Restore", "", "2026-10-03", PRESCRIPTION, PRODUCT).result(5)
+        assert store.archive_counts() == (3, 0)
+    finally:
+        store.close()
@@ -0,0 +1,30 @@
+import time
+
+from ui_watchdog import StallWatchdog
+
+
+class FakeRoot:
+    """A Tk root whose event loop never runs, so every heartbeat is late"""
+    
+    def after(self, ms, func):
+        return None
+    
+    def after_cancel(self, after_id):
+        pass
+
+
+def test_unfinished_stall_is_logged(tmp_path):
+    log_path = tmp_path / "stall_log.txt"
+    watchdog = StallWatchdog(FakeRoot(), str(log_path), threshold=0.1, interval=0.05)
+    watchdog.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not log_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        watchdog.stop()
+    
+    text = log_path.read_text(encoding="utf-8")
+    assert "Stall at" in text
+    assert "Main thread stack:" in text
+    assert "test_unfinished_stall_is_logged" in text
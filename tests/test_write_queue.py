@@ -0,0 +1,41 @@
+import threading
+
+import database
+from write_queue import WriteQueue
+
+PRESCRIPTION = {"right_sph": "-1.25", "left_sph": "-1.00"}
+PRODUCT = {"frame_name": "Frame", "lens_name": "Lens", "frame_paise": 150000, "lens_paise": 80000}
+
+
+def test_cancelled_save_is_skipped(tmp_path):
+    db_path = str(tmp_path / "shop.db")
+    database.open_database(db_path).close()
+    writes = WriteQueue(db_path)
+    
+    # Hold the writer so the next saves wait in the queue
+    running = threading.Event()
+    release = threading.Event()
+    
+    def hold(cursor):
+        running.set()
+        release.wait(5)
+    blocked = writes.submit(hold)
+    assert running.wait(5)
+    cancelled = writes.save_customer("Gone", "9000000001", "2024-01-01", PRESCRIPTION, PRODUCT)
+    kept = writes.save_customer("Kept", "9000000002", "2024-01-01", PRESCRIPTION, PRODUCT)
+    assert cancelled.cancel()
+    release.set()
+    
+    try:
+        blocked.result(5)
+        assert kept.result(5)
+        writes.flush(5)  # The writer thread is still running
+    finally:
+        writes.close()
+    
+    conn = database.connect(db_path)
+    try:
+        names = [row[0] for row in conn.execute("SELECT name FROM customers")]
+    finally:
+        conn.close()
+    assert names == ["Kept"]
@@ -0,0 +1,182 @@
+"""
+Storage tuning for Shivam Opticals connections.
+
+SQLite's defaults (a 2 MB page cache, no memory mapping, temp tables on disk)
+suit small databases. ``database.connect`` calls ``apply_tuning`` on every
+connection, which sizes the settings from the database file and the memory
+currently available:
+
+* ``cache_size``  - a quarter of the database, 8-256 MB, at most 1/16 of
+  free memory (each connection has its own cache)
+* ``mmap_size``   - map the database into memory when there is room, so reads
+  come straight from the OS file cache instead of being copied
+* ``temp_store``  - sorts and temp indexes in memory when at least 2 GB is free
+* ``synchronous`` - NORMAL, which is safe under WAL (the write queue still
+  asks for FULL on durable commits)
+
+Run ``python tuning.py --bench 200000`` to compare profiles on the customer
+list, search and export workloads.
+"""
+import argparse
+import ctypes
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+MIN_CACHE = 8 * MB
+MAX_CACHE = 256 * MB
+MAX_MMAP = 2 * GB
+
+# Assumed when the platform does not tell us
+FALLBACK_AVAILABLE_MEMORY = 1 * GB
+
+
+def available_memory():
+    """Bytes of physical memory currently available"""
+    try:
+        if sys.platform == "win32":
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+        elif os.path.exists("/proc/meminfo"):
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        else:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    return FALLBACK_AVAILABLE_MEMORY
+
+
+def choose_settings(db_size, free_memory):
+    """PRAGMA values for a database of db_size bytes"""
+    cache = min(max(db_size // 4, MIN_CACHE), MAX_CACHE, max(free_memory // 16, MIN_CACHE))
+    
+    # Memory mapping needs address space (64-bit Python) and spare memory
+    mmap = 0
+    if sys.maxsize > 2 ** 32 and free_memory >= 1 * GB:
+        mmap = min(MAX_MMAP, free_memory // 4)
+    
+    return {
+        "cache_size": -(cache // 1024),  # Negative: size in KiB rather than pages
+        "mmap_size": mmap,
+        "temp_store": "MEMORY" if free_memory >= 2 * GB else "DEFAULT",
+        "synchronous": "NORMAL",
+    }
+
+
+def settings_for(db_path):
+    """Adaptive settings for the database at db_path"""
+    try:
+        db_size = os.path.getsize(db_path)
+    except OSError:
+        db_size = 0
+    return choose_settings(db_size, available_memory())
+
+
+def apply_settings(conn, settings):
+    for name, value in settings.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def apply_tuning(conn, db_path, read_only=False):
+    """Apply the adaptive settings to a new connection; returns them"""
+    settings = settings_for(db_path)
+    if read_only:
+        settings.pop("synchronous")
+    apply_settings(conn, settings)
+    return settings
+
+
+# Fixed profiles compared by the benchmark
+PROFILES = {
+    "default": {},
+    "small": {"cache_size": -(MIN_CACHE // 1024), "mmap_size": 0, "temp_store": "DEFAULT",
+              "synchronous": "NORMAL"},
+    "large": {"cache_size": -(MAX_CACHE // 1024), "mmap_size": MAX_MMAP, "temp_store": "MEMORY",
+              "synchronous": "NORMAL"},
+}
+
+
+def benchmark(count=200000, repeats=3):
+    """Time list, search and export workloads under each profile"""
+    import random
+    
+    import database
+    import exporters
+    
+    rng = random.Random(7)
+    names = ["Sharma", "Kumar", "Verma", "Gupta", "Singh", "Patel", "Reddy", "Iyer", "Das", "Khan"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        conn = database.open_database(path)
+        cursor = conn.cursor()
+        for i in range(count):
+            database.insert_customer(
+                cursor, f"{rng.choice(names)} {i}", f"9{rng.randrange(10 ** 9):09d}",
+                f"20{rng.randrange(15, 25)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+                {"right_sph": "-1.25", "left_sph": "-1.00"},
+                {"frame_name": f"Frame {rng.randrange(300)}", "lens_name": "Lens",
+                 "frame_paise": 150000, "lens_paise": 80000})
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        print(f"{count} customers, {os.path.getsize(path) / MB:.0f} MB, "
+              f"{available_memory() / GB:.1f} GB available")
+        
+        def list_pages(conn):
+            after = None
+            for _ in range(20):
+                rows = database.query_customer_list(conn.cursor(), "", 200, after, "name", False)
+                after = database.list_cursor(rows[-1], "name")
+        
+        def search(conn):
+            database.query_customer_list(conn.cursor(), "kumar", sort="date")
+        
+        def export(conn):
+            with database.read_snapshot(conn):
+                exporters.read_export(conn)
+        
+        profiles = dict(PROFILES, adaptive=settings_for(path))
+        for name, settings in profiles.items():
+            timings = []
+            for workload in (list_pages, search, export):
+                best = None
+                for _ in range(repeats):
+                    conn = sqlite3.connect(path)
+                    apply_settings(conn, settings)
+                    start = time.perf_counter()
+                    workload(conn)
+                    elapsed = time.perf_counter() - start
+                    conn.close()
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+            print(f"{name:9} list {timings[0] * 1000:8.1f} ms   search {timings[1] * 1000:8.1f} ms   "
+                  f"export {timings[2] * 1000:8.1f} ms   {settings or '(SQLite defaults)'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Connection tuning")
+    parser.add_argument("--bench", type=int, metavar="COUNT", help="Benchmark profiles with COUNT customers")
+    parser.add_argument("--show", metavar="DB", help="Print the settings chosen for a database file")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.bench)
+    elif args.show:
+        print(settings_for(args.show))
+    else:
+        parser.print_help()
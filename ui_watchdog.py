@@ -0,0 +1,164 @@
+"""
+Event-loop stall watchdog for the Shivam Opticals Tk interface.
+
+A heartbeat is scheduled on the Tk main loop with ``root.after``. A background
+thread checks how late the heartbeat is; when the main loop has not run for
+longer than the threshold, the main thread's stack is captured with
+``sys._current_frames()`` and written to a log file straight away, so a
+hang that never recovers is still recorded; the duration is added when the
+loop recovers.
+"""
+import logging
+import os
+import sys
+import time
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+
+class StallWatchdog:
+    """Detect main-loop stalls and record which handler was running"""
+    
+    def __init__(self, root, log_path, handler_names=None, source_file=None,
+                 threshold=0.5, interval=0.1):
+        self.root = root
+        self.log_path = log_path
+        self.handler_names = set(handler_names or [])
+        self.source_file = os.path.abspath(source_file) if source_file else None
+        self.threshold = threshold  # Seconds of lateness before a stall is recorded
+        self.interval = interval  # Seconds between heartbeats
+        
+        self.main_thread_id = threading.main_thread().ident
+        self._last_beat = time.monotonic()
+        self._lock = threading.Lock()
+        self._running = False
+        self._after_id = None
+        self._thread = None
+        
+        # Stall currently in progress (captured but not yet finished)
+        self._current = None
+        
+        # Summary statistics
+        self.stall_count = 0
+        self.worst_latency = 0.0
+        self.last_stall = None
+        self.handler_counts = {}
+    
+    def start(self):
+        """Start the heartbeat and the monitoring thread"""
+        if self._running:
+            return
+        self._running = True
+        self._last_beat = time.monotonic()
+        self._after_id = self.root.after(int(self.interval * 1000), self._beat)
+        
+        self._thread = threading.Thread(target=self._monitor, name="StallWatchdog")
+        self._thread.daemon = True  # Thread will exit when main program exits
+        self._thread.start()
+    
+    def stop(self):
+        """Stop monitoring"""
+        self._running = False
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+    
+    def _beat(self):
+        """Heartbeat executed on the Tk thread"""
+        self._last_beat = time.monotonic()
+        if self._running:
+            self._after_id = self.root.after(int(self.interval * 1000), self._beat)
+    
+    def _monitor(self):
+        """Background loop measuring heartbeat lateness"""
+        while self._running:
+            time.sleep(self.interval / 2)
+            
+            lateness = time.monotonic() - self._last_beat - self.interval
+            
+            if lateness > self.threshold:
+                if self._current is None:
+                    # Stall just crossed the threshold - capture what is running
+                    self._current = self._capture(lateness)
+                    self._write_start(self._current)
+                else:
+                    self._current['latency'] = lateness
+            elif self._current is not None:
+                # Main loop recovered - finish the stall record
+                stall = self._current
+                self._current = None
+                self._finish(stall)
+    
+    def _capture(self, lateness):
+        """Capture the main thread's stack and the handler it is executing"""
+        frame = sys._current_frames().get(self.main_thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        handler = self._find_handler(frame)
+        
+        return {
+            'started': datetime.now() - timedelta(seconds=lateness + self.interval),
+            'latency': lateness,
+            'handler': handler,
+            'stack': stack,
+        }
+    
+    def _find_handler(self, frame):
+        """Return the outermost application handler on the stack"""
+        handler = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name in self.handler_names and (
+                    self.source_file is None or
+                    os.path.abspath(code.co_filename) == self.source_file):
+                handler = code.co_name
+            frame = frame.f_back
+        return handler or "<unknown>"
+    
+    def _write_start(self, stall):
+        """Append the captured handler and stack to the log"""
+        log.warning("UI stall started", extra={"fields": {"handler": stall['handler']}})
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write("=" * 60 + "\n")
+                log_file.write(f"Stall at {stall['started'].strftime('%Y-%m-%d %H:%M:%S')}\n")
+                log_file.write(f"Handler: {stall['handler']}\n")
+                log_file.write("Main thread stack:\n")
+                log_file.writelines(stall['stack'])
+        except Exception:
+            log.exception("Error writing stall log")
+    
+    def _finish(self, stall):
+        """Update statistics and append the stall's duration to the log"""
+        with self._lock:
+            self.stall_count += 1
+            self.worst_latency = max(self.worst_latency, stall['latency'])
+            self.last_stall = stall
+            handler = stall['handler']
+            self.handler_counts[handler] = self.handler_counts.get(handler, 0) + 1
+        log.warning("UI stall", extra={"fields": {
+            "handler": handler, "latency_ms": round(stall['latency'] * 1000)}})
+        
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(f"Stall at {stall['started'].strftime('%Y-%m-%d %H:%M:%S')} ended after "
+                               f"{stall['latency'] * 1000:.0f} ms ({stall['handler']})\n")
+        except Exception:
+            log.exception("Error writing stall log")
+    
+    def summary(self):
+        """Return a snapshot of the stall statistics"""
+        with self._lock:
+            return {
+                'count': self.stall_count,
+                'worst_ms': self.worst_latency * 1000,
+                'last_handler': self.last_stall['handler'] if self.last_stall else None,
+                'last_time': self.last_stall['started'] if self.last_stall else None,
+                'by_handler': dict(self.handler_counts),
+            }
+